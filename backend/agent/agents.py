@@ -1,13 +1,28 @@
-from langchain_core.messages import HumanMessage, SystemMessage
+from typing import Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.prebuilt import create_react_agent
 
 from tools import search_places, research_place
 from state import TravelState
+from models import model_for
+from runs import UpstreamTimeout, emit_event
+from speculation import drafter
+from place_registry import place_registry, researched_places_of
+from relevance import rank_places
+from itinerary import (
+    DayPlan, ItineraryDraft, ItineraryPatch, PatchOp,
+    apply_patch, full_patch, new_plan, outline, render_days, render_plan, resolve_patch,
+)
 
-# 1. Setup LLM
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0)
+# 1. Setup LLMs
+# Each node gets the model, timeout and fallback configured in MODEL_REGISTRY
+supervisor_llm = model_for("supervisor")
+search_llm = model_for("search")
+research_llm = model_for("research")
+itinerary_llm = model_for("itinerary")
 
 # 2. Define Helper to Create Agents
 def create_agent(llm, tools, system_prompt: str):
@@ -19,11 +34,31 @@ def create_agent(llm, tools, system_prompt: str):
     # We must pass the state_schema so the agent knows about our custom fields (budget, places, etc.)
     return create_react_agent(llm, tools, prompt=system_prompt, state_schema=TravelState)
 
+def invoke_until_deadline(agent, state: dict) -> Tuple[dict, bool]:
+    """
+    Runs a ReAct agent and returns its final state, and whether the deadline
+    cut it short. On UpstreamTimeout (e.g. during the agent's last model
+    turn) the state after its last completed step is returned instead, so
+    the tool results it already has (found or researched places) are kept.
+    """
+    result = state
+    try:
+        for result in agent.stream(state, stream_mode="values"):
+            pass
+    except UpstreamTimeout:
+        result = dict(result)
+        messages = result.get("messages", [])
+        if messages and getattr(messages[-1], "tool_calls", None):
+            # Its tool calls never ran; unanswered calls would break the next model turn
+            result["messages"] = messages[:-1]
+        return result, True
+    return result, False
+
 # 3. Define the Specialized Agents (Workers)
 
 # --- Search Agent ---
 search_agent = create_agent(
-    llm, 
+    search_llm, 
     [search_places],  # Only search for places, no flight searches needed
     system_prompt="""You are a Travel Discovery Agent specializing in finding diverse locations.
 
@@ -58,7 +93,18 @@ Remember: Give users many options to choose from!
 
 def search_node(state: TravelState) -> dict:
     """Entry point for the Search Agent."""
-    result = search_agent.invoke(state)
+    result, timed_out = invoke_until_deadline(search_agent, state)
+    if timed_out:
+        found = len(result.get("found_places", []))
+        print(f"⏱️ Search agent ran out of time; keeping {found} places found so far")
+        result["messages"] = list(result.get("messages", [])) + [AIMessage(content=(
+            f"I ran out of time before finishing the search, but found {found} places so far. "
+            "Select the ones you'd like me to research, or ask me to search again."
+        ))]
+    # Parallel searches each ranked only their own results; order the union as a whole
+    found = result.get("found_places", [])
+    ranked = rank_places(state.get("user_description", ""), place_registry.hydrate(found), min_score=0, max_places=0)
+    result["found_places"] = list(dict.fromkeys([place["id"] for place, _ in ranked] + found))
     # Update workflow stage to indicate we're waiting for user selection
     result["workflow_stage"] = "select_locations"
     return result
@@ -66,7 +112,7 @@ def search_node(state: TravelState) -> dict:
 
 # --- Research Agent ---
 research_agent = create_agent(
-    llm,
+    research_llm,
     [research_place],
     system_prompt="""You are a Travel Research Agent. Conduct thorough research and provide COMPREHENSIVE, DETAILED information.
 
@@ -95,14 +141,15 @@ def research_node(state: TravelState) -> dict:
     """Entry point for the Research Agent. Performs parallel research on selected places."""
     # Get selected place IDs from state
     selected_places = state.get("selected_places", [])
-    found_places = state.get("found_places", [])
     
     # Build a mapping of IDs to names for better context
     place_details = []
     for place_id in selected_places:
-        place = next((p for p in found_places if p.get("id") == place_id), None)
+        place = place_registry.get(place_id)
         if place:
-            place_details.append(f"- {place_id}: {place.get('name', 'Unknown')}")
+            place_details.append(f"- {place_id}: {place.name}")
+        else:
+            print(f"⚠️ Selected place {place_id} is no longer in the place registry; skipping its research")
     
     # Create an explicit message with the place IDs to research
     research_instruction = (
@@ -118,85 +165,195 @@ def research_node(state: TravelState) -> dict:
     state_with_instruction = dict(state)
     state_with_instruction["messages"] = state["messages"] + [HumanMessage(content=research_instruction)]
     
-    result = research_agent.invoke(state_with_instruction)
+    result, timed_out = invoke_until_deadline(research_agent, state_with_instruction)
+    if timed_out:
+        researched = {p["id"] for p in result.get("researched_places", [])} & set(selected_places)
+        print(f"⏱️ Research agent ran out of time after researching {len(researched)}/{len(selected_places)} places")
+        result["messages"] = list(result.get("messages", [])) + [AIMessage(content=(
+            f"I ran out of time and could only research {len(researched)} of the {len(selected_places)} places "
+            "you selected; their reports are in the research panel. Choose one for your itinerary, "
+            "or select places again to research the rest."
+        ))]
     # Update workflow stage to indicate we're waiting for user to choose locations
     result["workflow_stage"] = "choose_locations"
     return result
 
 
 # --- Itinerary Agent (Planner) ---
-itinerary_agent = create_agent(
-    llm,
-    [],  # No tools needed - just planning and recommendations
-    system_prompt="""You are the Itinerary Planning Agent. Create detailed travel plans based on user preferences.
-
-Your Tasks:
-1. **Initial Itinerary**: Create a comprehensive day-by-day plan with accommodations, activities, dining, and costs
-2. **Adjustments**: When user requests changes, MODIFY the previous itinerary based on their feedback
-   - Read their adjustment request carefully
-   - Make SPECIFIC changes they asked for
-   - Keep parts they didn't mention changing
-   - Explain what you changed
-
-Important:
-- When adjusting, DO NOT just repeat the same itinerary
-- Actually implement the changes the user requested
-- If they say "add more activities" - ADD MORE, don't keep the same
-- If they say "change hotel to budget" - CHANGE IT to a budget option
-- If they say "extend to 3 days" - ADD another day
+# The itinerary is kept as structured, day-indexed data in itinerary_plan.
+# Adjustments are planned as a patch, and only the affected days are regenerated.
+ITINERARY_SYSTEM_PROMPT = """You are the Itinerary Planning Agent. Create detailed travel plans based on user preferences.
+
+Plan each day as morning, afternoon and evening slots covering activities, dining and transportation,
+with where to stay each night. Give every slot an estimated cost in USD.
 
 Always include cost estimates and stay within budget.
 """
-)
 
-def itinerary_node(state: TravelState) -> dict:
+PATCH_SYSTEM_PROMPT = """You turn a traveller's feedback on their itinerary into the smallest set of day changes.
+
+- replace_day: regenerate an existing day; put the specific changes into instructions
+- add_day: insert a new day at the given position; describe what it should contain
+- remove_day: drop an existing day
+
+Only touch days the feedback affects. Feedback that applies to the whole trip (e.g. "cheaper hotels")
+becomes a replace_day for every day. Day numbers refer to the current itinerary.
+"""
+
+itinerary_writer = itinerary_llm.with_structured_output(ItineraryDraft)
+day_writer = itinerary_llm.with_structured_output(DayPlan)
+patch_planner = itinerary_llm.with_structured_output(ItineraryPatch)
+
+def build_itinerary_instruction(state: TravelState, chosen_place_id: str | None) -> str:
+    """Builds the request that asks the itinerary agent for the initial plan around the chosen place."""
+    researched_places = researched_places_of(state)
+    remaining_budget = state.get("remaining_budget", 0)
+    
+    # Get details of the chosen location
+    if chosen_place_id:
+        chosen_place = next((p for p in researched_places if p.get("id") == chosen_place_id), None)
+        
+        if chosen_place:
+            return (
+                f"I have selected {chosen_place.get('name', 'this location')} for my trip. "
+                f"My budget is ${remaining_budget:.2f}. "
+                f"Please create a detailed day-by-day itinerary with recommendations for accommodation, "
+                f"activities, dining, and transportation. Include estimated costs for everything!"
+            )
+        return (
+            f"I have selected a location (ID: {chosen_place_id}) for my trip. "
+            f"My budget is ${remaining_budget:.2f}. "
+            f"Please create a detailed itinerary with cost estimates."
+        )
+    return (
+        f"Please create a detailed itinerary for the selected location. "
+        f"My budget is ${remaining_budget:.2f}."
+    )
+
+def generate_itinerary(state: TravelState, chosen_place_id: str | None) -> dict:
+    """
+    Generates the initial itinerary for the chosen place. Returns the state
+    update: the request and the rendered plan as messages, and the plan.
+    Speculative drafts use the same function ahead of the user's choice.
+    """
+    instruction = HumanMessage(content=build_itinerary_instruction(state, chosen_place_id))
+    draft = itinerary_writer.invoke(
+        [SystemMessage(content=ITINERARY_SYSTEM_PROMPT)] + state.get("messages", []) + [instruction]
+    )
+    chosen_place = place_registry.get(chosen_place_id) if chosen_place_id else None
+    destination = chosen_place.name if chosen_place else state.get("current_location", "")
+    plan = new_plan(destination, draft)
+    return {
+        "messages": [instruction, AIMessage(content=render_plan(plan))],
+        "itinerary_plan": plan,
+    }
+
+def day_request(plan: dict, op: PatchOp, target: dict | None, remaining_budget: float) -> str:
+    """Context for regenerating or adding one day: the trip outline, the day itself and the change."""
+    if target is not None:
+        day_text = f"Regenerate Day {target['day']}. Current version:\n{render_days([target])}"
+    else:
+        day_text = f"Write a new day to insert as Day {op.day}."
+    return (
+        f"Trip to {plan['destination']}, budget ${remaining_budget:.2f}, "
+        f"currently ${plan['total_cost']:.2f} in total.\n"
+        f"Itinerary outline:\n{outline(plan)}\n\n"
+        f"{day_text}\n\nChanges requested: {op.instructions}"
+    )
+
+def adjust_itinerary(state: TravelState) -> Tuple[dict, dict]:
+    """
+    Applies the user's latest feedback to the itinerary as a patch.
+    Only the affected days are sent to and regenerated by the model, so the
+    cost grows with the size of the change rather than the trip.
+    Returns the state update and the patch to stream to the client.
+    """
+    plan = state["itinerary_plan"]
+    remaining_budget = state.get("remaining_budget", 0)
+    feedback = next((str(m.content) for m in reversed(state.get("messages", [])) if m.type == "human"), "")
+
+    patch = patch_planner.invoke([
+        SystemMessage(content=PATCH_SYSTEM_PROMPT),
+        HumanMessage(content=f"Current itinerary for {plan['destination']}:\n{outline(plan)}\n\nFeedback: {feedback}"),
+    ])
+    resolved = resolve_patch(plan, patch)
+    if not resolved:
+        # Nothing specific was identified, so apply the feedback to every day
+        resolved = [(PatchOp(op="replace_day", day=day["day"], instructions=feedback), day) for day in plan["days"]]
+
+    # Affected days are regenerated concurrently
+    to_write = [(op, target) for op, target in resolved if op.op != "remove_day"]
+    written = iter(day_writer.batch([
+        [SystemMessage(content=ITINERARY_SYSTEM_PROMPT), HumanMessage(content=day_request(plan, op, target, remaining_budget))]
+        for op, target in to_write
+    ]) if to_write else [])
+    changes = [(op, target, None if op.op == "remove_day" else next(written)) for op, target in resolved]
+    new, client_patch = apply_patch(plan, changes)
+
+    summary = []
+    for op, target in resolved:
+        if op.op == "remove_day":
+            summary.append(f"removed Day {op.day} ({target['title']})")
+        elif op.op == "replace_day":
+            summary.append(f"updated Day {op.day}")
+        else:
+            summary.append(f"added a day at position {op.day}")
+    # The whole plan, so the chat always shows the current itinerary, with the changed days marked
+    changed = {day["id"] for day in client_patch["days"]}
+    content = f"I {', '.join(summary)}. Here is your updated itinerary:\n\n{render_plan(new, changed)}"
+
+    return {"messages": [AIMessage(content=content)], "itinerary_plan": new}, client_patch
+
+def itinerary_node(state: TravelState, config: RunnableConfig) -> dict:
     """Entry point for the Itinerary Agent."""
-    # Check if this is an adjustment request by looking at the last message
-    messages = state.get("messages", [])
     workflow_stage = state.get("workflow_stage", "")
     
     # If workflow_stage is already review_itinerary, this is an adjustment request
-    is_adjustment = workflow_stage == "review_itinerary"
+    is_adjustment = workflow_stage == "review_itinerary" and state.get("itinerary_plan")
     
     if is_adjustment:
-        # For adjustments, the user's message is already in the state
-        # Just invoke the agent directly - it will see the conversation history
-        result = itinerary_agent.invoke(state)
+        try:
+            result, patch = adjust_itinerary(state)
+        except UpstreamTimeout:
+            # Keep the plan the user already has rather than failing the step
+            print("⏱️ Itinerary model timed out; keeping the current plan")
+            return {
+                "messages": [AIMessage(content=(
+                    "I couldn't adjust your itinerary in time, so it is unchanged. Please try again.\n\n"
+                    + render_plan(state["itinerary_plan"])
+                ))],
+                "workflow_stage": "review_itinerary",
+            }
     else:
         # This is the initial itinerary creation
         selected_places = state.get("selected_places", [])
-        researched_places = state.get("researched_places", [])
-        remaining_budget = state.get("remaining_budget", 0)
-        
-        # Get details of the chosen location
-        if selected_places and len(selected_places) > 0:
-            chosen_place_id = selected_places[0]  # Should be only ONE location at this stage
-            chosen_place = next((p for p in researched_places if p.get("id") == chosen_place_id), None)
-            
-            if chosen_place:
-                itinerary_instruction = (
-                    f"I have selected {chosen_place.get('name', 'this location')} for my trip. "
-                    f"My budget is ${remaining_budget:.2f}. "
-                    f"Please create a detailed day-by-day itinerary with recommendations for accommodation, "
-                    f"activities, dining, and transportation. Include estimated costs for everything!"
-                )
-            else:
-                itinerary_instruction = (
-                    f"I have selected a location (ID: {chosen_place_id}) for my trip. "
-                    f"My budget is ${remaining_budget:.2f}. "
-                    f"Please create a detailed itinerary with cost estimates."
-                )
-        else:
-            itinerary_instruction = (
-                f"Please create a detailed itinerary for the selected location. "
-                f"My budget is ${remaining_budget:.2f}."
-            )
+        chosen_place_id = selected_places[0] if selected_places else None  # Should be only ONE location at this stage
         
-        # Add explicit instruction as a human message
-        state_with_instruction = dict(state)
-        state_with_instruction["messages"] = state["messages"] + [HumanMessage(content=itinerary_instruction)]
+        # A speculative draft for the chosen place answers without a new generation
+        thread_id = config.get("configurable", {}).get("thread_id")
+        result = None
+        if thread_id and chosen_place_id:
+            result = drafter.take(thread_id, chosen_place_id, state.get("remaining_budget", 0))
+            if result:
+                print(f"⚡ Using speculative itinerary draft for {chosen_place_id}")
         
-        result = itinerary_agent.invoke(state_with_instruction)
+        if not result:
+            try:
+                result = generate_itinerary(state, chosen_place_id)
+            except UpstreamTimeout:
+                # No plan yet: stay at the choice so the user can ask again
+                print("⏱️ Itinerary model timed out before the first plan")
+                return {
+                    "messages": [AIMessage(content=(
+                        "I couldn't put your itinerary together in time. "
+                        "Please choose the place again and I'll retry."
+                    ))],
+                    "workflow_stage": "choose_locations",
+                }
+        patch = full_patch(result["itinerary_plan"])
+    
+    # Only the changed days go to the client's itinerary view
+    emit_event({"type": "itinerary_patch", "data": patch})
     
     # Mark workflow stage as review_itinerary so user can provide feedback
     result["workflow_stage"] = "review_itinerary"
@@ -260,11 +417,31 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 ).partial(options=str(options), members=", ".join(members))
 
+def route_from_stage(state: TravelState) -> str:
+    """
+    Applies the supervisor's decision rules directly from workflow_stage.
+    Used as the supervisor's answer when its model misses the deadline.
+    """
+    stage = state.get("workflow_stage", "")
+    selected_places = state.get("selected_places", [])
+    messages = state.get("messages", [])
+    has_new_feedback = bool(messages) and messages[-1].type == "human"
+
+    if stage in ("", "init", "search"):
+        return "Search_Agent"
+    if stage == "select_locations":
+        return "Research_Agent" if selected_places else "FINISH"
+    if stage == "choose_locations":
+        return "Itinerary_Agent" if len(selected_places) == 1 else "FINISH"
+    if stage == "review_itinerary":
+        return "Itinerary_Agent" if has_new_feedback else "FINISH"
+    return "FINISH"
+
 def supervisor_node(state: TravelState) -> dict:
     """
     The Supervisor decides which agent goes next.
     """
-    supervisor_chain = prompt | llm.with_structured_output(
+    supervisor_chain = prompt | supervisor_llm.with_structured_output(
         {
             "name": "route",
             "description": "Select the next role.",
@@ -281,5 +458,10 @@ def supervisor_node(state: TravelState) -> dict:
         }
     )
     
-    result = supervisor_chain.invoke(state)
+    try:
+        result = supervisor_chain.invoke(state)
+    except UpstreamTimeout:
+        next_agent = route_from_stage(state)
+        print(f"⏱️ Supervisor model timed out; routing by stage to {next_agent}")
+        return {"next": next_agent}
     return {"next": result["next"]}
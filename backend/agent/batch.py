@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import time
+from typing import AsyncGenerator, List, Literal
+
+from langchain_core.messages import HumanMessage
+from pydantic import BaseModel
+
+from deadlines import deadline_in
+from graph import app as agent_graph
+from jobs import graph_jobs
+from place_registry import found_places_of, researched_places_of
+from ratelimit import request_priority
+from runs import RunContext, UpstreamTimeout, current_run, runs
+from sessions import build_resume_update
+
+# Stages at which the graph pauses for a human decision
+HITL_STAGES = ["select_locations", "choose_locations", "review_itinerary"]
+
+# Time budget for one batch trip across all of its steps, from when a worker starts it
+BATCH_TRIP_SECONDS = float(os.environ.get("BATCH_TRIP_SECONDS", 300))
+
+# How long past its deadline a trip may go on before it is abandoned
+TRIP_GRACE_SECONDS = 5.0
+
+
+class SelectionPolicy(BaseModel):
+    """
+    Decides on behalf of the user at each HITL pause of a batch run.
+    """
+    strategy: Literal["top_k"] = "top_k"
+    k: int = 3                 # Places sent to research
+    min_rating: float = 0.0    # Ignore places rated below this
+
+    def pick_for_research(self, found_places: List[dict]) -> List[str]:
+        """Selects the top-k found places by rating."""
+        candidates = [p for p in found_places if (p.get("rating") or 0) >= self.min_rating]
+        candidates.sort(key=lambda p: p.get("rating") or 0, reverse=True)
+        return [p["id"] for p in candidates[: self.k]]
+
+    def pick_for_itinerary(self, researched_places: List[dict]) -> List[str]:
+        """Selects the single best researched place by rating."""
+        if not researched_places:
+            return []
+        best = max(researched_places, key=lambda p: p.get("rating") or 0)
+        return [best["id"]]
+
+
+async def run_trip(
+    initial_state: dict,
+    thread_id: str,
+    policy: SelectionPolicy,
+    stop_at: str | None = None,
+    deadline_at: float | None = None,
+) -> dict:
+    """
+    Runs one trip through the graph, auto-advancing the HITL interrupts with
+    the selection policy, and stops once the first itinerary is ready (or
+    earlier, on reaching the `stop_at` stage). Every step sizes its
+    timeouts from the trip's `deadline_at`.
+    """
+    config = {"configurable": {"thread_id": thread_id, "deadline_at": deadline_at}}
+    # Batch work yields upstream quota to interactive sessions
+    request_priority.set("batch")
+    await agent_graph.ainvoke(initial_state, config)
+
+    # One resume per HITL stage at most; stop if a resume makes no progress
+    for _ in range(len(HITL_STAGES)):
+        snapshot = await agent_graph.aget_state(config)
+        stage = snapshot.values.get("workflow_stage", "")
+
+        if stage == stop_at:
+            break
+        if stage == "select_locations":
+            action = "research"
+            selected = policy.pick_for_research(found_places_of(snapshot.values))
+        elif stage == "choose_locations":
+            action = "plan_itinerary"
+            selected = policy.pick_for_itinerary(researched_places_of(snapshot.values))
+        else:
+            break
+
+        if not selected:
+            break
+
+        updates, message = build_resume_update(action, selected)
+        await agent_graph.aupdate_state(config, {**updates, "messages": [HumanMessage(content=message)]})
+        await agent_graph.ainvoke(None, config)
+
+        snapshot = await agent_graph.aget_state(config)
+        if snapshot.values.get("workflow_stage", "") == stage:
+            break
+
+    return _summarize(snapshot.values)
+
+
+def _summarize(values: dict) -> dict:
+    """Extracts the batch result fields from the final graph state."""
+    stage = values.get("workflow_stage", "")
+    itinerary_text = ""
+    if stage == "review_itinerary":
+        ai_messages = [m for m in values.get("messages", []) if m.type == "ai" and m.content and not getattr(m, "tool_calls", None)]
+        if ai_messages:
+            itinerary_text = str(ai_messages[-1].content)
+
+    return {
+        "status": "complete" if itinerary_text else "incomplete",
+        "stage": stage,
+        "found_places": len(values.get("found_places", [])),
+        "researched_places": [
+            {"id": p.get("id"), "name": p.get("name"), "rating": p.get("rating")}
+            for p in researched_places_of(values)
+        ],
+        "selected_places": values.get("selected_places", []),
+        "remaining_budget": values.get("remaining_budget"),
+        "itinerary": itinerary_text,
+        "itinerary_plan": values.get("itinerary_plan"),
+    }
+
+
+async def _run_on_worker(
+    initial_state: dict, thread_id: str, policy: SelectionPolicy, stop_at: str | None, run: RunContext
+) -> dict:
+    """Runs a trip on a graph-job worker, within BATCH_TRIP_SECONDS of starting."""
+    current_run.set(run)
+    deadline_at = deadline_in(BATCH_TRIP_SECONDS)
+    try:
+        return await asyncio.wait_for(
+            run_trip(initial_state, thread_id, policy, stop_at, deadline_at), BATCH_TRIP_SECONDS + TRIP_GRACE_SECONDS
+        )
+    except asyncio.TimeoutError as e:
+        if isinstance(e, UpstreamTimeout):
+            raise
+        runs.cancel_run(run)
+        print(f"⏱️ Batch trip {thread_id} passed its deadline")
+        return {"status": "error", "error": f"Trip took longer than {BATCH_TRIP_SECONDS:.0f}s"}
+
+
+async def run_batch(
+    initial_states: List[dict],
+    thread_ids: List[str],
+    policy: SelectionPolicy,
+    concurrency: int,
+    stop_at: str | None = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Runs trips on the graph-job pool with at most `concurrency` in flight,
+    starting each only when a slot frees up, and yields one NDJSON line per
+    trip, in completion order.
+    """
+    async def run_one(index: int) -> dict:
+        thread_id = thread_ids[index]
+        started = time.monotonic()
+        run = runs.start(thread_id)
+        try:
+            result = await graph_jobs.run(
+                lambda: _run_on_worker(initial_states[index], thread_id, policy, stop_at, run)
+            )
+        except asyncio.CancelledError:
+            runs.cancel_run(run)
+            raise
+        except Exception as e:
+            print(f"Batch trip {thread_id} failed: {e}")
+            result = {"status": "error", "error": str(e)}
+        finally:
+            runs.finish(run)
+        return {
+            "index": index,
+            "thread_id": thread_id,
+            "location": initial_states[index].get("current_location"),
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+            **result,
+        }
+
+    waiting = iter(range(len(initial_states)))
+    running = set()
+    try:
+        while True:
+            for index in waiting:
+                running.add(asyncio.create_task(run_one(index)))
+                if len(running) >= concurrency:
+                    break
+            if not running:
+                return
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                print(f"📦 Batch trip {result['index']} finished: {result['status']}")
+                yield json.dumps(result) + "\n"
+    finally:
+        # Client went away: stop trips that have not finished yet
+        for task in running:
+            task.cancel()
@@ -0,0 +1,145 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class SQLiteCacheStore:
+    """
+    Persistent backing for TTLCaches, shared by the server and the
+    precompute job (main.py). Values must be JSON-serializable; expiry is
+    stored as wall-clock time so it survives restarts.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT, key TEXT, value TEXT, expires_at REAL, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: Hashable) -> Optional[Tuple[float, Any]]:
+        """Returns (expires_at epoch, value), or None if the key was never stored."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, value FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, _store_key(key)),
+            ).fetchone()
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def set(self, namespace: str, key: Hashable, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, _store_key(key), json.dumps(value), expires_at),
+            )
+            self._conn.commit()
+
+
+def _store_key(key: Hashable) -> str:
+    return key if isinstance(key, str) else json.dumps(key, default=str)
+
+
+_default_store: Optional[SQLiteCacheStore] = None
+
+
+def get_cache_store() -> Optional[SQLiteCacheStore]:
+    """Returns the store configured by CACHE_DB_PATH, or None to keep caches in memory only."""
+    global _default_store
+    path = os.environ.get("CACHE_DB_PATH")
+    if not path:
+        return None
+    if _default_store is None or _default_store.path != path:
+        _default_store = SQLiteCacheStore(path)
+    return _default_store
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache with a per-entry time-to-live.
+    Used to keep enrichment lookups (Wikipedia, weather) warm across sessions.
+    With a `store`, entries are written through to it and misses are read
+    back from it, so they outlive the process.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_entries: int = 1024,
+        store: Optional[SQLiteCacheStore] = None,
+        namespace: str = "",
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.store = store
+        self.namespace = namespace
+        self._entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value, or default if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            # The store may hold a fresher copy (e.g. written by the precompute job)
+            entry = self._load(key) or entry
+        with self._lock:
+            if entry is None or entry[0] < time.monotonic():
+                # Expired entries stay (until evicted) for get_stale
+                return default
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            return entry[1]
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the cached value even if it has expired. For answering
+        with older data when a fresh lookup can't be made in time.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load(key)
+        return default if entry is None else entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Stores a value, evicting the least recently used entry when full."""
+        self._put(key, time.monotonic() + self.ttl_seconds, value)
+        if self.store is not None:
+            self.store.set(self.namespace, key, value, time.time() + self.ttl_seconds)
+
+    def _put(self, key: Hashable, expires_at: float, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key: Hashable) -> Optional[tuple]:
+        """Reads a missing key back from the store into memory."""
+        if self.store is None:
+            return None
+        stored = self.store.get(self.namespace, key)
+        if stored is None:
+            return None
+        # Convert the wall-clock expiry back to this process's monotonic clock
+        expires_at = time.monotonic() + (stored[0] - time.time())
+        self._put(key, expires_at, stored[1])
+        return expires_at, stored[1]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+_MISSING = object()
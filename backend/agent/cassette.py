@@ -0,0 +1,210 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List
+
+# "record" captures every session to CASSETTE_DIR; anything else disables recording
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "")
+CASSETTE_DIR = os.environ.get("CASSETTE_DIR", "cassettes")
+# Recording cassettes kept in memory; older ones are saved already and reloaded if their session resumes
+CASSETTE_MAX_THREADS = int(os.environ.get("CASSETTE_MAX_THREADS", 200))
+
+
+class CassetteMiss(Exception):
+    """Raised in replay when the cassette has no recorded response left for a call."""
+
+
+class Cassette:
+    """
+    Everything needed to replay one session offline: the /api/plan and
+    /api/resume inputs, every upstream response (Gemini, Places, Wikipedia,
+    weather) with its latency, and how long each graph step took.
+
+    Calls are matched on replay by kind and request key, in recorded order.
+    If the new build sends a different request (e.g. a changed prompt) the
+    next unused response of the same kind is served and counted as a
+    mismatch.
+    """
+
+    def __init__(self, thread_id: str, mode: str = "record", entries: List[dict] | None = None):
+        self.thread_id = thread_id
+        self.mode = mode
+        self.entries: List[dict] = entries or []
+        self.simulate_latency = False
+        self.mismatches = 0
+        self.steps: List[dict] = []  # Steps observed in this process (record or replay)
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._by_key: Dict[tuple, deque] = defaultdict(deque)
+        self._by_kind: Dict[str, deque] = defaultdict(deque)
+        if mode == "replay":
+            for entry in self.entries:
+                if entry["type"] == "call":
+                    self._by_key[(entry["kind"], entry["key"])].append(entry)
+                    self._by_kind[entry["kind"]].append(entry)
+
+    @property
+    def inputs(self) -> List[dict]:
+        return [e for e in self.entries if e["type"] == "input"]
+
+    @property
+    def recorded_steps(self) -> List[dict]:
+        return [e for e in self.entries if e["type"] == "step"]
+
+    def _append(self, entry: dict) -> None:
+        entry["at_ms"] = round((time.monotonic() - self._started) * 1000, 3)
+        with self._lock:
+            self.entries.append(entry)
+
+    def record_input(self, endpoint: str, payload: dict) -> None:
+        self._append({"type": "input", "endpoint": endpoint, "payload": payload})
+
+    def record_step(self, node: str, seconds: float) -> None:
+        step = {"type": "step", "node": node, "latency_ms": round(seconds * 1000, 3)}
+        with self._lock:
+            self.steps.append(step)
+        if self.mode == "record":
+            self._append(dict(step))
+
+    def record_call(self, kind: str, key: str, response: Any, seconds: float, error: str | None = None) -> None:
+        entry = {"type": "call", "kind": kind, "key": key, "latency_ms": round(seconds * 1000, 3)}
+        if error is not None:
+            entry["error"] = error
+        else:
+            entry["response"] = response
+        self._append(entry)
+
+    def replay_call(self, kind: str, key: str) -> dict:
+        with self._lock:
+            queue = self._by_key.get((kind, key))
+            while queue and queue[0].get("_used"):
+                queue.popleft()
+            if queue:
+                entry = queue.popleft()
+            else:
+                entry = next((e for e in self._by_kind[kind] if not e.get("_used")), None)
+                if entry is None:
+                    raise CassetteMiss(f"No recorded {kind} response left for {key}")
+                self.mismatches += 1
+            entry["_used"] = True
+            return entry
+
+    def save(self, directory: str = CASSETTE_DIR) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.thread_id}.jsonl.gz")
+        with self._lock:
+            entries = list(self.entries)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        thread_id = os.path.basename(path).split(".")[0]
+        return cls(thread_id, mode="replay", entries=entries)
+
+
+# Cassette of the session the current context works for, if recording or replaying
+current_cassette: ContextVar[Cassette | None] = ContextVar("current_cassette", default=None)
+
+
+def request_key(*parts: Any) -> str:
+    """Stable short hash of a request's identifying parts."""
+    raw = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def cassette_call(
+    kind: str,
+    key: str,
+    fn: Callable[[], Any],
+    encode: Callable[[Any], Any] = lambda value: value,
+    decode: Callable[[Any], Any] = lambda value: value,
+) -> Any:
+    """
+    Runs an upstream call through the current cassette: recorded when
+    recording, served from the cassette when replaying, and passed straight
+    through otherwise.
+
+    Lookups that go through shared caches or the coalescer are recorded
+    around them, so a cache hit or a coalesced result is captured like a
+    fresh response, and replay never depends on what is cached. Calls made
+    inside `fn` are not recorded again.
+    """
+    cassette = current_cassette.get()
+    if cassette is None:
+        return fn()
+
+    if cassette.mode == "replay":
+        entry = cassette.replay_call(kind, key)
+        if cassette.simulate_latency:
+            time.sleep(entry["latency_ms"] / 1000)
+        if "error" in entry:
+            raise Exception(entry["error"])
+        return decode(entry["response"])
+
+    started = time.monotonic()
+    token = current_cassette.set(None)
+    try:
+        result = fn()
+    except Exception as e:
+        cassette.record_call(kind, key, None, time.monotonic() - started, error=str(e))
+        raise
+    finally:
+        current_cassette.reset(token)
+    cassette.record_call(kind, key, encode(result), time.monotonic() - started)
+    return result
+
+
+class CassetteRecorder:
+    """
+    Keeps one recording cassette per thread while the server runs in record
+    mode, for the CASSETTE_MAX_THREADS most recently active threads.
+    """
+
+    def __init__(self, directory: str = CASSETTE_DIR, max_threads: int = CASSETTE_MAX_THREADS):
+        self.directory = directory
+        self.max_threads = max_threads
+        self._cassettes: "OrderedDict[str, Cassette]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return CASSETTE_MODE == "record"
+
+    def for_thread(self, thread_id: str) -> Cassette | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            cassette = self._cassettes.get(thread_id)
+            if cassette is None:
+                cassette = self._cassettes[thread_id] = self._reopen(thread_id)
+                while len(self._cassettes) > self.max_threads:
+                    self._cassettes.popitem(last=False)
+            self._cassettes.move_to_end(thread_id)
+            return cassette
+
+    def _reopen(self, thread_id: str) -> Cassette:
+        """A new cassette, continuing the saved one if the session was evicted and resumed."""
+        path = os.path.join(self.directory, f"{thread_id}.jsonl.gz")
+        if not os.path.exists(path):
+            return Cassette(thread_id)
+        return Cassette(thread_id, entries=Cassette.load(path).entries)
+
+    def save(self, thread_id: str) -> None:
+        with self._lock:
+            cassette = self._cassettes.get(thread_id)
+        if cassette is not None:
+            path = cassette.save(self.directory)
+            print(f"📼 Saved cassette for {thread_id} to {path}")
+
+
+recorder = CassetteRecorder()
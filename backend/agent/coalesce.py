@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from metrics import REGISTRY
+from runs import RunCancelled, check_cancelled
+
+UPSTREAM_CALLS = REGISTRY.counter(
+    "upstream_lookup_calls_total", "Upstream lookups requested by sessions"
+)
+UPSTREAM_COALESCED = REGISTRY.counter(
+    "upstream_lookup_coalesced_total", "Lookups that joined an identical in-flight request"
+)
+COALESCING_RATIO = REGISTRY.gauge(
+    "upstream_lookup_coalescing_ratio", "Share of lookups served by an in-flight request"
+)
+
+
+class RequestCoalescer:
+    """
+    Process-wide in-flight request table.
+
+    Concurrent calls with the same (upstream, key) wait on the future of the
+    first caller instead of hitting the upstream again. The entry is removed
+    as soon as the call settles, so failures are shared with callers already
+    waiting but never cached for later ones. If the leader's run is
+    cancelled, a waiting caller takes over instead of failing with it.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Tuple[str, Hashable], Future] = {}
+        self._lock = threading.Lock()
+
+    def call(self, upstream: str, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        flight_key = (upstream, key)
+        while True:
+            with self._lock:
+                future = self._in_flight.get(flight_key)
+                is_leader = future is None
+                if is_leader:
+                    future = Future()
+                    self._in_flight[flight_key] = future
+
+            self._record(upstream, coalesced=not is_leader)
+
+            if is_leader:
+                break
+            try:
+                return future.result()
+            except RunCancelled:
+                # The leader's session was cancelled, not ours: take over the call
+                check_cancelled(upstream)
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(flight_key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(flight_key, None)
+        future.set_result(result)
+        return result
+
+    def _record(self, upstream: str, coalesced: bool) -> None:
+        UPSTREAM_CALLS.inc(upstream=upstream)
+        if coalesced:
+            UPSTREAM_COALESCED.inc(upstream=upstream)
+        calls = UPSTREAM_CALLS.value(upstream=upstream)
+        COALESCING_RATIO.set(UPSTREAM_COALESCED.value(upstream=upstream) / calls, upstream=upstream)
+
+
+coalescer = RequestCoalescer()
@@ -0,0 +1,99 @@
+import os
+import zlib
+from typing import AsyncGenerator, AsyncIterator
+
+from metrics import REGISTRY
+
+try:
+    import brotli  # Optional: enables "br" streams
+except ImportError:
+    brotli = None
+
+BYTES_IN = REGISTRY.counter(
+    "sse_bytes_uncompressed_total", "SSE payload bytes produced before compression"
+)
+BYTES_OUT = REGISTRY.counter(
+    "sse_bytes_sent_total", "SSE bytes written to clients after compression"
+)
+
+# Encodings the server may use, in order of preference. Empty disables compression.
+ENABLED_ENCODINGS = [
+    e.strip() for e in os.environ.get("SSE_COMPRESSION", "br,gzip").split(",")
+    if e.strip() in ("br", "gzip") and (e.strip() != "br" or brotli is not None)
+]
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    """
+    Picks the preferred enabled encoding the client accepts, honouring q=0.
+    Returns None when the stream should be sent uncompressed.
+    """
+    if not accept_encoding or not ENABLED_ENCODINGS:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in ENABLED_ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class StreamCompressor:
+    """
+    Incremental compressor for one SSE stream. Each call to compress()
+    returns bytes the client can decode immediately (sync flush), while the
+    compression window is kept across events so repeated payloads shrink.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=5)
+        else:
+            # wbits=31 writes a gzip header and trailer
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+async def compress_stream(chunks: AsyncIterator[str], encoding: str | None) -> AsyncGenerator[bytes, None]:
+    """
+    Encodes an SSE stream, compressing it when an encoding was negotiated.
+    Every event group yielded by `chunks` is flushed straight away, so
+    compression never holds back an event.
+    """
+    compressor = StreamCompressor(encoding) if encoding else None
+    label = encoding or "identity"
+    try:
+        async for chunk in chunks:
+            data = chunk.encode("utf-8")
+            BYTES_IN.inc(len(data), encoding=label)
+            if compressor is not None:
+                data = compressor.compress(data)
+            BYTES_OUT.inc(len(data), encoding=label)
+            yield data
+
+        if compressor is not None:
+            tail = compressor.finish()
+            BYTES_OUT.inc(len(tail), encoding=label)
+            yield tail
+    finally:
+        await chunks.aclose()
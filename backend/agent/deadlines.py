@@ -0,0 +1,47 @@
+import os
+import time
+
+from langchain_core.runnables import ensure_config
+
+# Time budget for one /api/plan or /api/resume request, from arrival to the last event
+PLAN_SLO_SECONDS = float(os.environ.get("PLAN_SLO_SECONDS", 90))
+
+# Timeout for HTTP upstreams (Places, wttr.in) when the caller sets none
+DEFAULT_HTTP_TIMEOUT = float(os.environ.get("UPSTREAM_HTTP_TIMEOUT", 10))
+
+# Share of the remaining time a single call may take, so the steps after it
+# still have time. A model call is usually followed by more work in its node
+# (tool calls, another model turn); an HTTP lookup is one of several per tool.
+LLM_SHARE = 0.5
+HTTP_SHARE = 0.25
+
+
+def deadline_in(seconds: float = PLAN_SLO_SECONDS) -> float:
+    """Epoch time `seconds` from now, for the graph config's `deadline_at`."""
+    return time.time() + seconds
+
+
+def remaining() -> float | None:
+    """
+    Seconds left before the current request's deadline, or None if the
+    current graph run has none. Read from the `deadline_at` configurable
+    of the running graph, which LangChain carries into nodes, tools and
+    the threads they start.
+    """
+    deadline_at = ensure_config().get("configurable", {}).get("deadline_at")
+    if deadline_at is None:
+        return None
+    return deadline_at - time.time()
+
+
+def step_timeout(default: float | None, share: float = 1.0) -> float | None:
+    """
+    Timeout for a step: its own default, capped at `share` of the time left.
+    Returns 0 once the deadline has passed, so the step gives up right away
+    and the caller falls back to partial results.
+    """
+    left = remaining()
+    if left is None:
+        return default
+    capped = max(left, 0.0) * share
+    return capped if default is None else min(default, capped)
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncGenerator, List, Tuple
+
+from metrics import REGISTRY
+from runs import runs
+
+REPLAYED = REGISTRY.counter("sse_events_replayed_total", "SSE events replayed to reconnecting clients")
+RESYNCS = REGISTRY.counter(
+    "sse_replay_gaps_total", "Reconnects whose missed events had already left the replay ring"
+)
+ABANDONED = REGISTRY.counter(
+    "sse_streams_abandoned_total", "Running streams cancelled because no client came back within the grace window"
+)
+
+# Events kept per thread for replay, and how many threads keep a log
+EVENT_LOG_SIZE = int(os.environ.get("EVENT_LOG_SIZE", 500))
+EVENT_LOG_THREADS = int(os.environ.get("EVENT_LOG_THREADS", 1000))
+# How long a running stream may go without subscribers (e.g. while its
+# client reconnects) before its run is cancelled
+STREAM_ABANDON_GRACE_SECONDS = float(os.environ.get("STREAM_ABANDON_GRACE_SECONDS", 10))
+
+
+class ThreadEventLog:
+    """
+    The SSE events sent for one thread, numbered with monotonic IDs that
+    continue across the thread's streams (plan, then each resume). Keeps
+    the most recent events in a bounded ring for replay, and lets
+    subscribers follow the streams that are still running.
+
+    Graph jobs append from their worker threads while subscribers wait on
+    the server's event loop, so every method is thread-safe.
+    """
+
+    def __init__(self, max_events: int = EVENT_LOG_SIZE):
+        self.last_id = 0
+        self._open_streams = 0
+        self._events: deque = deque(maxlen=max_events)
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        # When the thread last had no subscribers, or None while it has some
+        self._unwatched_since: float | None = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def live(self) -> bool:
+        """Whether a stream is currently producing events for the thread."""
+        return self._open_streams > 0
+
+    def unwatched_for(self) -> float:
+        """Seconds the thread has gone without subscribers since its last stream started; 0 while it has some."""
+        with self._lock:
+            if self._unwatched_since is None:
+                return 0.0
+            return time.monotonic() - self._unwatched_since
+
+    def open(self) -> int:
+        """Marks a stream started. Returns the last event ID before it, to subscribe from."""
+        with self._lock:
+            self._open_streams += 1
+            if self._unwatched_since is not None:
+                # The client that started the stream subscribes next; give it the full grace window
+                self._unwatched_since = time.monotonic()
+            return self.last_id
+
+    def append(self, chunk: str) -> int:
+        with self._lock:
+            self.last_id += 1
+            self._events.append((self.last_id, chunk))
+            self._notify((self.last_id, chunk))
+            return self.last_id
+
+    def since(self, last_event_id: int) -> Tuple[List[Tuple[int, str]], bool]:
+        """
+        Returns the events after `last_event_id`, and whether some of them
+        had already been dropped from the ring.
+        """
+        with self._lock:
+            missed = [(event_id, chunk) for event_id, chunk in self._events if event_id > last_event_id]
+            oldest = self._events[0][0] if self._events else self.last_id + 1
+            dropped = last_event_id + 1 < oldest and last_event_id < self.last_id
+            # An ID from before a restart (or another server) can't be resumed from either
+            return missed, dropped or last_event_id > self.last_id
+
+    def subscribe(self) -> asyncio.Queue | None:
+        """Follows the running streams from the caller's event loop. Returns None if none is running."""
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            if not self.live:
+                return None
+            self._subscribers.append((asyncio.get_running_loop(), queue))
+            self._unwatched_since = None
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> bool:
+        """Stops following. Returns True if a stream is still running and nobody else follows it."""
+        with self._lock:
+            self._subscribers = [(loop, q) for loop, q in self._subscribers if q is not queue]
+            if self._subscribers:
+                return False
+            self._unwatched_since = time.monotonic()
+            return self.live
+
+    def close(self) -> None:
+        """Marks a stream finished, and releases the subscribers once none is running."""
+        with self._lock:
+            self._open_streams -= 1
+            if not self.live:
+                self._notify(None)
+
+    def _notify(self, item) -> None:
+        for loop, queue in self._subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # The subscriber's loop is closed; it is gone
+
+
+class EventLogRegistry:
+    """Event logs of the most recently active threads."""
+
+    def __init__(self, max_threads: int = EVENT_LOG_THREADS):
+        self.max_threads = max_threads
+        self._logs: "OrderedDict[str, ThreadEventLog]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, thread_id: str, create: bool = False) -> ThreadEventLog | None:
+        with self._lock:
+            log = self._logs.get(thread_id)
+            if log is None and create:
+                log = self._logs[thread_id] = ThreadEventLog()
+                while len(self._logs) > self.max_threads:
+                    self._logs.popitem(last=False)
+            if log is not None:
+                self._logs.move_to_end(thread_id)
+            return log
+
+
+event_logs = EventLogRegistry()
+
+
+def _with_id(event_id: int, chunk: str) -> str:
+    return f"id: {event_id}\n{chunk}"
+
+
+def _resync(thread_id: str) -> str:
+    return f"data: {json.dumps({'type': 'resync', 'thread_id': thread_id})}\n\n"
+
+
+async def replay(thread_id: str, last_event_id: int) -> AsyncGenerator[str, None]:
+    """
+    Sends a reconnecting client the events after `last_event_id`, then
+    follows the thread's stream if it is still running. If missed events
+    were already dropped, a `resync` event asks the client to reload the
+    snapshot from /api/state. Never runs the graph.
+    """
+    log = event_logs.get(thread_id)
+    if log is None:
+        RESYNCS.inc()
+        yield _resync(thread_id)
+        return
+
+    # Subscribe before reading the ring so no event falls between the two
+    queue = log.subscribe()
+    try:
+        missed, gap = log.since(last_event_id)
+        if gap:
+            RESYNCS.inc()
+            yield _resync(thread_id)
+        sent = last_event_id
+        for event_id, chunk in missed:
+            REPLAYED.inc()
+            sent = event_id
+            yield _with_id(event_id, chunk)
+        while queue is not None:
+            item = await queue.get()
+            if item is None:
+                return
+            event_id, chunk = item
+            if event_id > sent:
+                sent = event_id
+                yield _with_id(event_id, chunk)
+    finally:
+        if queue is not None and log.unsubscribe(queue):
+            # The client left mid-stream; keep the run going only while it may still reconnect
+            asyncio.get_running_loop().call_later(
+                STREAM_ABANDON_GRACE_SECONDS, _cancel_if_abandoned, thread_id, log
+            )
+
+
+def _cancel_if_abandoned(thread_id: str, log: ThreadEventLog) -> None:
+    if log.live and log.unwatched_for() >= STREAM_ABANDON_GRACE_SECONDS:
+        if runs.cancel(thread_id):
+            ABANDONED.inc()
+            print(f"🔌 No client came back to {thread_id}; cancelling its run")
@@ -2,6 +2,8 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
 from state import TravelState
 from agents import search_node, research_node, itinerary_node, supervisor_node
+from instrumentation import instrument_node
+from serializer import get_checkpoint_serializer
 
 # 1. Initialize the Graph
 workflow = StateGraph(TravelState)
@@ -9,10 +11,11 @@ workflow = StateGraph(TravelState)
 # 2. Add Nodes for the new workflow:
 # START -> Supervisor -> Search -> HITL (Select Places) -> Research -> HITL (Choose Locations) -> Itinerary -> END
 
-workflow.add_node("Supervisor", supervisor_node)
-workflow.add_node("Search_Agent", search_node)
-workflow.add_node("Research_Agent", research_node)
-workflow.add_node("Itinerary_Agent", itinerary_node)
+# Nodes are instrumented for opt-in profiling and cassette step timings
+workflow.add_node("Supervisor", instrument_node("Supervisor", supervisor_node))
+workflow.add_node("Search_Agent", instrument_node("Search_Agent", search_node))
+workflow.add_node("Research_Agent", instrument_node("Research_Agent", research_node))
+workflow.add_node("Itinerary_Agent", instrument_node("Itinerary_Agent", itinerary_node))
 
 # 3. Define Edges
 workflow.add_edge(START, "Supervisor")
@@ -44,7 +47,8 @@ workflow.add_conditional_edges(
 # Interrupt AFTER Search (so user can select places)
 # Interrupt AFTER Research (so user can choose which locations to include in itinerary)
 # Interrupt AFTER Itinerary (so user can review and request adjustments)
-checkpointer = MemorySaver()
+# Checkpoints are written with the serializer CHECKPOINT_SERIALIZER selects (see serializer.py)
+checkpointer = MemorySaver(serde=get_checkpoint_serializer())
 app = workflow.compile(
     checkpointer=checkpointer,
     interrupt_after=["Search_Agent", "Research_Agent", "Itinerary_Agent"]
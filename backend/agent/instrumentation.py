@@ -0,0 +1,32 @@
+import functools
+import time
+
+from cassette import current_cassette
+from metrics import REGISTRY
+from profiling import current_profiler, profile_thread
+
+NODE_LATENCY = REGISTRY.summary("graph_node_latency_seconds", "Wall time of each graph node step")
+
+
+def instrument_node(name: str, fn):
+    """
+    Wraps a graph node so its latency is exported, opt-in session profiling
+    can attribute its CPU time and cassettes record how long each step took.
+    When profiling and cassettes are off it costs two ContextVar lookups and
+    a timer per call.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        cassette = current_cassette.get()
+        try:
+            if cassette is None and current_profiler.get() is None:
+                return fn(*args, **kwargs)
+            with profile_thread(name):
+                return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            NODE_LATENCY.observe(elapsed, node=name)
+            if cassette is not None:
+                cassette.record_step(name, elapsed)
+    return wrapper
@@ -0,0 +1,171 @@
+import uuid
+from typing import List, Literal, Optional, Set, Tuple
+
+from pydantic import BaseModel, Field
+
+# --- Structured output schemas for the itinerary LLM calls ---
+
+class Slot(BaseModel):
+    """One part of a day."""
+    time: Literal["morning", "afternoon", "evening"]
+    activity: str = Field(description="What to do, e.g. 'Guided tour of the Louvre'")
+    place: str = Field(default="", description="Where it happens")
+    cost: float = Field(default=0.0, description="Estimated cost in USD")
+    notes: str = Field(default="", description="Tips, transport or booking notes")
+
+
+class DayPlan(BaseModel):
+    """A single day of the trip."""
+    title: str = Field(description="Short theme of the day")
+    accommodation: str = Field(default="", description="Where to stay that night, with price")
+    slots: List[Slot]
+
+
+class ItineraryDraft(BaseModel):
+    """The whole trip, as generated for the chosen location."""
+    summary: str = Field(description="Two or three sentences introducing the trip")
+    days: List[DayPlan]
+
+
+class PatchOp(BaseModel):
+    """One targeted change to the itinerary."""
+    op: Literal["replace_day", "add_day", "remove_day"]
+    day: int = Field(description="1-based day number the change applies to (for add_day: the position of the new day)")
+    instructions: str = Field(default="", description="What the regenerated or new day must change or contain")
+
+
+class ItineraryPatch(BaseModel):
+    """The smallest set of day changes that implements the user's feedback."""
+    ops: List[PatchOp]
+
+
+# --- Plan stored in TravelState.itinerary_plan ---
+# {"destination", "summary", "total_cost",
+#  "days": [{"id", "day", "title", "accommodation", "cost", "slots": [...]}]}
+# Day IDs are stable across patches; "day" is the 1-based position.
+
+def _day_record(day: DayPlan, day_id: Optional[str] = None) -> dict:
+    record = day.model_dump()
+    record["id"] = day_id or f"day_{uuid.uuid4().hex[:8]}"
+    record["cost"] = round(sum(slot.cost for slot in day.slots), 2)
+    return record
+
+
+def _finish(plan: dict) -> dict:
+    # Days are copied so checkpointed plans are never modified in place
+    plan["days"] = [{**day, "day": i + 1} for i, day in enumerate(plan["days"])]
+    plan["total_cost"] = round(sum(day["cost"] for day in plan["days"]), 2)
+    return plan
+
+
+def new_plan(destination: str, draft: ItineraryDraft) -> dict:
+    """Builds the stored plan from a freshly generated itinerary."""
+    return _finish({
+        "destination": destination,
+        "summary": draft.summary,
+        "days": [_day_record(day) for day in draft.days],
+    })
+
+
+def resolve_patch(plan: dict, patch: ItineraryPatch) -> List[Tuple[PatchOp, Optional[dict]]]:
+    """
+    Pairs each op with the existing day it targets (None for add_day).
+    Ops for days that don't exist are dropped, and replacing a day that is
+    also removed is pointless, so those replacements are dropped too.
+    """
+    days = plan.get("days", [])
+    removed = {op.day for op in patch.ops if op.op == "remove_day"}
+    resolved = []
+    for op in patch.ops:
+        if op.op == "add_day":
+            resolved.append((op, None))
+        elif 1 <= op.day <= len(days) and (op.op == "remove_day" or op.day not in removed):
+            resolved.append((op, days[op.day - 1]))
+    return resolved
+
+
+def apply_patch(plan: dict, changes: List[Tuple[PatchOp, Optional[dict], Optional[DayPlan]]]) -> Tuple[dict, dict]:
+    """
+    Applies resolved ops with their regenerated days to a copy of the plan.
+    Day numbers in the ops refer to the plan before the patch.
+    Returns the new plan and the patch to stream to the client.
+    """
+    original = plan["days"]
+    replaced = {}
+    removed = set()
+    added: List[Tuple[int, dict]] = []
+
+    for op, target, generated in changes:
+        if op.op == "remove_day":
+            removed.add(target["id"])
+        elif op.op == "replace_day":
+            replaced[target["id"]] = _day_record(generated, target["id"])
+        else:
+            # New days go before the day currently at that position, or at the end
+            added.append((min(max(op.day, 1), len(original) + 1), _day_record(generated)))
+
+    days = []
+    for position, day in enumerate(original, start=1):
+        days.extend(new_day for at, new_day in added if at == position)
+        if day["id"] in removed:
+            continue
+        days.append(replaced.get(day["id"], day))
+    days.extend(new_day for at, new_day in added if at > len(original))
+
+    new = _finish({**plan, "days": days})
+    added_ids = {day["id"] for _, day in added}
+    changed = [day for day in new["days"] if day["id"] in replaced or day["id"] in added_ids]
+    patch = {
+        "days": changed,
+        "removed": sorted(removed),
+        "order": [day["id"] for day in new["days"]],
+        "total_cost": new["total_cost"],
+    }
+    return new, patch
+
+
+def full_patch(plan: dict) -> dict:
+    """Patch that replaces the client's itinerary with the whole plan."""
+    return {
+        "replace": True,
+        "summary": plan["summary"],
+        "days": plan["days"],
+        "removed": [],
+        "order": [day["id"] for day in plan["days"]],
+        "total_cost": plan["total_cost"],
+    }
+
+
+def outline(plan: dict) -> str:
+    """One line per day, as compact context for patch planning."""
+    lines = []
+    for day in plan["days"]:
+        activities = "; ".join(slot["activity"] for slot in day["slots"])
+        lines.append(f"Day {day['day']}: {day['title']} (${day['cost']:.0f}) - {activities}")
+    return "\n".join(lines)
+
+
+def render_days(days: List[dict], changed: Set[str] = frozenset()) -> str:
+    """Renders days as the markdown shown in the chat, marking those whose ID is in `changed`."""
+    parts = []
+    for day in days:
+        mark = " ✏️ *(updated)*" if day["id"] in changed else ""
+        lines = [f"**Day {day['day']}: {day['title']}**{mark}"]
+        for slot in day["slots"]:
+            where = f" at {slot['place']}" if slot["place"] else ""
+            line = f"- *{slot['time'].capitalize()}*: {slot['activity']}{where} (${slot['cost']:.0f})"
+            if slot["notes"]:
+                line += f" - {slot['notes']}"
+            lines.append(line)
+        if day["accommodation"]:
+            lines.append(f"- *Stay*: {day['accommodation']}")
+        lines.append(f"- Day total: ${day['cost']:.2f}")
+        parts.append("\n".join(lines))
+    return "\n\n".join(parts)
+
+
+def render_plan(plan: dict, changed: Set[str] = frozenset()) -> str:
+    return (
+        f"{plan['summary']}\n\n{render_days(plan['days'], changed)}\n\n"
+        f"**Estimated total: ${plan['total_cost']:.2f}**"
+    )
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Awaitable, Callable
+
+from event_log import STREAM_ABANDON_GRACE_SECONDS, ThreadEventLog, event_logs
+from metrics import REGISTRY
+from monitor import loop_monitor
+
+JOBS_WAITING = REGISTRY.gauge("graph_jobs_waiting", "Graph jobs submitted but not yet picked up by a worker")
+JOBS_RUNNING = REGISTRY.gauge("graph_jobs_running", "Graph jobs currently executing on a worker")
+JOB_QUEUE_SECONDS = REGISTRY.summary(
+    "graph_job_queue_seconds", "How long graph jobs waited for a free worker"
+)
+JOBS_DROPPED = REGISTRY.counter(
+    "graph_jobs_dropped_total", "Queued graph jobs never started, by reason (abandoned, deadline)"
+)
+
+# Graph runs executing at once, independent of how many clients are streaming
+GRAPH_JOB_WORKERS = int(os.environ.get("GRAPH_JOB_WORKERS", 8))
+
+
+class GraphJobPool:
+    """
+    Runs graph executions off the server's event loop. Each worker thread
+    has an event loop of its own and drives one job at a time, publishing
+    the job's SSE events to the thread's event log; HTTP handlers only
+    subscribe to that log (see event_log.replay). A slow or blocking step
+    therefore holds up its own worker, not every open stream. A run whose
+    client disconnects carries on for STREAM_ABANDON_GRACE_SECONDS, so the
+    client can reconnect to it, and is cancelled if nobody does.
+
+    Workers are threads rather than processes: the checkpointer
+    (MemorySaver), the run registry and the event logs live in this
+    process, and a run must be able to read and cancel them.
+    """
+
+    def __init__(self, max_workers: int = GRAPH_JOB_WORKERS):
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="graph-job", initializer=self._start_worker
+        )
+
+    def submit(self, thread_id: str, chunks: AsyncGenerator[str, None], deadline_at: float | None = None) -> int:
+        """
+        Queues an SSE generator for a thread. Returns the event ID to
+        subscribe from, so the caller sees every event of the job.
+        A job still queued at `deadline_at` (epoch time) is failed with an
+        error event instead of started.
+        """
+        log = event_logs.get(thread_id, create=True)
+        # Opened before queueing, so subscribers wait for the job instead of finding nothing to follow
+        start_id = log.open()
+        JOBS_WAITING.inc()
+        self._pool.submit(self._run, log, chunks, time.monotonic(), deadline_at)
+        return start_id
+
+    async def run(self, job: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs a coroutine function on a worker and returns its result, for
+        callers that want the outcome rather than SSE events (batch trips).
+        Cancelling the caller only unqueues a job that hasn't started; a
+        running job stops when its run is cancelled.
+        """
+        JOBS_WAITING.inc()
+        future = self._pool.submit(self._run_job, job, time.monotonic())
+        # A job cancelled while queued never reaches _run_job
+        future.add_done_callback(lambda f: JOBS_WAITING.dec() if f.cancelled() else None)
+        return await asyncio.wrap_future(future)
+
+    def _start_worker(self) -> None:
+        self._local.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._local.loop)
+        # Sync nodes, to_thread tool calls and get_state run on this loop and its default executor
+        self._local.name = threading.current_thread().name
+        loop_monitor.watch_loop(self._local.name, self._local.loop)
+
+    def _run(
+        self, log: ThreadEventLog, chunks: AsyncGenerator[str, None], submitted_at: float, deadline_at: float | None
+    ) -> None:
+        JOBS_WAITING.dec()
+        JOB_QUEUE_SECONDS.observe(time.monotonic() - submitted_at)
+        if log.unwatched_for() >= STREAM_ABANDON_GRACE_SECONDS:
+            # The client left while the job was queued and never came back
+            print("🔌 Dropping a queued graph job nobody is following")
+            self._drop(log, chunks, "abandoned")
+            return
+        if deadline_at is not None and time.time() >= deadline_at:
+            # Its whole time budget went on waiting for a worker
+            print("⏱️ Dropping a graph job whose deadline passed while it was queued")
+            self._drop(log, chunks, "deadline", "The server is busy and couldn't start this step in time. Please try again.")
+            return
+        JOBS_RUNNING.inc()
+        try:
+            self._local.loop.run_until_complete(self._probed(self._publish(log, chunks), self._local.name))
+        except Exception as e:
+            print(f"❌ Graph job failed: {e}")
+        finally:
+            JOBS_RUNNING.dec()
+            log.close()
+
+    def _run_job(self, job: Callable[[], Awaitable[Any]], submitted_at: float) -> Any:
+        JOBS_WAITING.dec()
+        JOB_QUEUE_SECONDS.observe(time.monotonic() - submitted_at)
+        JOBS_RUNNING.inc()
+        try:
+            return self._local.loop.run_until_complete(self._probed(job(), self._local.name))
+        finally:
+            JOBS_RUNNING.dec()
+
+    @staticmethod
+    async def _probed(job: Awaitable[Any], worker: str) -> Any:
+        # The worker's loop only runs during a job, so its lag is measured per job
+        probe = asyncio.create_task(loop_monitor.probe(worker))
+        try:
+            return await job
+        finally:
+            probe.cancel()
+
+    def _drop(self, log: ThreadEventLog, chunks: AsyncGenerator[str, None], reason: str, error: str | None = None) -> None:
+        JOBS_DROPPED.inc(reason=reason)
+        self._local.loop.run_until_complete(chunks.aclose())
+        if error:
+            log.append(f"data: {json.dumps({'type': 'error', 'data': error})}\n\n")
+        log.close()
+
+    @staticmethod
+    async def _publish(log: ThreadEventLog, chunks: AsyncGenerator[str, None]) -> None:
+        try:
+            async for chunk in chunks:
+                log.append(chunk)
+        finally:
+            await chunks.aclose()
+
+
+graph_jobs = GraphJobPool()
+loop_monitor.watch_pool("graph-job", lambda: graph_jobs._pool)
@@ -1,36 +1,161 @@
+"""
+Headless precompute job: warms the persistent lookup caches (Places,
+Wikipedia, weather) for popular destinations, so the first user of the day
+for those cities gets warm-cache latency.
+
+Point it and the server at the same CACHE_DB_PATH, then:
+
+    python main.py destinations.txt --workers 4
+    python main.py destinations.txt --tools-only        # no LLM calls at all
+
+The destinations file has one destination per line; blank lines and lines
+starting with '#' are skipped.
+
+Only the lookup caches are warmed: itineraries live in the run's checkpoint,
+which the server can't see, so generating them here would be wasted quota.
+
+Places pages are cached by their query text ("<type or query> in
+<location>", ignoring case and spacing). In graph mode the search agent picks
+the location and query itself, as it does for live sessions, so a hit needs
+the live model to phrase a search the same way; "Paris" and "Paris, France"
+are different keys. --tools-only searches "<type> in <destination>" for each
+of --place-types, so write destinations the way users usually name them.
+Wikipedia and weather lookups are keyed by place name and location and are
+far more likely to hit.
+"""
 from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-from graph import app
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from typing import List
+
+from cache import get_cache_store
+from place_registry import place_registry
+from ratelimit import request_priority
+from sessions import build_initial_state
+from tools import PLACES_CACHE, WEATHER_CACHE, WIKIPEDIA_CACHE, search_places, warm_place_research
+
+# Place types searched per destination in --tools-only mode (what the search agent usually asks for)
+DEFAULT_PLACE_TYPES = ["tourist_attraction", "lodging", "restaurant", "museum"]
+
+
+def read_destinations(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+async def precompute_graph(destinations: List[str], args) -> int:
+    """
+    Runs each destination through the real graph, search then research of the
+    top places, stopping before the itinerary. Returns the number of failed
+    destinations.
+    """
+    # Imported here so --tools-only runs without a Gemini key
+    from batch import SelectionPolicy, run_batch
+
+    policy = SelectionPolicy(k=args.research_top)
+    initial_states = [
+        build_initial_state(f"Plan a trip to {destination}", args.budget, destination, args.description)
+        for destination in destinations
+    ]
+    thread_ids = [f"precompute_{uuid.uuid4()}" for _ in destinations]
+
+    failed = 0
+    started = time.monotonic()
+    done = 0
+    async for line in run_batch(initial_states, thread_ids, policy, args.workers, "choose_locations"):
+        result = json.loads(line)
+        done += 1
+        if result["status"] == "error":
+            failed += 1
+            detail = f"failed: {result['error']}"
+        else:
+            detail = f"{result['found_places']} places, {len(result['researched_places'])} researched"
+        report_progress(done, len(destinations), result["location"], detail, result["elapsed_seconds"], started)
+    return failed
+
+
+async def precompute_tools(destinations: List[str], args) -> int:
+    """
+    Calls the search and research lookups directly, without the LLM: every
+    place type is searched, and the top places are researched. Returns the
+    number of failed destinations.
+    """
+    semaphore = asyncio.Semaphore(args.workers)
+    started = time.monotonic()
+    done = 0
+    failed = 0
+
+    def warm(destination: str) -> str:
+        found_places = []
+        for place_type in args.place_types:
+            command = search_places.func(location=destination, place_type=place_type, tool_call_id="precompute")
+            found_places.extend(place_registry.hydrate(command.update["found_places"]))
+        top = sorted(found_places, key=lambda p: p.get("rating") or 0, reverse=True)[: args.research_top]
+        for place in top:
+            warm_place_research(place)
+        return f"{len(found_places)} places, {len(top)} researched"
+
+    async def run_one(destination: str):
+        async with semaphore:
+            # Precompute traffic yields upstream quota to interactive sessions
+            request_priority.set("batch")
+            t0 = time.monotonic()
+            try:
+                detail = await asyncio.to_thread(warm, destination)
+                ok = True
+            except Exception as e:
+                detail, ok = f"failed: {e}", False
+            return destination, detail, ok, time.monotonic() - t0
+
+    for next_done in asyncio.as_completed([run_one(d) for d in destinations]):
+        destination, detail, ok, elapsed = await next_done
+        done += 1
+        failed += 0 if ok else 1
+        report_progress(done, len(destinations), destination, detail, elapsed, started)
+    return failed
+
+
+def report_progress(done: int, total: int, destination: str, detail: str, elapsed: float, started: float) -> None:
+    rate = done / max(time.monotonic() - started, 1e-9) * 60
+    print(f"[{done}/{total}] {destination}: {detail} in {elapsed:.1f}s ({rate:.1f} destinations/min)")
 
-# The 'app' is now imported from graph.py which contains the Multi-Agent Supervisor Graph
 
-# --- HOW TO RUN IT ---
 if __name__ == "__main__":
-    # Initialize with a budget
-    initial_state = {
-        "messages": [("user", "Plan a trip to Tokyo from NYC. I need a flight and a hotel for 3 nights. Budget is $2500.")],
-        "total_budget": 2500.0,
-        "remaining_budget": 2500.0,
-        "itinerary": [],
-        "current_location": "NYC",
-        "next": "Supervisor" # Start with Supervisor
-    }
-
-    print("🤖 Multi-Agent System Starting...")
-    
-    # Run the graph
-    for chunk in app.stream(initial_state, stream_mode="values"):
-        # Pretty print the last message
-        if "messages" in chunk and chunk["messages"]:
-            last_msg = chunk["messages"][-1]
-            print(f"\n[{last_msg.type.upper()}]: {last_msg.content}")
-            
-        # Check if budget updated
-        if "remaining_budget" in chunk:
-             print(f"💰 Ledger Update: Remaining Funds = ${chunk['remaining_budget']}")
-             
-        # Show who is acting
-        if "next" in chunk:
-            print(f"👉 Next Agent: {chunk['next']}")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Warm the persistent lookup caches for popular destinations.")
+    parser.add_argument("destinations", help="File with one destination per line")
+    parser.add_argument("--workers", type=int, default=4, help="Destinations processed concurrently")
+    parser.add_argument("--research-top", type=int, default=5, help="Top places per destination to research")
+    parser.add_argument("--tools-only", action="store_true", help="Call the lookups directly, without the graph or LLM")
+    parser.add_argument("--place-types", nargs="+", default=DEFAULT_PLACE_TYPES, help="Place types searched with --tools-only")
+    parser.add_argument("--budget", type=float, default=2000.0)
+    parser.add_argument("--description", default="top attractions, hotels and restaurants")
+    args = parser.parse_args()
+
+    if get_cache_store() is None:
+        print("❌ CACHE_DB_PATH is not set, so nothing would outlive this process. Set it to the server's cache database.")
+        sys.exit(2)
+
+    destinations = read_destinations(args.destinations)
+    mode = "tools only" if args.tools_only else "graph"
+    print(f"🔥 Precomputing {len(destinations)} destinations ({mode}, {args.workers} workers) into {os.environ['CACHE_DB_PATH']}")
+
+    started = time.monotonic()
+    runner = precompute_tools if args.tools_only else precompute_graph
+    failed = asyncio.run(runner(destinations, args))
+    elapsed = time.monotonic() - started
+
+    print(
+        f"✅ {len(destinations) - failed}/{len(destinations)} destinations warmed in {elapsed:.1f}s "
+        f"({len(destinations) / max(elapsed, 1e-9) * 60:.1f}/min). "
+        f"In-process cache entries: {len(PLACES_CACHE)} places pages, "
+        f"{len(WIKIPEDIA_CACHE)} Wikipedia, {len(WEATHER_CACHE)} weather"
+    )
+    sys.exit(1 if failed else 0)
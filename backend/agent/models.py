@@ -0,0 +1,207 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from cassette import cassette_call, request_key
+
+from deadlines import LLM_SHARE, step_timeout
+from metrics import REGISTRY
+from ratelimit import GOVERNORS
+from runs import UpstreamTimeout, check_cancelled, run_with_timeout
+from upstream import MAX_THROTTLE_RETRIES, retry_after_from_error
+
+LLM_LATENCY = REGISTRY.summary("llm_call_latency_seconds", "LLM call latency by graph node and model")
+SLO_MISSES = REGISTRY.counter("llm_slo_missed_total", "LLM calls slower than their node's latency SLO")
+FALLBACKS = REGISTRY.counter(
+    "llm_fallbacks_total", "LLM calls answered by the node's fallback after the primary model missed its timeout"
+)
+
+
+class NodeModel:
+    """Model settings for one graph node: the model, its latency SLO and timeout, and the fallback model."""
+
+    def __init__(self, node: str, model: str, timeout: float, slo: float, fallback: Optional[str] = None):
+        self.node = node
+        self.model = model
+        self.timeout = timeout
+        self.slo = slo
+        self.fallback = fallback
+
+
+def _node_model(node: str, model: str, timeout: float, slo: float, fallback: Optional[str] = None) -> NodeModel:
+    # Overridable per node, e.g. MODEL_ITINERARY, MODEL_ITINERARY_TIMEOUT, MODEL_ITINERARY_SLO, MODEL_ITINERARY_FALLBACK
+    prefix = f"MODEL_{node.upper()}"
+    return NodeModel(
+        node,
+        os.environ.get(prefix, model),
+        float(os.environ.get(f"{prefix}_TIMEOUT", timeout)),
+        float(os.environ.get(f"{prefix}_SLO", slo)),
+        os.environ.get(f"{prefix}_FALLBACK", fallback or "") or None,
+    )
+
+
+# The supervisor only picks the next agent, so it gets a small fast model and
+# falls back to a rule-based route (see agents.route_from_stage) instead of a model.
+MODEL_REGISTRY: Dict[str, NodeModel] = {
+    "supervisor": _node_model("supervisor", "gemini-2.0-flash-lite", timeout=8, slo=2),
+    "search": _node_model("search", "gemini-2.0-flash", timeout=30, slo=10, fallback="gemini-2.0-flash-lite"),
+    "research": _node_model("research", "gemini-2.0-flash", timeout=45, slo=20, fallback="gemini-2.0-flash-lite"),
+    "itinerary": _node_model("itinerary", "gemini-2.0-flash", timeout=60, slo=25, fallback="gemini-2.0-flash-lite"),
+}
+
+
+class GovernedChatModel(ChatGoogleGenerativeAI):
+    """
+    Gemini chat model whose calls go through the shared "gemini" rate-limit
+    governor. Rate-limit errors pause the governor for the advertised retry
+    delay and are retried, instead of failing the agent step. Calls stop as
+    soon as the session's run is cancelled.
+
+    With `call_timeout`, a call that takes longer is abandoned and answered
+    by the `fallback` model instead (or raises UpstreamTimeout without one).
+    The timeout is capped at a share of the time left before the request's
+    deadline.
+    """
+
+    governor_name: str = "gemini"
+    node: str = ""
+    call_timeout: Optional[float] = None
+    slo_seconds: Optional[float] = None
+    fallback: Optional[BaseChatModel] = None
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = request_key(
+            self.model,
+            [(m.type, m.content, getattr(m, "tool_calls", None)) for m in messages],
+            stop,
+            kwargs,
+        )
+        return cassette_call(
+            "llm",
+            key,
+            lambda: self._governed_generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            _encode_result,
+            _decode_result,
+        )
+
+    def _governed_generate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.monotonic()
+        try:
+            return self._generate_with_retries(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except UpstreamTimeout:
+            if self.fallback is None:
+                raise
+            self._log_fallback()
+            return self.fallback._governed_generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        finally:
+            self._observe(time.monotonic() - started)
+
+    def _generate_with_retries(self, messages, stop=None, run_manager=None, **kwargs):
+        governor = GOVERNORS[self.governor_name]
+        for attempt in range(MAX_THROTTLE_RETRIES):
+            check_cancelled(self.governor_name)
+            governor.acquire(timeout=step_timeout(self.call_timeout, LLM_SHARE))
+            timeout = step_timeout(self.call_timeout, LLM_SHARE)
+            try:
+                # Runs off-thread so a cancelled session releases its worker immediately.
+                # The client gets the same timeout, so an abandoned call frees its I/O thread too.
+                return run_with_timeout(
+                    self.governor_name, timeout,
+                    super()._generate, messages, stop=stop, run_manager=run_manager,
+                    **{**kwargs, "timeout": timeout},
+                )
+            except Exception as e:
+                delay = retry_after_from_error(e)
+                if delay is None or attempt == MAX_THROTTLE_RETRIES - 1:
+                    raise
+                governor.pause_for(delay)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        governor = GOVERNORS[self.governor_name]
+        started = time.monotonic()
+        try:
+            for attempt in range(MAX_THROTTLE_RETRIES):
+                check_cancelled(self.governor_name)
+                await asyncio.to_thread(governor.acquire, timeout=step_timeout(self.call_timeout, LLM_SHARE))
+                timeout = step_timeout(self.call_timeout, LLM_SHARE)
+                try:
+                    return await asyncio.wait_for(
+                        super()._agenerate(
+                            messages, stop=stop, run_manager=run_manager, **{**kwargs, "timeout": timeout}
+                        ),
+                        timeout=timeout,
+                    )
+                except asyncio.TimeoutError:
+                    if self.fallback is None:
+                        raise UpstreamTimeout(f"{self.model} timed out after {timeout:.1f}s")
+                    self._log_fallback()
+                    return await self.fallback._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                except Exception as e:
+                    delay = retry_after_from_error(e)
+                    if delay is None or attempt == MAX_THROTTLE_RETRIES - 1:
+                        raise
+                    governor.pause_for(delay)
+        finally:
+            self._observe(time.monotonic() - started)
+
+    def _log_fallback(self) -> None:
+        FALLBACKS.inc(node=self.node, model=self.fallback.model)
+        print(f"⏱️ {self.model} timed out for {self.node or 'a call'}; using {self.fallback.model}")
+
+    def _observe(self, seconds: float) -> None:
+        LLM_LATENCY.observe(seconds, node=self.node, model=self.model)
+        if self.slo_seconds is not None and seconds > self.slo_seconds:
+            SLO_MISSES.inc(node=self.node)
+
+
+def model_for(node: str) -> GovernedChatModel:
+    """Builds the chat model configured for a graph node in MODEL_REGISTRY."""
+    config = MODEL_REGISTRY[node]
+    # Calls are rate limited by the shared Gemini governor, which also handles
+    # 429 retries, so the client's own retries are turned off. Each call passes
+    # the client its step budget; `timeout` caps calls made any other way.
+    fallback = None
+    if config.fallback:
+        fallback = GovernedChatModel(
+            model=config.fallback, temperature=0, max_retries=1, timeout=config.timeout,
+            node=node, call_timeout=config.timeout,
+        )
+    return GovernedChatModel(
+        model=config.model,
+        temperature=0,
+        max_retries=1,
+        timeout=config.timeout,
+        node=node,
+        call_timeout=config.timeout,
+        slo_seconds=config.slo,
+        fallback=fallback,
+    )
+
+
+def _encode_result(result: ChatResult) -> dict:
+    return {
+        "generations": [
+            {"message": message_to_dict(g.message), "generation_info": g.generation_info}
+            for g in result.generations
+        ],
+        "llm_output": result.llm_output,
+    }
+
+
+def _decode_result(data: dict) -> ChatResult:
+    return ChatResult(
+        generations=[
+            ChatGeneration(
+                message=messages_from_dict([g["message"]])[0],
+                generation_info=g["generation_info"],
+            )
+            for g in data["generations"]
+        ],
+        llm_output=data["llm_output"],
+    )
@@ -0,0 +1,212 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, Callable, Dict
+
+from metrics import REGISTRY
+
+LOOP_LAG = REGISTRY.summary(
+    "event_loop_lag_seconds", "How late an event loop ran a timer it was due to run, by loop"
+)
+LOOP_LAG_LAST = REGISTRY.gauge("event_loop_lag_last_seconds", "Most recent event loop lag measurement, by loop")
+LOOP_BLOCKED = REGISTRY.counter(
+    "event_loop_blocked_total", "Times an event loop was blocked past LOOP_BLOCK_THRESHOLD, by loop"
+)
+LOOP_BLOCKED_SAMPLES = REGISTRY.counter(
+    "event_loop_blocked_samples_total",
+    "Stack samples taken while an event loop was blocked, by loop and innermost app frame (site)",
+)
+POOL_QUEUED = REGISTRY.gauge("executor_queued_tasks", "Tasks waiting for a thread, by pool")
+POOL_BUSY = REGISTRY.gauge("executor_busy_threads", "Threads running a task, by pool")
+POOL_THREADS = REGISTRY.gauge("executor_threads", "Threads started, by pool")
+POOL_MAX = REGISTRY.gauge("executor_max_threads", "Thread limit, by pool")
+OPEN_STREAMS = REGISTRY.gauge("sse_streams_open", "SSE responses currently streaming to clients")
+
+# How often the lag probe wakes up
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", 0.1))
+# The loop counts as blocked once a timer is this late; its stack is then logged
+LOOP_BLOCK_THRESHOLD = float(os.environ.get("LOOP_BLOCK_THRESHOLD", 0.25))
+LOOP_MONITOR_ENABLED = os.environ.get("LOOP_MONITOR_ENABLED", "1").lower() in ("1", "true")
+
+# Stacks logged per blocked episode (later samples show where a long block went)
+MAX_STACKS_PER_BLOCK = 5
+# Frames shown per logged stack, innermost last
+STACK_LIMIT = 25
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def pool_stats(executor: ThreadPoolExecutor) -> Dict[str, int]:
+    """Queued tasks, busy threads, started threads and the thread limit of a thread pool."""
+    threads = len(getattr(executor, "_threads", ()))
+    idle_semaphore = getattr(executor, "_idle_semaphore", None)
+    idle = idle_semaphore._value if idle_semaphore is not None else 0
+    return {
+        "queued": executor._work_queue.qsize(),
+        "busy": max(threads - idle, 0),
+        "threads": threads,
+        "max": executor._max_workers,
+    }
+
+
+def _blocking_site(frame) -> str:
+    """The innermost frame in the app's own code, else the innermost frame."""
+    innermost = frame
+    while frame is not None:
+        if frame.f_code.co_filename.startswith(_APP_DIR):
+            break
+        frame = frame.f_back
+    frame = frame or innermost
+    return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+
+
+class _WatchedLoop:
+    """A monitored event loop: the thread running it, and its probe's last heartbeat."""
+
+    def __init__(self, name: str, loop: asyncio.AbstractEventLoop, thread: int):
+        self.name = name
+        self.loop = loop
+        self.thread = thread
+        self.probing = False
+        self.heartbeat = time.monotonic()
+        self.blocked_since: float | None = None
+        self.stacks_logged = 0
+        self.last_logged = 0.0
+
+
+class LoopMonitor:
+    """
+    Watches event loops: the server's, and each graph-job worker's. A probe
+    task on each loop measures how late its timers fire (scheduling lag).
+    A watchdog thread notices when a probe stops reporting for longer than
+    the block threshold, and logs the stack of that loop's thread at that
+    moment, i.e. the code holding the loop. The watchdog also samples the
+    thread pools the loops depend on.
+    """
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, block_threshold: float = LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self._pools: Dict[str, Callable[[], ThreadPoolExecutor | None]] = {}
+        self._loops: Dict[str, _WatchedLoop] = {}
+        self._probe: asyncio.Task | None = None
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    @property
+    def running(self) -> bool:
+        return not self._stopped.is_set()
+
+    def watch_pool(self, name: str, get_executor: Callable[[], ThreadPoolExecutor | None]) -> None:
+        """Samples a thread pool's saturation as pool=`name`. The getter may return None until it exists."""
+        self._pools[name] = get_executor
+
+    def watch_loop(self, name: str, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Registers `loop` as loop=`name`, along with its default executor;
+        call from the loop's thread. It is checked while probe(name) runs on it.
+        """
+        self._loops[name] = _WatchedLoop(name, loop, threading.get_ident())
+        self.watch_pool(f"{name}-default", lambda: loop._default_executor)
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Starts the watchdog, and monitoring of `loop` as the server loop; call from the loop's thread."""
+        self._stopped.clear()
+        self.watch_loop("server", loop)
+        self._probe = loop.create_task(self.probe("server"))
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        print(f"🩺 Event loop monitor started (block threshold {self.block_threshold:.2f}s)")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._probe is not None:
+            self._probe.cancel()
+
+    async def probe(self, name: str) -> None:
+        """
+        Measures the lag of a registered loop until cancelled. Worker loops
+        only run while they have a job, so they probe per job.
+        """
+        watched = self._loops.get(name)
+        if watched is None or not self.running:
+            return
+        watched.heartbeat = time.monotonic()
+        watched.probing = True
+        try:
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                watched.heartbeat = now
+                lag = max(now - started - self.interval, 0.0)
+                LOOP_LAG.observe(lag, loop=name)
+                LOOP_LAG_LAST.set(lag, loop=name)
+        finally:
+            watched.probing = False
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.block_threshold / 2):
+            self._sample_pools()
+            for watched in list(self._loops.values()):
+                self._check(watched)
+
+    def _check(self, watched: _WatchedLoop) -> None:
+        now = time.monotonic()
+        late = now - watched.heartbeat - self.interval
+        if not watched.probing or late < self.block_threshold:
+            if watched.blocked_since is not None:
+                print(f"🩺 Event loop {watched.name} unblocked after {now - watched.blocked_since:.2f}s")
+            watched.blocked_since = None
+            return
+
+        if watched.blocked_since is None:
+            watched.blocked_since = watched.heartbeat + self.interval
+            watched.stacks_logged = 0
+            watched.last_logged = 0.0
+            LOOP_BLOCKED.inc(loop=watched.name)
+        # Sample at the threshold, then at growing gaps while the block lasts
+        if (
+            watched.stacks_logged < MAX_STACKS_PER_BLOCK
+            and now - watched.last_logged >= self.block_threshold * 2 ** watched.stacks_logged
+        ):
+            self._log_stack(watched, now - watched.blocked_since)
+            watched.stacks_logged += 1
+            watched.last_logged = now
+
+    def _log_stack(self, watched: _WatchedLoop, blocked_for: float) -> None:
+        frame = sys._current_frames().get(watched.thread)
+        if frame is None:
+            return
+        site = _blocking_site(frame)
+        LOOP_BLOCKED_SAMPLES.inc(loop=watched.name, site=site)
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT))
+        print(f"🐢 Event loop {watched.name} blocked for {blocked_for:.2f}s in {site}. Loop thread stack:\n{stack}")
+
+    def _sample_pools(self) -> None:
+        for name, get_executor in list(self._pools.items()):
+            executor = get_executor()
+            if executor is None:
+                continue
+            stats = pool_stats(executor)
+            POOL_QUEUED.set(stats["queued"], pool=name)
+            POOL_BUSY.set(stats["busy"], pool=name)
+            POOL_THREADS.set(stats["threads"], pool=name)
+            POOL_MAX.set(stats["max"], pool=name)
+
+
+async def track_stream(events: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    """Counts an SSE stream as open while it is being written to a client."""
+    OPEN_STREAMS.inc()
+    try:
+        async for event in events:
+            yield event
+    finally:
+        OPEN_STREAMS.dec()
+        await events.aclose()
+
+
+loop_monitor = LoopMonitor()
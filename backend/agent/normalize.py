@@ -0,0 +1,81 @@
+from functools import lru_cache
+from typing import Iterable, List
+
+from place_registry import PlaceRecord, stable_place_id
+
+# Google Places type -> display category used on the map and in research
+# reports. Listed in priority order: when a place has types from several
+# categories, the one listed first wins.
+CATEGORY_TYPES = [
+    ("hotel", ("lodging", "hotel", "motel")),
+    ("restaurant", ("restaurant", "cafe", "food", "bar")),
+    ("museum", ("museum",)),
+    ("park", ("park", "natural_feature", "campground")),
+    ("heritage", ("hindu_temple", "church", "mosque", "place_of_worship", "synagogue")),
+    ("city", ("locality", "city_hall", "administrative_area_level_1", "political")),
+    ("landmark", ("landmark",)),
+    ("attraction", ("tourist_attraction", "point_of_interest")),
+]
+
+# Type -> (priority, category), so a place is categorized in one pass over its types
+TYPE_CATEGORIES = {
+    place_type: (priority, category)
+    for priority, (category, place_types) in enumerate(CATEGORY_TYPES)
+    for place_type in place_types
+}
+
+# Types too generic to name a category after
+GENERIC_TYPES = frozenset({"establishment", "point_of_interest", "geocode"})
+
+
+@lru_cache(maxsize=1024)
+def _display_category(place_type: str) -> str:
+    return place_type.replace("_", " ").title()
+
+
+def categorize_place(types: Iterable[str]) -> str:
+    """
+    Maps Google Places types to the display category used on the map and
+    in research reports (hotel, restaurant, museum, park, heritage, ...).
+    Types without a category of their own fall back to the first specific
+    type (e.g. "Zoo"), then to "place".
+    """
+    best = None
+    fallback = None
+    for place_type in types:
+        match = TYPE_CATEGORIES.get(place_type)
+        if match is not None:
+            if best is None or match < best:
+                best = match
+        elif fallback is None and place_type not in GENERIC_TYPES:
+            fallback = place_type
+    if best is not None:
+        return best[1]
+    return _display_category(fallback) if fallback is not None else "place"
+
+
+def normalize_places(places: List[dict]) -> List[PlaceRecord]:
+    """
+    Normalizes a page of Places API results (or local index hits in the
+    same shape) into place records, in one pass.
+    """
+    records = []
+    for place in places:
+        name = place.get("displayName", {}).get("text", "Unknown")
+        address = place.get("formattedAddress", "Address unknown")
+        location = place.get("location", {})
+        lat, lng = location.get("latitude", 0.0), location.get("longitude", 0.0)
+        types = place.get("types", [])
+        records.append(PlaceRecord(
+            # The same place gets the same ID in every session, so sessions share its record
+            id=stable_place_id(name, address, lat, lng, place.get("id")),
+            name=name,
+            address=address,
+            lat=lat,
+            lng=lng,
+            rating=place.get("rating", 0.0),
+            type=categorize_place(types),
+            price_level=place.get("priceLevel", "UNSPECIFIED"),
+            types=types,
+        ))
+    return records
@@ -0,0 +1,330 @@
+"""
+Local full-text place index backed by SQLite FTS5.
+
+Answers search_places without the Places API, for offline development, load
+testing, and as a first-tier lookup before the paid API. Build it from a
+places dump (GeoJSON-seq OSM extracts, e.g. `osmium export -f geojsonseq`,
+or JSON lines of plain records):
+
+    python place_index.py import paris.geojsonseq --db places.db
+    python place_index.py search "museum" --location Paris --db places.db
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from normalize import categorize_place
+
+# OSM tag (key, value) -> Google Places type. A value of None matches any value.
+OSM_TAG_TYPES = {
+    ("tourism", "hotel"): "lodging",
+    ("tourism", "hostel"): "lodging",
+    ("tourism", "guest_house"): "lodging",
+    ("tourism", "motel"): "lodging",
+    ("tourism", "museum"): "museum",
+    ("tourism", "gallery"): "art_gallery",
+    ("tourism", "attraction"): "tourist_attraction",
+    ("tourism", "viewpoint"): "tourist_attraction",
+    ("tourism", "zoo"): "zoo",
+    ("tourism", "theme_park"): "amusement_park",
+    ("amenity", "restaurant"): "restaurant",
+    ("amenity", "cafe"): "cafe",
+    ("amenity", "bar"): "bar",
+    ("amenity", "pub"): "bar",
+    ("amenity", "fast_food"): "restaurant",
+    ("amenity", "place_of_worship"): "place_of_worship",
+    ("amenity", "townhall"): "city_hall",
+    ("leisure", "park"): "park",
+    ("leisure", "garden"): "park",
+    ("natural", None): "natural_feature",
+    ("historic", None): "landmark",
+    ("place", "city"): "locality",
+    ("place", "town"): "locality",
+}
+
+# The same table keyed by OSM key, then value (None for any value), so a
+# feature's tags are matched with dict lookups instead of a scan of the table
+OSM_TYPES_BY_KEY = {
+    key: {value: place_type for (k, value), place_type in OSM_TAG_TYPES.items() if k == key}
+    for key in dict.fromkeys(key for key, _ in OSM_TAG_TYPES)
+}
+
+# OSM religion tag -> more specific Google Places type for places of worship
+OSM_RELIGION_TYPES = {
+    "christian": "church",
+    "muslim": "mosque",
+    "hindu": "hindu_temple",
+    "jewish": "synagogue",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS places (
+    id INTEGER PRIMARY KEY,
+    source_id TEXT UNIQUE,
+    name TEXT NOT NULL,
+    address TEXT,
+    city TEXT,
+    lat REAL,
+    lng REAL,
+    rating REAL,
+    user_rating_count INTEGER,
+    price_level TEXT,
+    types TEXT,
+    category TEXT
+);
+CREATE INDEX IF NOT EXISTS places_lat_lng ON places(lat, lng);
+CREATE INDEX IF NOT EXISTS places_category ON places(category);
+CREATE VIRTUAL TABLE IF NOT EXISTS places_fts USING fts5(
+    name, types, address, city,
+    content='places', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+
+def _fts_terms(text: str) -> List[str]:
+    """Splits free text into quoted FTS5 terms, dropping query syntax characters."""
+    return [f'"{token}"' for token in re.findall(r"\w+", text.lower())]
+
+
+def record_from_feature(feature: dict) -> Optional[dict]:
+    """
+    Converts a dump entry into an index record. Accepts GeoJSON features with
+    OSM tags as properties, or plain records with name/lat/lng/types fields.
+    Returns None for entries without a name or coordinates.
+    """
+    if feature.get("type") == "Feature":
+        tags = feature.get("properties") or {}
+        geometry = feature.get("geometry") or {}
+        coordinates = geometry.get("coordinates") or []
+        if geometry.get("type") != "Point" or len(coordinates) < 2:
+            return None
+        lng, lat = coordinates[0], coordinates[1]
+
+        types = []
+        for key, types_by_value in OSM_TYPES_BY_KEY.items():
+            if key not in tags:
+                continue
+            place_type = types_by_value.get(tags[key]) or types_by_value.get(None)
+            if place_type and place_type not in types:
+                types.append(place_type)
+        religion_type = OSM_RELIGION_TYPES.get(tags.get("religion"))
+        if religion_type and "place_of_worship" in types:
+            types.insert(0, religion_type)
+        if not types:
+            types = ["point_of_interest"]
+
+        address = ", ".join(
+            part for part in [
+                " ".join(p for p in [tags.get("addr:housenumber"), tags.get("addr:street")] if p),
+                tags.get("addr:city"),
+            ] if part
+        )
+        record = {
+            "source_id": f"{feature.get('id') or tags.get('@id') or ''}",
+            "name": tags.get("name") or tags.get("name:en"),
+            "address": address,
+            "city": tags.get("addr:city", ""),
+            "lat": lat,
+            "lng": lng,
+            "rating": float(tags["rating"]) if "rating" in tags else None,
+            "user_rating_count": None,
+            "price_level": "UNSPECIFIED",
+            "types": types,
+        }
+    else:
+        record = {
+            "source_id": f"{feature.get('id', '')}",
+            "name": feature.get("name"),
+            "address": feature.get("address", ""),
+            "city": feature.get("city", ""),
+            "lat": feature.get("lat"),
+            "lng": feature.get("lng", feature.get("lon")),
+            "rating": feature.get("rating"),
+            "user_rating_count": feature.get("user_rating_count"),
+            "price_level": feature.get("price_level", "UNSPECIFIED"),
+            "types": feature.get("types") or ["point_of_interest"],
+        }
+
+    if not record["name"] or record["lat"] is None or record["lng"] is None:
+        return None
+    if not record["source_id"]:
+        record["source_id"] = f"{record['name']}@{record['lat']:.5f},{record['lng']:.5f}"
+    record["category"] = categorize_place(record["types"])
+    return record
+
+
+class PlaceIndex:
+    """SQLite FTS5 index of places, safe to query from several threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def import_records(self, records: Iterable[dict], batch_size: int = 5000) -> int:
+        """Inserts or replaces records and keeps the full-text index in sync. Returns the count."""
+        conn = self._connection()
+        count = 0
+        batch = []
+
+        def flush():
+            conn.executemany(
+                """
+                INSERT INTO places (source_id, name, address, city, lat, lng, rating,
+                                    user_rating_count, price_level, types, category)
+                VALUES (:source_id, :name, :address, :city, :lat, :lng, :rating,
+                        :user_rating_count, :price_level, :types, :category)
+                ON CONFLICT(source_id) DO UPDATE SET
+                    name=excluded.name, address=excluded.address, city=excluded.city,
+                    lat=excluded.lat, lng=excluded.lng, rating=excluded.rating,
+                    user_rating_count=excluded.user_rating_count,
+                    price_level=excluded.price_level, types=excluded.types,
+                    category=excluded.category
+                """,
+                batch,
+            )
+            batch.clear()
+
+        for record in records:
+            batch.append({**record, "types": " ".join(record["types"])})
+            count += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+        conn.execute("INSERT INTO places_fts(places_fts) VALUES ('rebuild')")
+        conn.commit()
+        return count
+
+    def search(
+        self,
+        query: str,
+        location: str = "",
+        category: Optional[str] = None,
+        min_rating: Optional[float] = None,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        limit: int = 15,
+    ) -> List[dict]:
+        """
+        Full-text search for places matching `query` near `location`.
+        Optional filters: display category, minimum rating, and a bounding
+        box given as (south, west, north, east). Results are sorted by
+        rating and returned in the Places API response shape, so they go
+        through the same normalization as API results.
+        """
+        match_parts = []
+        query_terms = _fts_terms(query)
+        if query_terms:
+            match_parts.append("{name types address} : (" + " OR ".join(query_terms) + ")")
+        location_terms = _fts_terms(location.split(",")[0]) if location else []
+        if location_terms and not bbox:
+            match_parts.append("{city address} : (" + " ".join(location_terms) + ")")
+
+        sql = "SELECT p.* FROM places p"
+        params: list = []
+        where = []
+        if match_parts:
+            sql += " JOIN places_fts f ON f.rowid = p.id"
+            where.append("places_fts MATCH ?")
+            params.append(" AND ".join(match_parts))
+        if category:
+            where.append("p.category = ?")
+            params.append(category)
+        if min_rating is not None:
+            where.append("p.rating >= ?")
+            params.append(min_rating)
+        if bbox:
+            south, west, north, east = bbox
+            where.append("p.lat BETWEEN ? AND ? AND p.lng BETWEEN ? AND ?")
+            params.extend([south, north, west, east])
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY p.rating IS NULL, p.rating DESC LIMIT ?"
+        params.append(limit)
+
+        rows = self._connection().execute(sql, params).fetchall()
+        return [
+            {
+                "displayName": {"text": row["name"]},
+                "formattedAddress": row["address"] or row["city"] or "Address unknown",
+                "rating": row["rating"] or 0.0,
+                "userRatingCount": row["user_rating_count"],
+                "location": {"latitude": row["lat"], "longitude": row["lng"]},
+                "priceLevel": row["price_level"] or "UNSPECIFIED",
+                "types": (row["types"] or "").split(),
+            }
+            for row in rows
+        ]
+
+
+def read_dump(path: str) -> Iterable[dict]:
+    """Yields index records from a GeoJSON-seq or JSON-lines dump."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            # GeoJSON text sequences prefix each record with an RS character
+            line = line.strip().lstrip("\x1e")
+            if not line:
+                continue
+            record = record_from_feature(json.loads(line))
+            if record:
+                yield record
+
+
+_default_index: Optional[PlaceIndex] = None
+
+
+def get_place_index() -> Optional[PlaceIndex]:
+    """Returns the index configured by PLACE_INDEX_PATH, or None if there is none."""
+    global _default_index
+    path = os.environ.get("PLACE_INDEX_PATH")
+    if not path or not os.path.exists(path):
+        return None
+    if _default_index is None or _default_index.path != path:
+        _default_index = PlaceIndex(path)
+    return _default_index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the local place index.")
+    parser.add_argument("--db", default=os.environ.get("PLACE_INDEX_PATH", "places.db"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_cmd = commands.add_parser("import", help="Import a GeoJSON-seq or JSON-lines places dump")
+    import_cmd.add_argument("dump")
+
+    search_cmd = commands.add_parser("search", help="Run a query against the index")
+    search_cmd.add_argument("query")
+    search_cmd.add_argument("--location", default="")
+    search_cmd.add_argument("--category")
+    search_cmd.add_argument("--min-rating", type=float)
+    search_cmd.add_argument("--limit", type=int, default=15)
+
+    args = parser.parse_args()
+    index = PlaceIndex(args.db)
+
+    if args.command == "import":
+        started = time.perf_counter()
+        count = index.import_records(read_dump(args.dump))
+        print(f"📥 Imported {count} places into {args.db} in {time.perf_counter() - started:.1f}s")
+    else:
+        started = time.perf_counter()
+        results = index.search(args.query, args.location, args.category, args.min_rating, limit=args.limit)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for place in results:
+            print(f"- {place['displayName']['text']} ({place['rating']}★): {place['formattedAddress']}")
+        print(f"{len(results)} results in {elapsed_ms:.2f} ms")
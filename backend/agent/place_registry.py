@@ -0,0 +1,175 @@
+import hashlib
+import os
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Iterable, List
+
+from metrics import REGISTRY
+
+PLACES_INTERNED = REGISTRY.gauge("place_registry_records", "Distinct place records held by the place registry")
+INTERN_LOOKUPS = REGISTRY.counter(
+    "place_registry_interns_total", "Places interned, by whether an identical record was already held (hit, new, variant)"
+)
+PLACES_EVICTED = REGISTRY.counter("place_registry_evictions_total", "Place records evicted as least recently used")
+PLACES_UNRESOLVED = REGISTRY.counter(
+    "place_registry_unresolved_total", "Place IDs looked up that the registry no longer (or never) held"
+)
+
+# Records kept before the least recently used are evicted
+PLACE_REGISTRY_MAX_RECORDS = int(os.environ.get("PLACE_REGISTRY_MAX_RECORDS", 50_000))
+
+RECORD_FIELDS = ("id", "name", "address", "lat", "lng", "rating", "type", "price_level", "types")
+
+
+class PlaceRecord:
+    """
+    One place as search found it: immutable, and shared by every session
+    that found it. Strings that repeat across places (types, categories,
+    price levels) are interned.
+    """
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, id: str, name: str, address: str, lat: float, lng: float, rating: float,
+                 type: str, price_level: str, types: Iterable[str]):
+        values = (id, name, address, float(lat), float(lng), float(rating or 0.0),
+                  sys.intern(type), sys.intern(price_level), tuple(sys.intern(t) for t in types))
+        for field, value in zip(RECORD_FIELDS, values):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PlaceRecord is immutable")
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PlaceRecord) and all(
+            getattr(self, field) == getattr(other, field) for field in RECORD_FIELDS
+        )
+
+    def to_dict(self) -> dict:
+        """The found_places shape sent to clients."""
+        place = {field: getattr(self, field) for field in RECORD_FIELDS}
+        place["types"] = list(self.types)
+        return place
+
+    def with_id(self, place_id: str) -> "PlaceRecord":
+        return PlaceRecord(place_id, *(getattr(self, field) for field in RECORD_FIELDS[1:]))
+
+    def content_digest(self) -> str:
+        raw = "|".join(repr(getattr(self, field)) for field in RECORD_FIELDS[1:])
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=3).hexdigest()
+
+
+def stable_place_id(name: str, address: str, lat: float, lng: float, source_id: str | None = None) -> str:
+    """
+    ID of a place that is the same in every session: derived from the
+    upstream ID when there is one, else from the name, address and
+    coordinates. Keeps a readable slug, since the agents pass these IDs
+    to tools.
+    """
+    key = source_id or f"{name}|{address}|{lat:.5f}|{lng:.5f}"
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4).hexdigest()
+    return f"place_{name.replace(' ', '_').lower()}_{digest}"
+
+
+class PlaceRegistry:
+    """
+    Process-wide store of interned place records. Session state keeps only
+    place IDs (found_places) and its own per-session fields (selection,
+    research reports), so a popular place costs one record however many
+    sessions and checkpoints refer to it. Records are hydrated back into
+    dicts where places leave the process: SSE events, snapshots, prompts.
+
+    Records are held in memory only, up to `max_records` (least recently
+    used evicted first). IDs whose record is gone, after an eviction or a
+    restart, are skipped by hydrate and counted; see unresolved_place_ids.
+    """
+
+    def __init__(self, max_records: int = PLACE_REGISTRY_MAX_RECORDS):
+        self._records: OrderedDict[str, PlaceRecord] = OrderedDict()
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self._epoch = uuid.uuid4().hex[:8]
+        self._evictions = 0
+
+    def intern(self, record: PlaceRecord) -> str:
+        """
+        Stores a found place, reusing the held record if nothing changed, and
+        returns its ID. Records are never replaced: a place that changed since
+        (e.g. a new rating) is stored as a variant with its own ID, so
+        sessions that already hold the old ID keep seeing what they found.
+        """
+        outcome = "new"
+        with self._lock:
+            held = self._records.get(record.id)
+            if held is not None and held != record:
+                outcome = "variant"
+                record = record.with_id(f"{record.id}_{record.content_digest()}")
+                held = self._records.get(record.id)
+            if held is not None:
+                self._records.move_to_end(held.id)
+                INTERN_LOOKUPS.inc(outcome="hit")
+                return held.id
+            self._records[record.id] = record
+            while len(self._records) > self.max_records:
+                self._records.popitem(last=False)
+                self._evictions += 1
+                PLACES_EVICTED.inc()
+            PLACES_INTERNED.set(len(self._records))
+        INTERN_LOOKUPS.inc(outcome=outcome)
+        return record.id
+
+    @property
+    def version(self) -> str:
+        """
+        Changes whenever an ID could hydrate differently than before: held
+        records are never replaced, so only evictions and a restart (a new
+        registry) do that.
+        """
+        return f"{self._epoch}-{self._evictions}"
+
+    def get(self, place_id: str) -> PlaceRecord | None:
+        with self._lock:
+            record = self._records.get(place_id)
+            if record is not None:
+                self._records.move_to_end(place_id)
+        if record is None:
+            PLACES_UNRESOLVED.inc()
+        return record
+
+    def hydrate(self, place_ids: Iterable[str]) -> List[dict]:
+        """Place dicts for the given IDs, skipping any the registry doesn't hold."""
+        return [record.to_dict() for record in map(self.get, place_ids) if record is not None]
+
+    def missing(self, place_ids: Iterable[str]) -> List[str]:
+        """The given IDs the registry doesn't hold, without counting them as lookups."""
+        return [place_id for place_id in place_ids if place_id not in self._records]
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+place_registry = PlaceRegistry()
+
+
+def found_places_of(state: dict) -> List[dict]:
+    """The session's found places, as dicts."""
+    return place_registry.hydrate(state.get("found_places", []))
+
+
+def unresolved_place_ids(state: dict) -> List[str]:
+    """
+    Found places the session refers to whose record is gone (evicted, or
+    the server restarted since the search). They have to be searched again.
+    """
+    return place_registry.missing(state.get("found_places", []))
+
+
+def researched_places_of(state: dict) -> List[dict]:
+    """The session's researched places: the shared place fields plus the session's research."""
+    researched = []
+    for entry in state.get("researched_places", []):
+        record = place_registry.get(entry["id"])
+        researched.append({**(record.to_dict() if record else {}), **entry})
+    return researched
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from typing import Dict, List
+
+from ratelimit import request_priority
+from tools import warm_place_research
+
+
+class ResearchPrefetcher:
+    """
+    Warms the research enrichment caches while the graph is paused at
+    select_locations, so research_place is mostly served from cache once
+    the user confirms their selection.
+
+    One cancellable task per thread; a global semaphore caps how many
+    lookups run at once across all sessions. Tasks run on the loop given
+    to bind() (the server's), so graph job threads can schedule them.
+    """
+
+    def __init__(self, top_n: int = 5, max_concurrency: int = 4):
+        self.top_n = top_n
+        self.max_concurrency = max_concurrency
+        self._tasks: Dict[str, Future] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Runs prefetches on `loop` from now on, whichever thread schedules them."""
+        self._loop = loop
+
+    def schedule(self, thread_id: str, found_places: List[dict]) -> None:
+        """Starts prefetching the top-N places by rating, replacing any previous task for the thread."""
+        self.cancel(thread_id)
+        if self.top_n <= 0 or not found_places:
+            return
+
+        candidates = sorted(found_places, key=lambda p: p.get("rating") or 0, reverse=True)[: self.top_n]
+        print(f"🔮 Prefetching research data for {len(candidates)} places ({thread_id})")
+
+        loop = self._loop or asyncio.get_running_loop()
+        task = asyncio.run_coroutine_threadsafe(self._run(candidates), loop)
+        with self._lock:
+            self._tasks[thread_id] = task
+        task.add_done_callback(lambda t: self._forget(thread_id, t))
+
+    def cancel(self, thread_id: str) -> None:
+        """Cancels the pending prefetch for a thread, if any."""
+        with self._lock:
+            task = self._tasks.pop(thread_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    async def _run(self, places: List[dict]) -> None:
+        # Speculative work must not delay interactive upstream calls
+        request_priority.set("batch")
+        await asyncio.gather(*(self._warm(place) for place in places))
+
+    async def _warm(self, place: dict) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            await asyncio.to_thread(warm_place_research, place)
+
+    def _forget(self, thread_id: str, task: Future) -> None:
+        with self._lock:
+            if self._tasks.get(thread_id) is task:
+                del self._tasks[thread_id]
+
+
+prefetcher = ResearchPrefetcher(
+    top_n=int(os.environ.get("PREFETCH_TOP_N", 5)),
+    max_concurrency=int(os.environ.get("PREFETCH_MAX_CONCURRENCY", 4)),
+)
@@ -0,0 +1,162 @@
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict
+
+# Sampling period while a session is being profiled
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+
+# How many finished profiles are kept for download
+MAX_STORED_PROFILES = int(os.environ.get("PROFILE_STORE_SIZE", 50))
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of the threads currently doing work for one
+    session. Threads register themselves (graph nodes, tools, upstream I/O)
+    for as long as they work on the session, so unrelated sessions sharing
+    the process don't show up in the profile.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._threads: Dict[int, list] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler: threading.Thread | None = None
+
+    def add_thread(self, ident: int, role: str) -> None:
+        with self._lock:
+            self._threads.setdefault(ident, []).append(role)
+
+    def remove_thread(self, ident: int) -> None:
+        with self._lock:
+            roles = self._threads.get(ident)
+            if roles:
+                roles.pop()
+                if not roles:
+                    del self._threads[ident]
+
+    def start(self) -> None:
+        self._sampler = threading.Thread(target=self._run, name="session-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                watched = {ident: roles[-1] for ident, roles in self._threads.items()}
+            if not watched:
+                continue
+            frames = sys._current_frames()
+            for ident, role in watched.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[_fold(frame, role)] += 1
+
+    def folded(self) -> str:
+        """Returns the samples in folded-stack format (flamegraph.pl, speedscope)."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _fold(frame, role: str) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.append(role)
+    return ";".join(reversed(stack))
+
+
+# Profiler of the session the current context works for, if profiling is on
+current_profiler: ContextVar[SamplingProfiler | None] = ContextVar("current_profiler", default=None)
+
+
+@contextmanager
+def profile_thread(role: str):
+    """Registers the calling thread with the session's profiler, if there is one."""
+    profiler = current_profiler.get()
+    if profiler is None:
+        yield
+        return
+    ident = threading.get_ident()
+    profiler.add_thread(ident, role)
+    try:
+        yield
+    finally:
+        profiler.remove_thread(ident)
+
+
+def profiled(role: str):
+    """
+    Decorator for graph nodes and tools. When profiling is off it costs a
+    single ContextVar lookup per call.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current_profiler.get() is None:
+                return fn(*args, **kwargs)
+            with profile_thread(role):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ProfileStore:
+    """Keeps the most recent profiles by thread_id, merging repeated runs of a session."""
+
+    def __init__(self, max_profiles: int = MAX_STORED_PROFILES):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, SamplingProfiler]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, thread_id: str, profiler: SamplingProfiler) -> None:
+        with self._lock:
+            existing = self._profiles.pop(thread_id, None)
+            if existing is not None:
+                profiler.samples.update(existing.samples)
+            self._profiles[thread_id] = profiler
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, thread_id: str) -> SamplingProfiler | None:
+        with self._lock:
+            return self._profiles.get(thread_id)
+
+
+profiles = ProfileStore()
+
+
+@contextmanager
+def profile_session(thread_id: str, enabled: bool):
+    """
+    Profiles everything run inside the block for a session when enabled, and
+    stores the result under its thread_id.
+    """
+    if not enabled:
+        yield
+        return
+    profiler = SamplingProfiler()
+    token = current_profiler.set(profiler)
+    started = time.monotonic()
+    profiler.start()
+    try:
+        with profile_thread("event-loop"):
+            yield
+    finally:
+        profiler.stop()
+        current_profiler.reset(token)
+        profiles.save(thread_id, profiler)
+        print(f"🔬 Profiled {thread_id}: {sum(profiler.samples.values())} samples over {time.monotonic() - started:.1f}s")
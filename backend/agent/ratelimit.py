@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from metrics import REGISTRY
+from runs import UpstreamTimeout, check_cancelled
+
+# Lower value wins when several callers wait for the same token
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+# Priority class of the work running in the current context.
+# Batch jobs and speculative background work set this to "batch".
+request_priority: ContextVar[str] = ContextVar("request_priority", default="interactive")
+
+QUEUE_WAIT = REGISTRY.summary(
+    "rate_limit_wait_seconds", "Time spent queued for an upstream rate-limit token"
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "rate_limit_queue_depth", "Callers currently waiting for an upstream rate-limit token"
+)
+THROTTLED = REGISTRY.counter(
+    "rate_limit_throttled_total", "Upstream 429 responses that paused the governor"
+)
+GAVE_UP = REGISTRY.counter(
+    "rate_limit_gave_up_total", "Callers that left the token queue, by reason (cancelled, timeout)"
+)
+
+# Longest a waiter sleeps before re-checking its run and deadline
+WAIT_SLICE_SECONDS = 0.1
+
+
+class TokenBucketGovernor:
+    """
+    Token bucket shared by every caller of one upstream API.
+
+    Callers block in acquire() until a token is available. Waiters are served
+    by priority class first and arrival order second, so interactive sessions
+    overtake queued batch work. pause_for() honours Retry-After by holding
+    back all tokens until the upstream is ready again. A waiter whose run is
+    cancelled, or whose timeout runs out, leaves the queue instead of
+    taking a token it can no longer use.
+    """
+
+    def __init__(self, name: str, rate_per_second: float, burst: int):
+        self.name = name
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: list = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority: str | None = None, timeout: float | None = None) -> float:
+        """
+        Blocks until a token is granted and returns the time spent waiting.
+        Raises RunCancelled if the current run is cancelled while waiting,
+        and UpstreamTimeout if no token came within `timeout` seconds.
+        """
+        priority = priority or request_priority.get()
+        entry = (PRIORITIES.get(priority, len(PRIORITIES)), next(self._sequence))
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+
+        with self._condition:
+            heapq.heappush(self._waiters, entry)
+            QUEUE_DEPTH.inc(upstream=self.name)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == entry and self._tokens >= 1 and now >= self._paused_until:
+                        heapq.heappop(self._waiters)
+                        self._tokens -= 1
+                        break
+                    self._give_up_if_done(deadline, now)
+                    wait = self._wait_timeout(now, is_head=self._waiters[0] == entry)
+                    self._condition.wait(WAIT_SLICE_SECONDS if wait is None else min(wait, WAIT_SLICE_SECONDS))
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                raise
+            finally:
+                QUEUE_DEPTH.dec(upstream=self.name)
+                # Let the next waiter in line re-check the bucket
+                self._condition.notify_all()
+
+        waited = time.monotonic() - started
+        QUEUE_WAIT.observe(waited, upstream=self.name, priority=priority)
+        return waited
+
+    def _give_up_if_done(self, deadline: float | None, now: float) -> None:
+        try:
+            check_cancelled(self.name)
+        except BaseException:
+            GAVE_UP.inc(upstream=self.name, reason="cancelled")
+            raise
+        if deadline is not None and now >= deadline:
+            GAVE_UP.inc(upstream=self.name, reason="timeout")
+            raise UpstreamTimeout(f"No {self.name} rate-limit token in time")
+
+    def pause_for(self, seconds: float) -> None:
+        """Stops granting tokens for `seconds` (e.g. from a Retry-After header)."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = min(self._tokens, 0.0)
+            THROTTLED.inc(upstream=self.name)
+            self._condition.notify_all()
+        print(f"⏳ {self.name} throttled upstream; pausing for {seconds:.1f}s")
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate_per_second)
+
+    def _wait_timeout(self, now: float, is_head: bool) -> float | None:
+        if not is_head:
+            # Woken by notify_all when the head is served
+            return None
+        if now < self._paused_until:
+            return self._paused_until - now
+        return max((1 - self._tokens) / self.rate_per_second, 0.001)
+
+
+# One governor per upstream quota, shared by interactive and batch traffic
+GOVERNORS = {
+    "gemini": TokenBucketGovernor(
+        "gemini",
+        rate_per_second=float(os.environ.get("GEMINI_RPM", 60)) / 60,
+        burst=int(os.environ.get("GEMINI_BURST", 5)),
+    ),
+    "places": TokenBucketGovernor(
+        "places",
+        rate_per_second=float(os.environ.get("PLACES_QPS", 10)),
+        burst=int(os.environ.get("PLACES_BURST", 10)),
+    ),
+    "wikipedia": TokenBucketGovernor(
+        "wikipedia",
+        rate_per_second=float(os.environ.get("WIKIPEDIA_QPS", 5)),
+        burst=int(os.environ.get("WIKIPEDIA_BURST", 5)),
+    ),
+    "weather": TokenBucketGovernor(
+        "weather",
+        rate_per_second=float(os.environ.get("WEATHER_QPS", 5)),
+        burst=int(os.environ.get("WEATHER_BURST", 5)),
+    ),
+}
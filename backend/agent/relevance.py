@@ -0,0 +1,100 @@
+"""
+Local relevance ranking of found places against the user's description.
+
+Texts are embedded with a hashed n-gram model (word unigrams plus
+character trigrams, hashed into a fixed number of buckets), so there is
+nothing to download or train, and misspellings and plurals still match.
+All candidates are scored with one matrix-vector product.
+"""
+import hashlib
+import os
+import re
+from functools import lru_cache
+from typing import List, Set, Tuple
+
+import numpy as np
+
+from metrics import REGISTRY
+
+PLACES_PRUNED = REGISTRY.counter(
+    "relevance_places_pruned_total", "Found places dropped as irrelevant to the user's description"
+)
+
+# Buckets of the hashed n-gram space
+RELEVANCE_DIM = int(os.environ.get("RELEVANCE_DIM", 4096))
+# Places scoring below this are dropped (0 keeps all; cosine scores are 0-1)
+RELEVANCE_MIN_SCORE = float(os.environ.get("RELEVANCE_MIN_SCORE", 0))
+# At most this many places are kept per search (0 keeps all)
+RELEVANCE_MAX_PLACES = int(os.environ.get("RELEVANCE_MAX_PLACES", 0))
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _features(text: str) -> List[str]:
+    words = _WORD.findall(text.lower().replace("_", " "))
+    features = list(words)
+    for word in words:
+        padded = f"<{word}>"
+        features.extend(padded[i : i + 3] for i in range(len(padded) - 2))
+    return features
+
+
+@lru_cache(maxsize=65536)
+def _bucket(feature: str, dim: int) -> int:
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little") % dim
+
+
+def embed(texts: List[str], dim: int = RELEVANCE_DIM) -> np.ndarray:
+    """Embeds texts as L2-normalized rows of hashed n-gram counts."""
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            rows.append(row)
+            cols.append(_bucket(feature, dim))
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    np.add.at(vectors, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def place_text(place: dict) -> str:
+    """What a place is matched on: its name, category and Places types."""
+    return " ".join([place.get("name", ""), place.get("type", ""), *place.get("types", [])])
+
+
+def score_places(description: str, places: List[dict]) -> np.ndarray:
+    """Cosine similarity of each place to the description."""
+    vectors = embed([description] + [place_text(place) for place in places])
+    return vectors[1:] @ vectors[0]
+
+
+def rank_places(
+    description: str,
+    places: List[dict],
+    min_score: float = RELEVANCE_MIN_SCORE,
+    max_places: int = RELEVANCE_MAX_PLACES,
+    keep: Set[str] = frozenset(),
+) -> List[Tuple[dict, float]]:
+    """
+    Orders places by relevance to the description, best first, breaking
+    ties by rating, and drops those below `min_score` or past `max_places`.
+    Places whose ID is in `keep` (e.g. found earlier in the session) are
+    ranked but never dropped, nor counted against `max_places`.
+    Without a description the places are returned as they are.
+    """
+    if not description.strip() or not places:
+        return [(place, 0.0) for place in places]
+
+    scores = score_places(description, places)
+    ratings = np.array([place.get("rating") or 0.0 for place in places], dtype=np.float32)
+    order = np.lexsort((-ratings, -scores))
+    kept = np.array([place["id"] in keep for place in places], dtype=bool)[order]
+    candidate = ~kept
+    if min_score > 0:
+        candidate &= scores[order] >= min_score
+    if max_places > 0:
+        candidate &= np.cumsum(candidate) <= max_places
+    order = order[kept | candidate]
+    PLACES_PRUNED.inc(len(places) - len(order))
+    return [(places[i], float(scores[i])) for i in order]
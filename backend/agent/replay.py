@@ -0,0 +1,118 @@
+"""
+Replays a recorded session cassette offline against the current build and
+reports per-step latency differences.
+
+Record cassettes by running the server with CASSETTE_MODE=record, then:
+
+    python replay.py cassettes/trip_<id>.jsonl.gz
+    python replay.py cassettes/*.jsonl.gz --max-regression 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+# Upstream responses come from the cassette; dummy keys keep the clients from
+# refusing to start and make search_places take the same API path as recorded.
+os.environ.setdefault("GOOGLE_API_KEY", "replay")
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "replay")
+
+from langchain_core.messages import HumanMessage
+
+from cassette import Cassette, current_cassette
+from graph import app as agent_graph
+from sessions import build_initial_state, build_resume_update
+
+
+async def replay(cassette: Cassette) -> dict:
+    """Drives the graph with the cassette's inputs and compares step timings."""
+    current_cassette.set(cassette)
+    config = {"configurable": {"thread_id": f"replay_{cassette.thread_id}"}}
+
+    started = time.perf_counter()
+    for entry in cassette.inputs:
+        payload = entry["payload"]
+        if entry["endpoint"] == "plan":
+            state = build_initial_state(
+                payload["query"], payload["budget"], payload["location"], payload.get("description", "")
+            )
+            await agent_graph.ainvoke(state, config)
+        else:
+            updates, message = build_resume_update(
+                payload["action"], payload.get("selected_places"), payload.get("message", "")
+            )
+            await agent_graph.aupdate_state(config, {**updates, "messages": [HumanMessage(content=message)]})
+            await agent_graph.ainvoke(None, config)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    recorded = cassette.recorded_steps
+    replayed = cassette.steps
+    steps = []
+    for i in range(max(len(recorded), len(replayed))):
+        before = recorded[i] if i < len(recorded) else None
+        after = replayed[i] if i < len(replayed) else None
+        steps.append({
+            "step": i + 1,
+            "node": (after or before)["node"],
+            "diverged": bool(before and after and before["node"] != after["node"]),
+            "recorded_ms": before["latency_ms"] if before else None,
+            "replayed_ms": after["latency_ms"] if after else None,
+        })
+
+    recorded_total = sum(s["latency_ms"] for s in recorded)
+    replayed_total = sum(s["latency_ms"] for s in replayed)
+    return {
+        "thread_id": cassette.thread_id,
+        "steps": steps,
+        "recorded_total_ms": round(recorded_total, 3),
+        "replayed_total_ms": round(replayed_total, 3),
+        "wall_ms": round(elapsed_ms, 3),
+        "change_pct": round((replayed_total - recorded_total) / recorded_total * 100, 1) if recorded_total else None,
+        "request_mismatches": cassette.mismatches,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"\n📼 {report['thread_id']}")
+    print(f"{'step':>4}  {'node':<18}{'recorded ms':>12}{'replayed ms':>12}{'delta ms':>10}")
+    for step in report["steps"]:
+        recorded, replayed = step["recorded_ms"], step["replayed_ms"]
+        delta = f"{replayed - recorded:+.1f}" if recorded is not None and replayed is not None else "-"
+        flag = "  ⚠️ diverged" if step["diverged"] else ""
+        print(
+            f"{step['step']:>4}  {step['node']:<18}"
+            f"{recorded if recorded is not None else '-':>12}"
+            f"{replayed if replayed is not None else '-':>12}{delta:>10}{flag}"
+        )
+    print(
+        f"Total: {report['recorded_total_ms']} ms recorded vs {report['replayed_total_ms']} ms replayed "
+        f"({report['change_pct']}%), {report['request_mismatches']} request mismatches"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded sessions and compare step latencies.")
+    parser.add_argument("cassettes", nargs="+")
+    parser.add_argument(
+        "--no-simulate-latency", action="store_true",
+        help="Serve upstream responses instantly instead of with their recorded latency"
+    )
+    parser.add_argument("--max-regression", type=float, help="Exit non-zero if any session slows down by more than this percent")
+    parser.add_argument("--json", action="store_true", help="Print reports as JSON lines")
+    args = parser.parse_args()
+
+    regressed = False
+    for path in args.cassettes:
+        cassette = Cassette.load(path)
+        cassette.simulate_latency = not args.no_simulate_latency
+        report = asyncio.run(replay(cassette))
+        if args.json:
+            print(json.dumps(report))
+        else:
+            print_report(report)
+        if args.max_regression is not None and (report["change_pct"] or 0) > args.max_regression:
+            regressed = True
+
+    sys.exit(1 if regressed else 0)
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import ContextVar, copy_context
+from typing import Any, Callable, Dict
+
+from metrics import REGISTRY
+from monitor import loop_monitor
+from profiling import profile_thread
+
+ACTIVE_RUNS = REGISTRY.gauge("graph_runs_active", "Graph runs currently executing")
+RUNS_CANCELLED = REGISTRY.counter(
+    "graph_runs_cancelled_total", "Graph runs cancelled before completion (e.g. client disconnected)"
+)
+CANCELLED_RUN_SECONDS = REGISTRY.summary(
+    "graph_run_cancelled_after_seconds", "How long cancelled runs had been executing"
+)
+CALLS_ABORTED = REGISTRY.counter(
+    "upstream_calls_aborted_total", "LLM and HTTP calls skipped or abandoned because their run was cancelled"
+)
+CALLS_TIMED_OUT = REGISTRY.counter(
+    "upstream_calls_timed_out_total", "LLM and HTTP calls abandoned because they outlived their timeout"
+)
+ABANDONED_RUNNING = REGISTRY.gauge(
+    "upstream_calls_abandoned_running", "Abandoned upstream calls still holding an upstream-io thread"
+)
+
+# How often a cancellable call checks whether its run was cancelled
+CANCEL_POLL_SECONDS = 0.1
+
+# Worker threads that carry blocking upstream I/O for cancellable runs. An
+# abandoned call keeps its thread until the client's own timeout ends it, so
+# every upstream client must be given one (see models.model_for, upstream.py)
+UPSTREAM_IO_WORKERS = int(os.environ.get("UPSTREAM_IO_WORKERS", 32))
+_IO_POOL = ThreadPoolExecutor(max_workers=UPSTREAM_IO_WORKERS, thread_name_prefix="upstream-io")
+loop_monitor.watch_pool("upstream-io", lambda: _IO_POOL)
+
+
+class RunCancelled(BaseException):
+    """
+    Raised inside a graph run once its run has been cancelled.
+    Like asyncio.CancelledError it is a BaseException, so the tools'
+    broad `except Exception` fallbacks don't swallow it.
+    """
+
+
+class UpstreamTimeout(TimeoutError):
+    """Raised when an upstream call outlives its timeout. The call is abandoned."""
+
+
+class RunContext:
+    """
+    Handle for one graph execution on a thread.
+    Sync nodes and tools see it through `current_run` and stop at the next
+    LLM or HTTP boundary once it is cancelled.
+    """
+
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.started_at = time.monotonic()
+        self._cancelled = threading.Event()
+        # Receives progress events (e.g. map patches) pushed mid-step; set by the SSE stream
+        self.listener: Callable[[dict], None] | None = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def check(self, upstream: str = "graph") -> None:
+        """Raises RunCancelled if the run was cancelled."""
+        if self._cancelled.is_set():
+            CALLS_ABORTED.inc(upstream=upstream)
+            raise RunCancelled(f"Run for {self.thread_id} was cancelled")
+
+    def emit(self, event: dict) -> None:
+        """Pushes a progress event to the run's client. Safe to call from any thread."""
+        if self.listener is not None and not self._cancelled.is_set():
+            self.listener(event)
+
+
+# The run the current context is executing for, if any
+current_run: ContextVar[RunContext | None] = ContextVar("current_run", default=None)
+
+
+def check_cancelled(upstream: str = "graph") -> None:
+    """Raises RunCancelled if the current context's run was cancelled."""
+    run = current_run.get()
+    if run is not None:
+        run.check(upstream)
+
+
+def emit_event(event: dict) -> None:
+    """Pushes a progress event to the current context's run, if anyone is listening."""
+    run = current_run.get()
+    if run is not None:
+        run.emit(event)
+
+
+def run_cancellable(upstream: str, fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+    """
+    Runs a blocking upstream call so that the caller is released as soon as
+    its run is cancelled. The abandoned call finishes in the background and
+    its result is discarded.
+    """
+    return run_with_timeout(upstream, None, fn, *args, **kwargs)
+
+
+def run_with_timeout(upstream: str, timeout: float | None, fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+    """
+    Like run_cancellable, but also gives up with UpstreamTimeout once
+    `timeout` seconds have passed, whether or not there is a run.
+    The arguments before `fn` are positional-only, so `fn` may take its
+    own `timeout` keyword (e.g. requests).
+    """
+    run = current_run.get()
+    if run is None and timeout is None:
+        return fn(*args, **kwargs)
+
+    if run is not None:
+        run.check(upstream)
+    if timeout is not None and timeout <= 0:
+        # Out of time already: don't start a call whose answer would be discarded
+        CALLS_TIMED_OUT.inc(upstream=upstream)
+        raise UpstreamTimeout(f"No time left for the {upstream} call")
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    context = copy_context()
+    future = _IO_POOL.submit(context.run, _run_detached, fn, args, kwargs)
+    while True:
+        poll = CANCEL_POLL_SECONDS if deadline is None else max(min(CANCEL_POLL_SECONDS, deadline - time.monotonic()), 0)
+        done, _ = wait([future], timeout=poll, return_when=FIRST_COMPLETED)
+        if done:
+            return future.result()
+        if run is not None and run.cancelled:
+            _abandon(future)
+            run.check(upstream)
+        if deadline is not None and time.monotonic() >= deadline:
+            _abandon(future)
+            CALLS_TIMED_OUT.inc(upstream=upstream)
+            raise UpstreamTimeout(f"{upstream} call timed out after {timeout:.1f}s")
+
+
+def _abandon(future) -> None:
+    """Unqueues a call that hasn't started; one already running is tracked until it ends."""
+    if future.cancel():
+        return
+    ABANDONED_RUNNING.inc()
+    future.add_done_callback(lambda _: ABANDONED_RUNNING.dec())
+
+
+def _run_detached(fn: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+    # Nested upstream calls run inline instead of queueing on the pool again
+    current_run.set(None)
+    with profile_thread("upstream-io"):
+        return fn(*args, **kwargs)
+
+
+class RunRegistry:
+    """Tracks the active run of each thread so it can be cancelled."""
+
+    def __init__(self):
+        self._runs: Dict[str, RunContext] = {}
+        self._lock = threading.Lock()
+
+    def start(self, thread_id: str) -> RunContext:
+        """Registers a new run, superseding (and cancelling) any older run on the thread."""
+        run = RunContext(thread_id)
+        with self._lock:
+            previous = self._runs.get(thread_id)
+            self._runs[thread_id] = run
+        if previous is not None:
+            self.cancel_run(previous)
+        ACTIVE_RUNS.inc()
+        return run
+
+    def finish(self, run: RunContext) -> None:
+        with self._lock:
+            if self._runs.get(run.thread_id) is run:
+                del self._runs[run.thread_id]
+        ACTIVE_RUNS.dec()
+
+    def cancel(self, thread_id: str) -> bool:
+        """Cancels the active run of a thread. Returns False if none was running."""
+        with self._lock:
+            run = self._runs.get(thread_id)
+        if run is None:
+            return False
+        self.cancel_run(run)
+        return True
+
+    def cancel_run(self, run: RunContext) -> None:
+        if run.cancelled:
+            return
+        run.cancel()
+        RUNS_CANCELLED.inc()
+        CANCELLED_RUN_SECONDS.observe(time.monotonic() - run.started_at)
+        print(f"🛑 Cancelled run for {run.thread_id}")
+
+
+runs = RunRegistry()
@@ -0,0 +1,224 @@
+"""
+Compact checkpoint serializer: msgpack, with repeated strings stored once,
+compressed with zstd (or zlib).
+
+Checkpoints repeat the same long strings many times over (research reports
+in researched_places, research_notes and messages; place IDs; message
+metadata), and the checkpointer keeps every version. Strings that occur
+more than once in a value are written to a table and referenced by index,
+then the whole value is compressed.
+
+LangChain messages round-trip through message_to_dict/messages_from_dict.
+Values the encoder doesn't know (e.g. Send, Interrupt, pydantic models) are
+left to LangGraph's JsonPlusSerializer, which also reads every checkpoint
+this serializer didn't write.
+
+It is opt-in (CHECKPOINT_SERIALIZER=compact): encoding is several times
+slower than jsonplus, which only pays off when checkpoints are stored or
+shipped somewhere bytes cost more than CPU. The in-memory checkpointer keeps
+jsonplus. Run benchmarks/bench_checkpoint_serde.py on your own checkpoints
+before switching.
+"""
+import os
+import zlib
+from collections import Counter
+from typing import Any, Callable
+
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from metrics import REGISTRY
+
+try:
+    import ormsgpack  # Installed with langgraph
+except ImportError:
+    ormsgpack = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard  # Optional: enables zstd compression
+except ImportError:
+    zstandard = None
+
+CHECKPOINT_BYTES = REGISTRY.counter(
+    "checkpoint_serialized_bytes_total", "Checkpoint bytes written, by serializer (compact, fallback)"
+)
+
+# Strings shorter than this are cheaper inline than as table references
+MIN_SHARED_LENGTH = 12
+# Values smaller than this are stored uncompressed
+MIN_COMPRESS_BYTES = 256
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+# msgpack extension codes
+_REF, _TUPLE, _SET, _MESSAGE = 1, 2, 3, 4
+
+TYPE_PREFIX = "compact-msgpack"
+
+# Values written as they are (exact types only: subclasses go to the fallback)
+_SCALARS = frozenset({type(None), bool, int, float, bytes})
+
+
+class _Unsupported(TypeError):
+    """A value the compact encoding doesn't cover; the fallback serializer takes it."""
+
+
+if ormsgpack is not None:
+    def _ext(code: int, data: bytes):
+        return ormsgpack.Ext(code, data)
+
+    def _pack(value: Any) -> bytes:
+        return ormsgpack.packb(value)
+
+    def _unpack(data: bytes, ext_hook: Callable[[int, bytes], Any] | None = None) -> Any:
+        return ormsgpack.unpackb(data, ext_hook=ext_hook) if ext_hook else ormsgpack.unpackb(data)
+elif msgpack is not None:
+    def _ext(code: int, data: bytes):
+        return msgpack.ExtType(code, data)
+
+    def _pack(value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def _unpack(data: bytes, ext_hook: Callable[[int, bytes], Any] | None = None) -> Any:
+        kwargs = {"ext_hook": ext_hook} if ext_hook else {}
+        return msgpack.unpackb(data, raw=False, **kwargs)
+else:
+    _pack = _unpack = _ext = None
+
+
+class _Encoder:
+    """Encodes one value: counts its strings, then writes it with repeated ones as references."""
+
+    def __init__(self, value: Any):
+        self._messages: dict = {}  # id(message) -> message_to_dict(message), converted once
+        counts: Counter = Counter()
+        self._count(value, counts)
+        self.table = [text for text, count in counts.items() if count > 1]
+        self.refs = {text: i for i, text in enumerate(self.table)}
+
+    def _message_dict(self, message: BaseMessage) -> dict:
+        converted = self._messages.get(id(message))
+        if converted is None:
+            converted = self._messages[id(message)] = message_to_dict(message)
+        return converted
+
+    def _count(self, value: Any, counts: Counter) -> None:
+        cls = type(value)
+        if cls is str:
+            if len(value) >= MIN_SHARED_LENGTH:
+                counts[value] += 1
+        elif cls is dict:
+            for item in value.values():
+                if type(item) not in _SCALARS:
+                    self._count(item, counts)
+        elif cls in (list, tuple, set, frozenset):
+            for item in value:
+                if type(item) not in _SCALARS:
+                    self._count(item, counts)
+        elif isinstance(value, BaseMessage):
+            self._count(self._message_dict(value), counts)
+
+    def encode(self, value: Any) -> Any:
+        cls = type(value)
+        if cls is str:
+            ref = self.refs.get(value)
+            return value if ref is None else _ext(_REF, ref.to_bytes(4, "little"))
+        if cls in _SCALARS:
+            return value
+        if cls is dict:
+            encoded = {}
+            for key, item in value.items():
+                if type(key) is not str:
+                    raise _Unsupported("dict with non-string keys")
+                encoded[key] = item if type(item) in _SCALARS else self.encode(item)
+            return encoded
+        if cls is list:
+            return [item if type(item) in _SCALARS else self.encode(item) for item in value]
+        if cls is tuple:
+            return _ext(_TUPLE, _pack([self.encode(item) for item in value]))
+        if cls in (set, frozenset):
+            return _ext(_SET, _pack([self.encode(item) for item in value]))
+        if isinstance(value, BaseMessage):
+            return _ext(_MESSAGE, _pack(self.encode(self._message_dict(value))))
+        raise _Unsupported(cls.__name__)
+
+
+def _decoder(table: list) -> Callable[[int, bytes], Any]:
+    def ext_hook(code: int, data: bytes) -> Any:
+        if code == _REF:
+            return table[int.from_bytes(data, "little")]
+        if code == _TUPLE:
+            return tuple(_unpack(data, ext_hook))
+        if code == _SET:
+            return set(_unpack(data, ext_hook))
+        if code == _MESSAGE:
+            return messages_from_dict([_unpack(data, ext_hook)])[0]
+        raise ValueError(f"Unknown extension code {code} in checkpoint")
+
+    return ext_hook
+
+
+class CompactSerializer:
+    """
+    LangGraph checkpoint serializer (dumps_typed/loads_typed) writing the
+    compact format. `compression` is "zstd", "zlib" or "none".
+    """
+
+    def __init__(self, compression: str = "zstd", fallback: JsonPlusSerializer | None = None):
+        if compression == "zstd" and zstandard is None:
+            compression = "zlib"
+        self.compression = compression
+        self.fallback = fallback or JsonPlusSerializer()
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        try:
+            encoder = _Encoder(obj)
+            data = _pack([encoder.table, _pack(encoder.encode(obj))])
+        except TypeError:
+            # _Unsupported, or a value msgpack can't hold (e.g. an int past 64 bits)
+            type_, data = self.fallback.dumps_typed(obj)
+            CHECKPOINT_BYTES.inc(len(data), serializer="fallback")
+            return type_, data
+
+        codec = self.compression if len(data) >= MIN_COMPRESS_BYTES else "none"
+        if codec == "zstd":
+            # Compressor contexts aren't thread-safe, and graph jobs checkpoint from several threads
+            data = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        elif codec == "zlib":
+            data = zlib.compress(data, ZLIB_LEVEL)
+        CHECKPOINT_BYTES.inc(len(data), serializer="compact")
+        return f"{TYPE_PREFIX}+{codec}", data
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if not type_.startswith(TYPE_PREFIX):
+            return self.fallback.loads_typed(data)
+
+        codec = type_.partition("+")[2]
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Checkpoint is zstd-compressed but zstandard is not installed")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        elif codec == "zlib":
+            payload = zlib.decompress(payload)
+        table, body = _unpack(payload)
+        return _unpack(body, _decoder(table))
+
+
+def get_checkpoint_serializer():
+    """
+    The serializer named by CHECKPOINT_SERIALIZER: "jsonplus" (LangGraph's
+    own, the default) or "compact", for persistent checkpointers where size
+    matters more than encode time. Compact needs ormsgpack or msgpack and
+    falls back to jsonplus without them. CHECKPOINT_COMPRESSION picks
+    zstd (default, if zstandard is installed), zlib or none.
+    """
+    name = os.environ.get("CHECKPOINT_SERIALIZER", "jsonplus")
+    if name == "compact" and _pack is not None:
+        return CompactSerializer(os.environ.get("CHECKPOINT_COMPRESSION", "zstd"))
+    if name == "compact":
+        print("⚠️ Neither ormsgpack nor msgpack is installed; using the default checkpoint serializer")
+    return JsonPlusSerializer()
@@ -1,5 +1,7 @@
 import json
 import asyncio
+import hmac
+import time
 import uuid
 import os
 from dotenv import load_dotenv
@@ -7,8 +9,8 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
 
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import AsyncGenerator, List, Optional
@@ -16,9 +18,37 @@ from langchain_core.messages import HumanMessage
 
 # Import the agent - using Supervisor graph
 from graph import app as agent_graph
+from agents import generate_itinerary
+from prefetch import prefetcher
+from speculation import drafter
+from sessions import build_initial_state, build_resume_update
+from batch import SelectionPolicy, run_batch
+from metrics import REGISTRY
+from runs import RunContext, current_run, runs
+from compression import compress_stream, negotiate_encoding
+from profiling import profile_session, profiles
+from cassette import current_cassette, recorder
+from deadlines import deadline_in
+from event_log import event_logs, replay
+from place_registry import found_places_of, place_registry, researched_places_of, unresolved_place_ids
+from jobs import graph_jobs
+from monitor import LOOP_MONITOR_ENABLED, loop_monitor, track_stream
 
 app = FastAPI(title="BudgetGuardian API")
 
+@app.on_event("startup")
+async def bind_background_work():
+    loop = asyncio.get_running_loop()
+    # Graph jobs run on worker loops; prefetches they schedule belong on the server's
+    prefetcher.bind(loop)
+    if LOOP_MONITOR_ENABLED:
+        # Also watches the server loop's default executor (run_in_executor / to_thread)
+        loop_monitor.start(loop)
+
+@app.on_event("shutdown")
+async def stop_background_work():
+    loop_monitor.stop()
+
 # Allow Next.js
 app.add_middleware(
     CORSMiddleware,
@@ -33,18 +63,130 @@ class TripRequest(BaseModel):
     budget: float
     location: str
     description: str = ""  # User's description of what they're looking for
+    profile: bool = False  # Capture a CPU profile of this session's graph run
 
 class ResumeRequest(BaseModel):
     thread_id: str
     selected_places: Optional[List[str]] = None
     message: str = ""
     action: str = "research"  # "research", "plan_itinerary", "adjust_itinerary", or "finalize_itinerary"
+    profile: bool = False  # Capture a CPU profile of this step's graph run
+
+class BatchPlanRequest(BaseModel):
+    trips: List[TripRequest]
+    concurrency: int = 4
+    selection: SelectionPolicy = SelectionPolicy()
+
+# Upper bound on concurrent trips per batch request
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", 8))
+# Upper bound on trips per batch request
+BATCH_MAX_TRIPS = int(os.environ.get("BATCH_MAX_TRIPS", 100))
+
+# Required by the admin endpoints; without it they are disabled
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def wants_profile(flag: bool, http_request: Request) -> bool:
+    """Profiling is requested with the body flag or an `X-Profile: 1` header."""
+    return flag or http_request.headers.get("x-profile", "").lower() in ("1", "true")
+
+def require_admin(http_request: Request) -> None:
+    """Allows the request only with the configured `X-Admin-Token`; denies everything if none is configured."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not hmac.compare_digest(http_request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# How often a job waiting on the graph checks whether its run passed its deadline
+DEADLINE_POLL_SECONDS = 1.0
+
+# How long past its deadline a run may go on (steps cap themselves, so this is
+# only reached by work that ignores the deadline) before the job ends it
+DEADLINE_GRACE_SECONDS = 2.0
 
-async def event_generator(input_data: dict | None, thread_id: str) -> AsyncGenerator[str, None]:
+async def stream_graph(
+    input_data: dict | None, config: dict, run: RunContext, profile: bool = False
+) -> AsyncGenerator[tuple, None]:
     """
-    Streams LangGraph events to the client in SSE format.
+    Runs agent_graph.astream in its own task and yields `("values", state)`
+    for its state events and `("custom", event)` for progress events the
+    run's nodes and tools emit mid-step (e.g. map patches).
+    If the consumer stops early (e.g. a newer run superseded this one), the
+    run is cancelled: the graph task is cancelled and in-flight LLM/tool
+    calls bail out at their next boundary. Supersteps that already completed stay
+    checkpointed, so the session can be resumed later.
+    With `profile`, the run is sampled and stored under its thread_id.
+    A run still going DEADLINE_GRACE_SECONDS after the config's
+    `deadline_at` is cancelled the same way, after a timeout event.
     """
-    config = {"configurable": {"thread_id": thread_id}}
+    deadline_at = config["configurable"].get("deadline_at")
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+    loop = asyncio.get_running_loop()
+    # Tools run in executor threads, so their events are handed over to the loop
+    run.listener = lambda event: loop.call_soon_threadsafe(queue.put_nowait, ("custom", event))
+
+    async def drive():
+        current_run.set(run)
+        current_cassette.set(recorder.for_thread(run.thread_id))
+        try:
+            with profile_session(run.thread_id, profile):
+                async for event in agent_graph.astream(input_data, config, stream_mode="values"):
+                    queue.put_nowait(("values", event))
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            queue.put_nowait(e)
+        else:
+            queue.put_nowait(finished)
+
+    task = asyncio.create_task(drive())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=DEADLINE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                if deadline_at is not None and time.time() > deadline_at + DEADLINE_GRACE_SECONDS:
+                    print(f"⏱️ Run for {run.thread_id} passed its deadline")
+                    yield ("custom", {"type": "error", "data": "This step took too long and was stopped. Please try again."})
+                    return
+                continue
+            if item is finished:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        run.listener = None
+        if not task.done():
+            runs.cancel_run(run)
+            task.cancel()
+
+def is_visible_message(msg) -> bool:
+    """Only human and AI messages are shown to the user; tool calls, tool responses and reasoning are not."""
+    # Filter messages: only show human and AI messages, skip tool calls and tool responses
+    if msg.type not in ["human", "ai"]:
+        return False
+    # Skip AI messages that are tool calls (have tool_calls attribute and it's not empty)
+    if msg.type == "ai" and hasattr(msg, 'tool_calls') and msg.tool_calls:
+        return False
+    # Skip empty or very short AI messages that are just intermediate reasoning
+    if msg.type == "ai" and (not msg.content or len(str(msg.content).strip()) < 10):
+        return False
+    return True
+
+async def event_generator(
+    input_data: dict | None, thread_id: str, deadline_at: float, profile: bool = False
+) -> AsyncGenerator[str, None]:
+    """
+    Streams LangGraph events in SSE format. Runs as a graph job on a
+    worker (see jobs.py); clients receive the events from the event log.
+    `deadline_at` is set when the request arrives, so time spent queued
+    for a worker counts against it.
+    """
+    # Every node and tool in the run sizes its timeouts from deadline_at
+    config = {"configurable": {"thread_id": thread_id, "deadline_at": deadline_at}}
+    run = runs.start(thread_id)
+    events = None
     
     # Track seen messages to avoid duplicates
     seen_message_count = 0
@@ -54,7 +196,12 @@ async def event_generator(input_data: dict | None, thread_id: str) -> AsyncGener
         yield f"data: {json.dumps({'type': 'meta', 'thread_id': thread_id})}\n\n"
 
         # Async Stream from LangGraph
-        async for event in agent_graph.astream(input_data, config, stream_mode="values"):
+        events = stream_graph(input_data, config, run, profile)
+        async for mode, event in events:
+            if mode == "custom":
+                # Progress events (e.g. map patches) go to the client as they are
+                yield f"data: {json.dumps(event)}\n\n"
+                continue
             
             payload = {}
 
@@ -67,16 +214,7 @@ async def event_generator(input_data: dict | None, thread_id: str) -> AsyncGener
                     for i in range(seen_message_count, current_message_count):
                         msg = event["messages"][i]
                         
-                        # Filter messages: only show human and AI messages, skip tool calls and tool responses
-                        if msg.type in ["human", "ai"]:
-                            # Skip AI messages that are tool calls (have tool_calls attribute and it's not empty)
-                            if msg.type == "ai" and hasattr(msg, 'tool_calls') and msg.tool_calls:
-                                continue
-                            
-                            # Skip empty or very short AI messages that are just intermediate reasoning
-                            if msg.type == "ai" and (not msg.content or len(str(msg.content).strip()) < 10):
-                                continue
-                                
+                        if is_visible_message(msg):
                             payload = {
                                 "type": "message",
                                 "data": {
@@ -106,7 +244,7 @@ async def event_generator(input_data: dict | None, thread_id: str) -> AsyncGener
             if "found_places" in event and event["found_places"]:
                 payload = {
                     "type": "map_update",
-                    "data": event["found_places"]
+                    "data": found_places_of(event)
                 }
                 yield f"data: {json.dumps(payload)}\n\n"
                 await asyncio.sleep(0.01)
@@ -115,7 +253,7 @@ async def event_generator(input_data: dict | None, thread_id: str) -> AsyncGener
             if "researched_places" in event and event["researched_places"]:
                 payload = {
                     "type": "research_update",
-                    "data": event["researched_places"]
+                    "data": researched_places_of(event)
                 }
                 yield f"data: {json.dumps(payload)}\n\n"
                 await asyncio.sleep(0.01)
@@ -129,12 +267,21 @@ async def event_generator(input_data: dict | None, thread_id: str) -> AsyncGener
                 yield f"data: {json.dumps(payload)}\n\n"
                 await asyncio.sleep(0.01)
 
+        if run.cancelled:
+            return
+        
         # Check if paused or done
-        state_snapshot = agent_graph.get_state(config)
+        state_snapshot = await agent_graph.aget_state(config)
         current_stage = state_snapshot.values.get("workflow_stage", "")
         
         # If workflow_stage is select_locations, choose_locations, or review_itinerary, we're paused
         if current_stage in ["select_locations", "choose_locations", "review_itinerary"]:
+            if current_stage == "select_locations":
+                # Warm research caches while the user is picking places
+                prefetcher.schedule(thread_id, found_places_of(state_snapshot.values))
+            elif current_stage == "choose_locations":
+                # Draft itineraries for the likeliest choices while the user decides
+                drafter.schedule(thread_id, state_snapshot.values, generate_itinerary)
             yield f"data: {json.dumps({'type': 'status', 'data': 'paused', 'stage': current_stage})}\n\n"
         elif state_snapshot.next:
             # Graph is interrupted for some other reason
@@ -147,117 +294,211 @@ async def event_generator(input_data: dict | None, thread_id: str) -> AsyncGener
         import traceback
         traceback.print_exc()
         yield f"data: {json.dumps({'type': 'error', 'data': str(e)})}\n\n"
+    finally:
+        # Make sure the graph task is cancelled if the run stopped early
+        if events is not None:
+            await events.aclose()
+        runs.finish(run)
+        if recorder.enabled:
+            await asyncio.to_thread(recorder.save, thread_id)
+
+def sse_response(events: AsyncGenerator[str, None], http_request: Request) -> StreamingResponse:
+    """
+    Wraps an SSE generator in a streaming response, compressed with the
+    encoding negotiated from the client's Accept-Encoding header.
+    """
+    encoding = negotiate_encoding(http_request.headers.get("accept-encoding"))
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(
+        compress_stream(track_stream(events), encoding),
+        media_type="text/event-stream",
+        headers=headers
+    )
 
 @app.post("/api/plan")
-async def plan_trip(request: TripRequest):
+async def plan_trip(request: TripRequest, http_request: Request):
     """
     Starts a new trip planning session.
     """
     print(f"Starting new trip: {request.query} in {request.location}")
+    deadline_at = deadline_in()
     thread_id = f"trip_{uuid.uuid4()}"
     
-    # Build the initial message including all user inputs
-    # Only add description if it's different from the query to avoid duplication
-    if request.description and request.description.strip() and request.description.strip() != request.query.strip():
-        full_query = f"{request.query}. Location: {request.location}. Budget: ${request.budget}. Looking for: {request.description}"
-    else:
-        full_query = f"{request.query}. Location: {request.location}. Budget: ${request.budget}."
+    initial_state = build_initial_state(request.query, request.budget, request.location, request.description)
     
-    initial_state = {
-        "messages": [HumanMessage(content=full_query)],
-        "total_budget": request.budget,
-        "remaining_budget": request.budget,
-        "itinerary": [],
-        "current_location": request.location,
-        "found_places": [],
-        "selected_places": [],
-        "research_notes": [],
-        "researched_places": [],
-        "user_description": request.description or request.query,
-        "workflow_stage": "search",
-        "next": "Supervisor",
-        "remaining_steps": 25  # Default from create_react_agent
-    }
+    if recorder.enabled:
+        recorder.for_thread(thread_id).record_input("plan", request.model_dump())
     
-    return StreamingResponse(
-        event_generator(initial_state, thread_id),
-        media_type="text/event-stream"
+    profile = wants_profile(request.profile, http_request)
+    start_id = graph_jobs.submit(
+        thread_id, event_generator(initial_state, thread_id, deadline_at, profile), deadline_at
     )
+    return sse_response(replay(thread_id, start_id), http_request)
 
 @app.post("/api/resume")
-async def resume_trip(request: ResumeRequest):
+async def resume_trip(request: ResumeRequest, http_request: Request):
     """
     Resumes a paused session with user input (selected places or confirmation to plan).
     """
     print(f"Resuming trip {request.thread_id} - Action: {request.action}")
+    deadline_at = deadline_in()
+
+    # Prefetched data only helps the research step
+    if request.action != "research":
+        prefetcher.cancel(request.thread_id)
+    # Only the draft for the chosen place is still useful
+    if request.action == "plan_itinerary" and request.selected_places:
+        drafter.choose(request.thread_id, request.selected_places[0])
+    else:
+        drafter.cancel(request.thread_id)
     
     config = {"configurable": {"thread_id": request.thread_id}}
     
-    updates = {}
-    
     # Handle different actions
     if request.action == "research" and request.selected_places:
         # User selected places, proceed to research
         print(f"📍 Selected places for research: {request.selected_places}")
         
         # Get current state to verify place IDs exist
-        current_state = agent_graph.get_state(config)
-        found_places = current_state.values.get("found_places", [])
-        available_ids = [p.get("id") for p in found_places if "id" in p]
+        current_state = await agent_graph.aget_state(config)
+        available_ids = set(current_state.values.get("found_places", []))
         
-        print(f"📋 Available place IDs in state: {available_ids}")
+        print(f"📋 {len(available_ids)} place IDs available in state")
         
         # Validate that selected places exist in found_places
         missing_places = [pid for pid in request.selected_places if pid not in available_ids]
         if missing_places:
             print(f"⚠️ WARNING: Some selected place IDs not found: {missing_places}")
-        
-        updates["selected_places"] = request.selected_places
-        
-        # Keep message simple - agent should use state, not parse message
-        message = f"Please research the selected places. I have selected {len(request.selected_places)} location(s) to learn more about."
-        
     elif request.action == "plan_itinerary" and request.selected_places:
-        # User confirmed locations, proceed to itinerary
         print(f"🗺️ Creating itinerary for: {request.selected_places}")
-
-        updates["selected_places"] = request.selected_places
-        
-        message = f"Great! Please create a detailed itinerary for my selected location. Remember to stay within my budget."
-        
     elif request.action == "adjust_itinerary":
-        # User wants to adjust the itinerary
         print(f"✏️ Adjusting itinerary based on feedback: {request.message}")
-        
-        # Keep workflow_stage as review_itinerary so supervisor routes to Itinerary_Agent
-        updates["workflow_stage"] = "review_itinerary"
-        
-        # Make the adjustment request very explicit
-        message = f"Please adjust the itinerary based on this feedback: {request.message}\n\nIMPORTANT: Make the specific changes I requested. Do not repeat the same itinerary."
-        
     elif request.action == "finalize_itinerary":
-        # User approved the itinerary, finalize
         print(f"✅ Finalizing itinerary")
-        
-        updates["workflow_stage"] = "complete"
-        
-        message = "The itinerary looks perfect! Thank you for the planning."
-        
-    else:
-        # Generic resume
-        message = request.message or "Please continue."
     
-    # 1. Update state with any changes
-    if updates:
-        agent_graph.update_state(config, updates)
+    updates, message = build_resume_update(request.action, request.selected_places, request.message)
     
-    # 2. Add user message to trigger next step  
-    agent_graph.update_state(config, {"messages": [HumanMessage(content=message)]})
+    if recorder.enabled:
+        recorder.for_thread(request.thread_id).record_input("resume", request.model_dump())
+    
+    # 1. Apply state changes and the user message that triggers the next step
+    #    as one update, so the resume writes a single checkpoint
+    await agent_graph.aupdate_state(config, {**updates, "messages": [HumanMessage(content=message)]})
+    
+    # 2. Resume stream from current position
+    profile = wants_profile(request.profile, http_request)
+    start_id = graph_jobs.submit(
+        request.thread_id, event_generator(None, request.thread_id, deadline_at, profile), deadline_at
+    )
+    return sse_response(replay(request.thread_id, start_id), http_request)
+
+@app.get("/api/stream/{thread_id}")
+async def reconnect_stream(thread_id: str, http_request: Request, last_event_id: int = 0):
+    """
+    Reconnects to a thread's event stream after a dropped connection. Sends
+    only the events after Last-Event-ID (header, or query parameter for
+    clients that can't set it), then follows the stream if it is still
+    running. Never runs the graph, so reconnecting costs no LLM calls.
+    """
+    header = http_request.headers.get("last-event-id")
+    if header is not None:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be an integer")
+    print(f"🔌 Client reconnected to {thread_id} after event {last_event_id}")
+    return sse_response(replay(thread_id, last_event_id), http_request)
+
+@app.get("/api/state/{thread_id}")
+async def get_state(thread_id: str, http_request: Request):
+    """
+    Returns the current snapshot of a session, for clients that lost events
+    and need to redraw. The ETag covers everything the snapshot is built
+    from: the checkpoint, the session's event log and the place records, so
+    polling an unchanged session is answered with 304 without rebuilding it.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    # Loads the checkpoint once; there is no cheaper way to learn its ID
+    state_snapshot = await agent_graph.aget_state(config)
+    if state_snapshot.created_at is None:
+        raise HTTPException(status_code=404, detail="Unknown thread")
+
+    log = event_logs.get(thread_id)
+    last_event_id = log.last_id if log else 0
+    checkpoint_id = state_snapshot.config["configurable"]["checkpoint_id"]
+    etag = f'"{checkpoint_id}.{last_event_id}.{place_registry.version}"'
+    if http_request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    values = state_snapshot.values
+    snapshot = {
+        "thread_id": thread_id,
+        "workflow_stage": values.get("workflow_stage", ""),
+        "total_budget": values.get("total_budget", 0),
+        "remaining_budget": values.get("remaining_budget", 0),
+        "itinerary": values.get("itinerary", []),
+        "itinerary_plan": values.get("itinerary_plan", {}),
+        "found_places": found_places_of(values),
+        "researched_places": researched_places_of(values),
+        # Found places whose records were evicted or lost in a restart; search again to get them back
+        "unresolved_places": unresolved_place_ids(values),
+        "messages": [
+            {"role": msg.type, "content": str(msg.content)}
+            for msg in values.get("messages", [])
+            if is_visible_message(msg)
+        ],
+        "next": list(state_snapshot.next),
+        # Reconnect from here to get only what happens after this snapshot
+        "last_event_id": last_event_id,
+    }
+    return JSONResponse(snapshot, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.post("/api/plan/batch")
+async def plan_batch(request: BatchPlanRequest, http_request: Request):
+    """
+    Plans many trips without a human in the loop, using the selection policy
+    at each pause. Results are streamed as NDJSON as each trip finishes.
+    Trips run on the graph-job workers, alongside interactive sessions.
+    """
+    require_admin(http_request)
+    if len(request.trips) > BATCH_MAX_TRIPS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_TRIPS} trips per batch")
+    concurrency = max(1, min(request.concurrency, BATCH_MAX_CONCURRENCY))
+    print(f"Starting batch of {len(request.trips)} trips (concurrency {concurrency})")
+    
+    initial_states = [
+        build_initial_state(trip.query, trip.budget, trip.location, trip.description)
+        for trip in request.trips
+    ]
+    thread_ids = [f"batch_{uuid.uuid4()}" for _ in request.trips]
     
-    # 3. Resume stream from current position
     return StreamingResponse(
-        event_generator(None, request.thread_id),
-        media_type="text/event-stream"
+        run_batch(initial_states, thread_ids, request.selection, concurrency),
+        media_type="application/x-ndjson"
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Exposes process metrics in Prometheus text format.
+    """
+    return PlainTextResponse(REGISTRY.render())
+
+@app.get("/api/admin/profiles/{thread_id}")
+async def download_profile(thread_id: str, http_request: Request):
+    """
+    Downloads the CPU profile captured for a session, in folded-stack format
+    (load it in speedscope or render it with flamegraph.pl).
+    """
+    require_admin(http_request)
+    profiler = profiles.get(thread_id)
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="No profile captured for this thread")
+    return PlainTextResponse(
+        profiler.folded(),
+        headers={"Content-Disposition": f'attachment; filename="{thread_id}.folded"'}
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage
+
+
+def build_initial_state(query: str, budget: float, location: str, description: str = "") -> dict:
+    """Builds the initial graph state for a new trip planning session."""
+    # Build the initial message including all user inputs
+    # Only add description if it's different from the query to avoid duplication
+    if description and description.strip() and description.strip() != query.strip():
+        full_query = f"{query}. Location: {location}. Budget: ${budget}. Looking for: {description}"
+    else:
+        full_query = f"{query}. Location: {location}. Budget: ${budget}."
+
+    return {
+        "messages": [HumanMessage(content=full_query)],
+        "total_budget": budget,
+        "remaining_budget": budget,
+        "itinerary": [],
+        "itinerary_plan": {},
+        "current_location": location,
+        "found_places": [],
+        "selected_places": [],
+        "research_notes": [],
+        "researched_places": [],
+        "user_description": description or query,
+        "workflow_stage": "search",
+        "next": "Supervisor",
+        "remaining_steps": 25  # Default from create_react_agent
+    }
+
+
+def build_resume_update(action: str, selected_places: Optional[List[str]], message: str = "") -> Tuple[dict, str]:
+    """
+    Maps a resume action to the state updates and the user message that
+    trigger the next step of the workflow.
+    """
+    updates = {}
+
+    if action == "research" and selected_places:
+        # User selected places, proceed to research
+        updates["selected_places"] = selected_places
+
+        # Keep message simple - agent should use state, not parse message
+        message = f"Please research the selected places. I have selected {len(selected_places)} location(s) to learn more about."
+
+    elif action == "plan_itinerary" and selected_places:
+        # User confirmed locations, proceed to itinerary
+        updates["selected_places"] = selected_places
+
+        message = f"Great! Please create a detailed itinerary for my selected location. Remember to stay within my budget."
+
+    elif action == "adjust_itinerary":
+        # Keep workflow_stage as review_itinerary so supervisor routes to Itinerary_Agent
+        updates["workflow_stage"] = "review_itinerary"
+
+        # Make the adjustment request very explicit
+        message = f"Please adjust the itinerary based on this feedback: {message}\n\nIMPORTANT: Make the specific changes I requested. Do not repeat the same itinerary."
+
+    elif action == "finalize_itinerary":
+        # User approved the itinerary, finalize
+        updates["workflow_stage"] = "complete"
+
+        message = "The itinerary looks perfect! Thank you for the planning."
+
+    else:
+        # Generic resume
+        message = message or "Please continue."
+
+    return updates, message
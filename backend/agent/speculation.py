@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Callable, Dict
+
+from metrics import REGISTRY
+from monitor import loop_monitor
+from place_registry import researched_places_of
+from ratelimit import request_priority
+from runs import CANCEL_POLL_SECONDS, RunCancelled, RunContext, check_cancelled, current_run
+
+DRAFTS = REGISTRY.counter(
+    "speculative_drafts_total", "Speculative itinerary drafts by outcome (started, used, cancelled, skipped)"
+)
+
+# Generates the itinerary state update for (state, chosen place ID)
+DraftFn = Callable[[dict, str], dict]
+
+
+class DraftJob:
+    """One background itinerary draft for a researched place."""
+
+    def __init__(self, thread_id: str, place_id: str, remaining_budget: float):
+        self.place_id = place_id
+        self.remaining_budget = remaining_budget
+        self.run = RunContext(f"{thread_id}:draft:{place_id}")
+        self.future: Future | None = None
+
+
+class ItineraryDrafter:
+    """
+    Drafts itineraries in the background while the graph is paused at
+    choose_locations, one per top-K researched place, so itinerary_node can
+    answer straight away when the user picks one of them.
+
+    Drafts run on a bounded worker pool at batch priority, and a rolling
+    hourly limit caps how many LLM drafts are spent speculatively.
+    """
+
+    def __init__(self, top_k: int = 0, max_workers: int = 2, max_drafts_per_hour: int = 60):
+        self.top_k = top_k
+        self.max_drafts_per_hour = max_drafts_per_hour
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="itinerary-draft")
+        self._jobs: Dict[str, Dict[str, DraftJob]] = {}
+        self._started: deque = deque()
+        self._lock = threading.Lock()
+
+    def schedule(self, thread_id: str, state: dict, draft: DraftFn) -> None:
+        """Starts drafting for the top-K researched places by rating, replacing older drafts for the thread."""
+        self.cancel(thread_id)
+        researched = researched_places_of(state)
+        if self.top_k <= 0 or not researched:
+            return
+
+        candidates = sorted(researched, key=lambda p: p.get("rating") or 0, reverse=True)[: self.top_k]
+        jobs = {}
+        for place in candidates:
+            if not self._spend():
+                DRAFTS.inc(outcome="skipped")
+                continue
+            job = DraftJob(thread_id, place["id"], state.get("remaining_budget", 0))
+            job.future = self._pool.submit(copy_context().run, self._run, job, state, draft)
+            jobs[job.place_id] = job
+            DRAFTS.inc(outcome="started")
+        if jobs:
+            with self._lock:
+                self._jobs[thread_id] = jobs
+            print(f"📝 Drafting itineraries for {len(jobs)} places in the background ({thread_id})")
+
+    def choose(self, thread_id: str, place_id: str) -> None:
+        """Cancels the drafts for every place except the one the user chose."""
+        with self._lock:
+            jobs = self._jobs.get(thread_id, {})
+            others = [job for pid, job in jobs.items() if pid != place_id]
+            for job in others:
+                del jobs[job.place_id]
+        for job in others:
+            self._cancel_job(job)
+
+    def cancel(self, thread_id: str) -> None:
+        """Cancels all pending drafts for a thread."""
+        with self._lock:
+            jobs = self._jobs.pop(thread_id, {})
+        for job in jobs.values():
+            self._cancel_job(job)
+
+    def take(self, thread_id: str, place_id: str, remaining_budget: float) -> dict | None:
+        """
+        Returns the draft for the chosen place, waiting for it if it is still
+        being generated. Returns None if there is no usable draft.
+        """
+        with self._lock:
+            job = self._jobs.pop(thread_id, {}).get(place_id)
+        if job is None:
+            return None
+        if job.remaining_budget != remaining_budget:
+            # The budget changed since the draft started, so it is stale
+            self._cancel_job(job)
+            return None
+
+        # Waiting is never slower than starting over; stay responsive to cancellation
+        while not wait([job.future], timeout=CANCEL_POLL_SECONDS).done:
+            try:
+                check_cancelled("itinerary-draft")
+            except RunCancelled:
+                self._cancel_job(job)
+                raise
+        try:
+            update = job.future.result()
+        except BaseException as e:
+            print(f"⚠️ Itinerary draft for {place_id} failed: {e}")
+            return None
+        DRAFTS.inc(outcome="used")
+        return update
+
+    def _spend(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._started and now - self._started[0] > 3600:
+                self._started.popleft()
+            if len(self._started) >= self.max_drafts_per_hour:
+                return False
+            self._started.append(now)
+            return True
+
+    def _cancel_job(self, job: DraftJob) -> None:
+        if job.future.done():
+            return
+        job.future.cancel()
+        job.run.cancel()
+        DRAFTS.inc(outcome="cancelled")
+
+    @staticmethod
+    def _run(job: DraftJob, state: dict, draft: DraftFn) -> dict:
+        # Each draft is its own cancellable run, and must not delay interactive calls
+        current_run.set(job.run)
+        request_priority.set("batch")
+        return draft(state, job.place_id)
+
+
+drafter = ItineraryDrafter(
+    top_k=int(os.environ.get("SPECULATIVE_DRAFTS_TOP_K", 0)),
+    max_workers=int(os.environ.get("SPECULATIVE_DRAFTS_MAX_WORKERS", 2)),
+    max_drafts_per_hour=int(os.environ.get("SPECULATIVE_DRAFTS_PER_HOUR", 60)),
+)
+loop_monitor.watch_pool("itinerary-draft", lambda: drafter._pool)
@@ -42,6 +42,16 @@ def reduce_places(current: List[dict] | None, new: List[dict] | None) -> List[di
     # Return as list
     return list(places_map.values())
 
+def reduce_place_ids(current: List[str] | None, new: List[str] | None) -> List[str]:
+    """
+    Takes the update's order: a search re-ranks all of the session's places
+    and returns the whole list, which replaces the current one. IDs the
+    update doesn't list (found by another search_places call in the same
+    step, ranked without them) are kept after it; search_node re-ranks the
+    merged list once the agent is done.
+    """
+    return list(dict.fromkeys((new or []) + (current or [])))
+
 # --- 3. Define the Core Agent State ---
 
 class TravelState(TypedDict):
@@ -59,19 +69,23 @@ class TravelState(TypedDict):
     # Itinerary - what we have actually planned/booked
     itinerary: Annotated[List[ItineraryItem], reduce_itinerary]
     
+    # Day-by-day plan for the chosen location; see itinerary.py for its shape
+    itinerary_plan: dict
+    
     # User inputs
     current_location: str     # Destination location (e.g., "Paris, France")
     user_description: str     # User's description of what they're looking for
     
-    # Search results - places found by Google Maps API
-    found_places: Annotated[List[dict], reduce_places]  # [{id, name, lat, lng, rating, price_level, type, address, types}]
+    # Search results - IDs of places found by Google Maps API; the places
+    # themselves are shared records in place_registry (see found_places_of)
+    found_places: Annotated[List[str], reduce_place_ids]
     
     # HITL - Human in the Loop selections
     selected_places: List[str]    # [place_id_1, place_id_2] - IDs selected by user for research
     
     # Research results - detailed information about places
-    researched_places: Annotated[List[dict], reduce_places]  # Detailed research results for selected places
-    researched_places: Annotated[List[dict], reduce_places]  # Detailed research results for selected places
+    # Research results for selected places: {id, report, estimated_cost} (see researched_places_of)
+    researched_places: Annotated[List[dict], reduce_places]
     research_notes: Annotated[List[str], operator.add]           # Summary of research findings
     
     # Workflow management
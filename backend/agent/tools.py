@@ -8,9 +8,19 @@ from langchain_core.tools import InjectedToolCallId
 from langgraph.types import Command
 
 import os
-import requests
 import json
 
+from cache import TTLCache, get_cache_store
+from cassette import cassette_call, request_key
+from coalesce import coalescer
+from normalize import normalize_places
+from place_registry import found_places_of, place_registry
+from relevance import rank_places
+from place_index import get_place_index
+from profiling import profiled
+from runs import emit_event
+import upstream
+
 PRICE_MAP = {
     "PRICE_LEVEL_FREE": 0.0,
     "PRICE_LEVEL_INEXPENSIVE": 100.0,  # e.g., $100/night
@@ -20,6 +30,32 @@ PRICE_MAP = {
     "UNSPECIFIED": 150.0 # Fallback average
 }
 
+# Where search_places looks first: "api" (local index only as offline fallback),
+# "local_first" (API only when the index has too few hits), or "local" (never the API)
+PLACES_BACKEND = os.environ.get("PLACES_BACKEND", "api")
+LOCAL_MIN_RESULTS = int(os.environ.get("PLACES_LOCAL_MIN_RESULTS", 5))
+
+# Text Search paging: results per request (the API allows up to 20) and the cap
+# on places collected across pages for one search
+PLACES_PAGE_SIZE = min(int(os.environ.get("PLACES_PAGE_SIZE", 20)), 20)
+PLACES_MAX_RESULTS = int(os.environ.get("PLACES_MAX_RESULTS", 40))
+
+# Best-matching places named in search_places' reply to the agent
+RELEVANCE_SUMMARY_SIZE = 5
+
+# Lookup caches shared by all sessions (search, research_place and the prefetcher).
+# With CACHE_DB_PATH they persist in SQLite, where the precompute job (main.py) warms them.
+_cache_store = get_cache_store()
+PLACES_CACHE = TTLCache(
+    ttl_seconds=float(os.environ.get("PLACES_CACHE_TTL", 43200)), store=_cache_store, namespace="places"
+)
+WIKIPEDIA_CACHE = TTLCache(
+    ttl_seconds=float(os.environ.get("WIKIPEDIA_CACHE_TTL", 86400)), store=_cache_store, namespace="wikipedia"
+)
+WEATHER_CACHE = TTLCache(
+    ttl_seconds=float(os.environ.get("WEATHER_CACHE_TTL", 1800)), store=_cache_store, namespace="weather"
+)
+
 @tool
 def book_hotel(
     hotel_name: str, 
@@ -67,7 +103,60 @@ def book_hotel(
     )
 
 
+def fetch_places(api_key: str, search_query: str, page_size: int, page_token: str | None = None) -> dict:
+    """Calls the Places Text Search API for one page and returns the raw JSON response."""
+    url = "https://places.googleapis.com/v1/places:searchText"
+    headers = {
+        "Content-Type": "application/json",
+        "X-Goog-Api-Key": api_key,
+        "X-Goog-FieldMask": "places.id,places.displayName,places.priceLevel,places.formattedAddress,places.location,places.rating,places.userRatingCount,places.types,nextPageToken"
+    }
+    payload = {
+        "textQuery": search_query,
+        "pageSize": page_size
+    }
+    if page_token:
+        # Follow-up pages must repeat the original request parameters
+        payload["pageToken"] = page_token
+
+    response = upstream.request("places", "POST", url, headers=headers, json=payload)
+    response.raise_for_status()
+    return response.json()
+
+def _load_place_page(api_key: str, search_query: str, page_size: int, page_token: str | None, cache_key: str) -> dict:
+    data = PLACES_CACHE.get(cache_key)
+    if data is None:
+        # Identical concurrent searches (e.g. many users planning the same city) share one request per page
+        data = coalescer.call("places", cache_key, fetch_places, api_key, search_query, page_size, page_token)
+        PLACES_CACHE.set(cache_key, data)
+    return data
+
+def iter_place_pages(api_key: str, search_query: str, max_results: int = PLACES_MAX_RESULTS):
+    """
+    Yields Places API results page by page, following nextPageToken until
+    `max_results` places were returned or there are no more pages.
+    """
+    page_token = None
+    remaining = max_results
+    while remaining > 0:
+        page_size = min(PLACES_PAGE_SIZE, remaining)
+        # Case and spacing don't change the results, so they don't split the cache either
+        cache_key = f"{' '.join(search_query.casefold().split())}|{page_size}|{page_token or ''}"
+        # Recorded above the cache, so cassettes capture cached pages too
+        data = cassette_call(
+            "places_page", request_key(cache_key), lambda: _load_place_page(api_key, search_query, page_size, page_token, cache_key)
+        )
+        places = data.get("places", [])[:remaining]
+        if not places:
+            return
+        yield places
+        remaining -= len(places)
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            return
+
 @tool
+@profiled("tool:search_places")
 def search_places(
     location: str, 
     place_type: str = "tourist_attraction",
@@ -95,13 +184,6 @@ def search_places(
     api_key = os.environ.get("GOOGLE_MAPS_API_KEY")
     # Note: We continue even if no key, to trigger fallback
     
-    url = "https://places.googleapis.com/v1/places:searchText"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-Api-Key": api_key if api_key else "",
-        "X-Goog-FieldMask": "places.displayName,places.priceLevel,places.formattedAddress,places.location,places.rating,places.userRatingCount,places.types"
-    }
-    
     # Build search query based on user input
     if user_query and user_query.strip():
         # User specified exact place/query
@@ -109,146 +191,201 @@ def search_places(
     else:
         # Search by category
         search_query = f"{place_type} in {location}"
-    
-    payload = {
-        "textQuery": search_query,
-        "maxResultCount": 15  # Increased to get more diverse results
-    }
 
-    data = {}
+    found_places = []
+
+    def add_page(places: list) -> None:
+        # Merge the page and put its markers on the client's map straight away
+        page = [place_registry.intern(record) for record in normalize_places(places)]
+        found_places.extend(page)
+        emit_event({"type": "map_patch", "data": place_registry.hydrate(page)})
+
+    local_places = []
+    index = get_place_index()
+    if index and PLACES_BACKEND in ("local", "local_first"):
+        local_places = index.search(user_query or place_type, location, limit=PLACES_MAX_RESULTS)
+
+    needs_api = PLACES_BACKEND == "api" or (
+        PLACES_BACKEND == "local_first" and len(local_places) < LOCAL_MIN_RESULTS
+    )
+    if local_places and not needs_api:
+        add_page(local_places)
+
     try:
-        if api_key:
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
+        if api_key and needs_api:
+            for places in iter_place_pages(api_key, search_query):
+                add_page(places)
     except Exception as e:
+        # Keep the pages that already arrived
         print(f"API Error: {str(e)}")
-        
-    results = []
-    found_places = []
+
+    # Offline fallback: answer from the local index (or its thin local_first
+    # results) when the API is unavailable
+    if not found_places:
+        if index and PLACES_BACKEND == "api":
+            local_places = index.search(user_query or place_type, location, limit=PLACES_MAX_RESULTS)
+        if local_places:
+            add_page(local_places)
     
     # FALLBACK MOCK DATA
-    if "places" not in data or not data["places"]:
-        print("⚠️ API returned no places. Using MOCK data.")
-        data = {
-            "places": [
-                {
-                    "displayName": {"text": f"Mock {place_type.capitalize()} 1"},
-                    "formattedAddress": f"123 Mock St, {location}",
-                    "rating": 4.5,
-                    "location": {"latitude": 35.6895, "longitude": 139.6917},
-                    "priceLevel": "PRICE_LEVEL_MODERATE"
-                },
-                {
-                    "displayName": {"text": f"Mock {place_type.capitalize()} 2"},
-                    "formattedAddress": f"456 Test Ave, {location}",
-                    "rating": 4.2,
-                    "location": {"latitude": 35.6890, "longitude": 139.7000},
-                    "priceLevel": "PRICE_LEVEL_EXPENSIVE"
-                }
-            ]
-        }
+    if not found_places:
+        print("⚠️ No places found by the API or local index. Using MOCK data.")
+        add_page([
+            {
+                "displayName": {"text": f"Mock {place_type.capitalize()} 1"},
+                "formattedAddress": f"123 Mock St, {location}",
+                "rating": 4.5,
+                "location": {"latitude": 35.6895, "longitude": 139.6917},
+                "priceLevel": "PRICE_LEVEL_MODERATE"
+            },
+            {
+                "displayName": {"text": f"Mock {place_type.capitalize()} 2"},
+                "formattedAddress": f"456 Test Ave, {location}",
+                "rating": 4.2,
+                "location": {"latitude": 35.6890, "longitude": 139.7000},
+                "priceLevel": "PRICE_LEVEL_EXPENSIVE"
+            }
+        ])
 
-    for i, place in enumerate(data["places"]):
-        name = place.get("displayName", {}).get("text", "Unknown")
-        address = place.get("formattedAddress", "Address unknown")
-        rating = place.get("rating", 0.0)
-        price_level = place.get("priceLevel", "UNSPECIFIED")
-        types = place.get("types", [])
-        
-        loc = place.get("location", {})
-        lat = loc.get("latitude", 0.0)
-        lng = loc.get("longitude", 0.0)
-        
-        # Generate unique ID
-        place_id = f"place_{i}_{name.replace(' ', '_').lower()}"
-        
-        # Determine place category from types - more comprehensive categorization
-        place_category = "place"  # default
-        
-        # Check types in order of priority for better categorization
-        if "lodging" in types or "hotel" in types or "motel" in types:
-            place_category = "hotel"
-        elif "restaurant" in types or "cafe" in types or "food" in types or "bar" in types:
-            place_category = "restaurant"
-        elif "museum" in types:
-            place_category = "museum"
-        elif "park" in types or "natural_feature" in types or "campground" in types:
-            place_category = "park"
-        elif "hindu_temple" in types or "church" in types or "mosque" in types or "place_of_worship" in types or "synagogue" in types:
-            place_category = "heritage"
-        elif "locality" in types or "city_hall" in types or "administrative_area_level_1" in types or "political" in types:
-            place_category = "city"
-        elif "landmark" in types:
-            place_category = "landmark"
-        elif "tourist_attraction" in types or "point_of_interest" in types:
-            place_category = "attraction"
-        elif "establishment" in types:
-            # Establishment is too generic, try to find more specific type
-            for t in types:
-                if t not in ["establishment", "point_of_interest"]:
-                    place_category = t.replace("_", " ").title()
-                    break
-        
-        # If still generic, use the first meaningful type from the list
-        if place_category == "place" and types:
-            # Skip generic types
-            for t in types:
-                if t not in ["establishment", "point_of_interest", "geocode"]:
-                    place_category = t.replace("_", " ").title()
-                    break
-        
-        found_places.append({
-            "id": place_id,
-            "name": name,
-            "address": address,
-            "lat": lat,
-            "lng": lng,
-            "rating": rating,
-            "type": place_category,
-            "price_level": price_level,
-            "types": types
-        })
-        
-        results.append(f"- {name} ({rating}★, {place_category}): {address}")
+    # Rank this search's places with the session's earlier ones against what
+    # the user asked for, dropping new ones that don't match it
+    description = (state or {}).get("user_description", "")
+    earlier = (state or {}).get("found_places", [])
+    candidates = place_registry.hydrate(dict.fromkeys(earlier + found_places))
+    ranked = rank_places(description, candidates, keep=set(earlier))
+    ranked_ids = [place["id"] for place, _ in ranked]
+    pruned = set(found_places).difference(ranked_ids, earlier)
+    if pruned:
+        # Their markers went out with the pages; take them off the client's map
+        emit_event({"type": "map_patch", "data": [], "removed": sorted(pruned)})
+    new_count = len([place_id for place_id in ranked_ids if place_id not in earlier])
+
+    summary = f"Found {new_count} {place_type}s in {location}. See map for details."
+    best = [place["name"] for place, score in ranked[:RELEVANCE_SUMMARY_SIZE] if score > 0]
+    if best:
+        summary += f" Best matches for the user's request: {', '.join(best)}."
 
     return Command(
         update={
-            "found_places": found_places,
+            "found_places": ranked_ids,
             "messages": [
                 ToolMessage(
-                    content=f"Found {len(found_places)} {place_type}s in {location}. See map for details.",
+                    content=summary,
                     tool_call_id=tool_call_id
                 )
             ]
         }
     )
 
-@tool
-def get_wikipedia_info(place_name: str) -> str:
+def fetch_wikipedia_info(place_name: str) -> str:
     """
-    Fetch Wikipedia information about a place including historical significance,
-    culture, attractions, and general information.
+    Fetches the Wikipedia summary block for a place.
+    Successful lookups are cached; failures raise so callers can fall back.
     """
-    try:
-        import wikipedia
-        # Search for the place
-        search_results = wikipedia.search(place_name, results=1)
-        if not search_results:
-            return f"No Wikipedia information found for {place_name}"
-        
+    # Recorded above the cache, so cassettes capture lookups the prefetcher already made
+    return cassette_call("wikipedia_info", request_key(place_name), lambda: _cached_wikipedia_info(place_name))
+
+def _cached_wikipedia_info(place_name: str) -> str:
+    cached = WIKIPEDIA_CACHE.get(place_name)
+    if cached is not None:
+        return cached
+    return coalescer.call("wikipedia", place_name, _load_wikipedia_info, place_name)
+
+def _load_wikipedia_info(place_name: str) -> str:
+    info = upstream.call("wikipedia", _lookup_wikipedia, place_name)
+    WIKIPEDIA_CACHE.set(place_name, info)
+    return info
+
+def _lookup_wikipedia(place_name: str) -> str:
+    import wikipedia
+    # Search for the place
+    search_results = wikipedia.search(place_name, results=1)
+    if not search_results:
+        info = f"No Wikipedia information found for {place_name}"
+    else:
         # Get the page summary
         page = wikipedia.page(search_results[0], auto_suggest=False)
         summary = wikipedia.summary(search_results[0], sentences=5, auto_suggest=False)
-        
-        return f"""
+
+        info = f"""
 **Wikipedia Information for {place_name}:**
 
 {summary}
 
 **Full Article**: {page.url}
 """
+    return info
+
+def fetch_weather_info(location: str) -> str:
+    """
+    Fetches current weather for a location from wttr.in.
+    Successful lookups are cached; failures raise so callers can fall back.
+    """
+    return cassette_call("weather_info", request_key(location), lambda: _cached_weather_info(location))
+
+def _cached_weather_info(location: str) -> str:
+    cached = WEATHER_CACHE.get(location)
+    if cached is not None:
+        return cached
+    return coalescer.call("weather", location, _load_weather_info, location)
+
+def _load_weather_info(location: str) -> str:
+    # Use wttr.in which doesn't require an API key
+    url = f"https://wttr.in/{location}?format=j1"
+    response = upstream.request("weather", "GET", url, timeout=5)
+
+    if response.status_code != 200:
+        raise Exception("API request failed")
+
+    data = response.json()
+    current = data['current_condition'][0]
+
+    info = f"""
+**Weather in {location}:**
+- Temperature: {current['temp_C']}°C ({current['temp_F']}°F)
+- Condition: {current['weatherDesc'][0]['value']}
+- Humidity: {current['humidity']}%
+- Wind: {current['windspeedKmph']} km/h
+- Feels Like: {current['FeelsLikeC']}°C
+"""
+
+    WEATHER_CACHE.set(location, info)
+    return info
+
+def weather_location_for(place_name: str) -> str:
+    """Extracts the location used for weather lookups from a place name."""
+    return place_name.split(',')[0] if ',' in place_name else place_name
+
+def warm_place_research(place: dict) -> None:
+    """
+    Pre-fetches the enrichment data research_place needs for a place,
+    so a later research call is served from cache. Errors are ignored.
+    """
+    place_name = place.get("name")
+    if not place_name:
+        return
+    try:
+        fetch_wikipedia_info(place_name)
+    except Exception as e:
+        print(f"Prefetch Wikipedia error for {place_name}: {e}")
+    try:
+        fetch_weather_info(weather_location_for(place_name))
+    except Exception as e:
+        print(f"Prefetch weather error for {place_name}: {e}")
+
+@tool
+def get_wikipedia_info(place_name: str) -> str:
+    """
+    Fetch Wikipedia information about a place including historical significance,
+    culture, attractions, and general information.
+    """
+    try:
+        return fetch_wikipedia_info(place_name)
     except Exception as e:
+        # Out of time or unavailable: an older cached summary still beats the stub
+        stale = WIKIPEDIA_CACHE.get_stale(place_name)
+        if stale is not None:
+            return stale
         # Fallback for when Wikipedia API is not available or errors
         return f"""
 **Wikipedia Information for {place_name}:**
@@ -266,26 +403,12 @@ def get_weather_info(location: str) -> str:
     Uses wttr.in free weather API.
     """
     try:
-        import requests
-        # Use wttr.in which doesn't require an API key
-        url = f"https://wttr.in/{location}?format=j1"
-        response = requests.get(url, timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
-            current = data['current_condition'][0]
-            
-            return f"""
-**Weather in {location}:**
-- Temperature: {current['temp_C']}°C ({current['temp_F']}°F)
-- Condition: {current['weatherDesc'][0]['value']}
-- Humidity: {current['humidity']}%
-- Wind: {current['windspeedKmph']} km/h
-- Feels Like: {current['FeelsLikeC']}°C
-"""
-        else:
-            raise Exception("API request failed")
+        return fetch_weather_info(location)
     except Exception as e:
+        # Out of time or unavailable: answer with the last weather we saw
+        stale = WEATHER_CACHE.get_stale(location)
+        if stale is not None:
+            return stale.replace(f"**Weather in {location}:**", f"**Weather in {location} (cached):**", 1)
         # Fallback weather info
         return f"""
 **Weather in {location}:**
@@ -295,6 +418,7 @@ def get_weather_info(location: str) -> str:
 """
 
 @tool
+@profiled("tool:research_place")
 def research_place(
     place_id: str,
     state: Annotated[dict, InjectedState],
@@ -310,7 +434,7 @@ def research_place(
     
     Looks up the place from found_places using the place_id.
     """
-    found_places = state.get("found_places", [])
+    found_places = found_places_of(state)
     
     # Debug logging
     print(f"🔍 Research requested for place_id: {place_id}")
@@ -361,7 +485,7 @@ def research_place(
     wiki_info = get_wikipedia_info.invoke(place_name)
     
     # Get weather info (extract city from place name or address)
-    location_for_weather = place_name.split(',')[0] if ',' in place_name else place_name
+    location_for_weather = weather_location_for(place_name)
     weather_info = get_weather_info.invoke(location_for_weather)
     
     # Build comprehensive research report
@@ -390,17 +514,11 @@ def research_place(
 **Estimated Visit Cost**: ${PRICE_MAP.get(place.get('price_level', 'UNSPECIFIED'), 150)}
 """
     
-    # Add to researched_places
+    # Add to researched_places; the place fields stay in the shared record
     new_researched_place = {
         "id": place_id,
-        "name": place_name,
-        "type": place_type,
-        "address": address,
-        "rating": rating,
         "report": research_report,
         "estimated_cost": PRICE_MAP.get(place.get('price_level', 'UNSPECIFIED'), 150),
-        "lat": place.get("lat", 0),
-        "lng": place.get("lng", 0)
     }
     
     return Command(
@@ -0,0 +1,131 @@
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from cassette import cassette_call, request_key
+from deadlines import DEFAULT_HTTP_TIMEOUT, HTTP_SHARE, step_timeout
+from ratelimit import GOVERNORS
+from runs import check_cancelled, run_with_timeout
+
+# Attempts per call when the upstream answers 429
+MAX_THROTTLE_RETRIES = 3
+
+# Backoff used when a 429 carries no usable Retry-After hint
+DEFAULT_RETRY_AFTER = 2.0
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parses a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_from_error(error: BaseException) -> float | None:
+    """
+    Returns the back-off requested by a rate-limited model call, or None if
+    the error is not a rate limit. Looks through the exception chain for a
+    Retry-After header or a google.rpc.RetryInfo retryDelay.
+    """
+    current = error
+    is_rate_limit = False
+    while current is not None:
+        if getattr(current, "code", None) == 429 or "RateLimit" in type(current).__name__:
+            is_rate_limit = True
+        response = getattr(current, "response", None)
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            delay = parse_retry_after(headers.get("Retry-After"))
+            if delay is not None:
+                return delay
+        match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(getattr(current, "details", "") or current))
+        if match:
+            return float(match.group(1))
+        current = current.__cause__
+    return DEFAULT_RETRY_AFTER if is_rate_limit else None
+
+
+def acquire(upstream: str, default_timeout: float | None = DEFAULT_HTTP_TIMEOUT) -> float:
+    """
+    Waits for a rate-limit token, bailing out if the current run is
+    cancelled before or while it waits in the queue, or with
+    UpstreamTimeout once the call's share of the deadline is used up.
+    """
+    check_cancelled(upstream)
+    waited = GOVERNORS[upstream].acquire(timeout=step_timeout(default_timeout, HTTP_SHARE))
+    check_cancelled(upstream)
+    return waited
+
+
+def call(upstream: str, fn, *args, **kwargs):
+    """
+    Runs a blocking client-library call (e.g. wikipedia) through the
+    upstream's governor, within its share of the request's deadline.
+    """
+    def send():
+        acquire(upstream)
+        return run_with_timeout(upstream, step_timeout(DEFAULT_HTTP_TIMEOUT, HTTP_SHARE), fn, *args, **kwargs)
+
+    return cassette_call(upstream, request_key(fn.__name__, args, kwargs), send)
+
+
+def request(upstream: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Sends an HTTP request through the upstream's rate-limit governor.
+    A 429 pauses the governor for the Retry-After period before retrying,
+    so every session backs off together instead of hammering the quota.
+    If the current run is cancelled, the caller is released immediately.
+    Requests time out after DEFAULT_HTTP_TIMEOUT (or the given `timeout`),
+    capped at their share of the time left before the request's deadline.
+    """
+    key = request_key(method, url, kwargs.get("params"), kwargs.get("json"))
+    return cassette_call(
+        f"http:{upstream}", key, lambda: _send(upstream, method, url, **kwargs), _encode_response, _decode_response
+    )
+
+
+def _send(upstream: str, method: str, url: str, **kwargs) -> requests.Response:
+    governor = GOVERNORS[upstream]
+    default_timeout = kwargs.pop("timeout", DEFAULT_HTTP_TIMEOUT)
+    for attempt in range(MAX_THROTTLE_RETRIES):
+        acquire(upstream, default_timeout)
+        # Computed per attempt: waiting for the governor used up some of the budget
+        timeout = step_timeout(default_timeout, HTTP_SHARE)
+        response = run_with_timeout(upstream, timeout, requests.request, method, url, timeout=timeout, **kwargs)
+        if response.status_code != 429:
+            return response
+
+        delay = parse_retry_after(response.headers.get("Retry-After"))
+        governor.pause_for(delay if delay is not None else DEFAULT_RETRY_AFTER * (attempt + 1))
+    return response
+
+
+def _encode_response(response: requests.Response) -> dict:
+    # Only the parts callers read are recorded; request headers (API keys) never are
+    return {
+        "status": response.status_code,
+        "url": response.url,
+        "content_type": response.headers.get("Content-Type", ""),
+        "body": response.text,
+    }
+
+
+def _decode_response(data: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = data["status"]
+    response.url = data["url"]
+    response.headers = CaseInsensitiveDict({"Content-Type": data["content_type"]})
+    response.encoding = "utf-8"
+    response._content = data["body"].encode("utf-8")
+    return response
@@ -0,0 +1,105 @@
+"""
+Compares checkpoint serializers on a synthetic long session: size, and
+encode/decode time per checkpoint. Each state channel is serialized on its
+own, as the checkpointer stores them.
+
+    python benchmarks/bench_checkpoint_serde.py
+    python benchmarks/bench_checkpoint_serde.py --turns 60 --places 40 --researched 8
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent"))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage  # noqa: E402
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer  # noqa: E402
+
+from serializer import CompactSerializer, zstandard  # noqa: E402
+
+WORDS = (
+    "museum park tour local cuisine hotel budget history cathedral river walk market evening "
+    "tickets morning transport metro view garden gallery lunch dinner square palace"
+).split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def build_state(turns: int, places: int, researched: int, rng: random.Random) -> dict:
+    place_ids = [f"place_place_{i}_{rng.getrandbits(32):08x}" for i in range(places)]
+    reports = {
+        place_id: f"### Research Report: Place {i}\n\n" + "\n".join(sentence(rng, 14) for _ in range(25))
+        for i, place_id in enumerate(place_ids[:researched])
+    }
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(content=sentence(rng, 12), id=f"h{turn}"))
+        call_id = f"call_{turn}"
+        place_id = rng.choice(place_ids)
+        messages.append(AIMessage(
+            content="",
+            id=f"a{turn}",
+            tool_calls=[{"name": "research_place", "args": {"place_id": place_id}, "id": call_id}],
+            response_metadata={"model_name": "gemini-2.0-flash", "finish_reason": "STOP"},
+            usage_metadata={"input_tokens": 1200, "output_tokens": 80, "total_tokens": 1280},
+        ))
+        messages.append(ToolMessage(content=reports.get(place_id, sentence(rng, 20)), tool_call_id=call_id, id=f"t{turn}"))
+        messages.append(AIMessage(content="\n".join(sentence(rng, 16) for _ in range(6)), id=f"r{turn}"))
+    return {
+        "messages": messages,
+        "total_budget": 5000.0,
+        "remaining_budget": 3200.0,
+        "itinerary": [{"name": "Hotel", "cost": 800.0, "type": "hotel", "status": "pending"}],
+        "current_location": "Paris, France",
+        "user_description": "art museums, good food and a walkable neighbourhood",
+        "found_places": place_ids,
+        "selected_places": place_ids[:researched],
+        "researched_places": [
+            {"id": place_id, "report": report, "estimated_cost": 150.0} for place_id, report in reports.items()
+        ],
+        "research_notes": list(reports.values()),
+        "workflow_stage": "choose_locations",
+        "next": "Supervisor",
+    }
+
+
+def measure(serde, state: dict, rounds: int) -> tuple:
+    blobs = {}
+    started = time.perf_counter()
+    for _ in range(rounds):
+        blobs = {channel: serde.dumps_typed(value) for channel, value in state.items()}
+    encode = (time.perf_counter() - started) / rounds
+    started = time.perf_counter()
+    for _ in range(rounds):
+        decoded = {channel: serde.loads_typed(blob) for channel, blob in blobs.items()}
+    decode = (time.perf_counter() - started) / rounds
+    assert decoded == state, "round trip changed the state"
+    return sum(len(data) for _, data in blobs.values()), encode, decode
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark checkpoint serializers.")
+    parser.add_argument("--turns", type=int, default=30, help="Conversation turns (4 messages each)")
+    parser.add_argument("--places", type=int, default=40)
+    parser.add_argument("--researched", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    state = build_state(args.turns, args.places, args.researched, random.Random(args.seed))
+    serializers = [("jsonplus (default)", JsonPlusSerializer()), ("compact, no compression", CompactSerializer("none")),
+                   ("compact + zlib", CompactSerializer("zlib"))]
+    if zstandard is not None:
+        serializers.append(("compact + zstd", CompactSerializer("zstd")))
+
+    print(f"{len(state['messages'])} messages, {args.places} places, {args.researched} researched\n")
+    print(f"{'serializer':<26} {'size':>10} {'encode':>10} {'decode':>10}")
+    baseline = None
+    for name, serde in serializers:
+        size, encode, decode = measure(serde, state, args.rounds)
+        baseline = baseline or size
+        print(f"{name:<26} {size / 1024:8.1f}KB {encode * 1000:8.2f}ms {decode * 1000:8.2f}ms   ({size / baseline:.0%} of current)")
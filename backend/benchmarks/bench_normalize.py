@@ -0,0 +1,138 @@
+"""
+Per-place cost of place normalization, on the two paths that normalize in
+bulk: Places API pages in search_places, and dump entries imported into the
+local place index. Uses synthetic data, so it needs no keys or network.
+
+    python benchmarks/bench_normalize.py --places 50000
+    python benchmarks/bench_normalize.py --places 50000 --with-db   # include the SQLite import
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent"))
+
+from normalize import categorize_place, normalize_places  # noqa: E402
+from place_index import OSM_TAG_TYPES, PlaceIndex, record_from_feature  # noqa: E402
+from place_registry import PlaceRegistry  # noqa: E402
+
+# Types as they show up in Places responses: a specific type or two, then generic ones
+SPECIFIC_TYPES = [
+    "lodging", "restaurant", "cafe", "museum", "park", "church", "hindu_temple", "zoo",
+    "art_gallery", "amusement_park", "shopping_mall", "aquarium", "bakery", "locality",
+    "tourist_attraction", "landmark", "night_club", "stadium", "library", "spa",
+]
+GENERIC_TYPES = ["point_of_interest", "establishment", "geocode", "food", "political"]
+PRICE_LEVELS = ["PRICE_LEVEL_INEXPENSIVE", "PRICE_LEVEL_MODERATE", "PRICE_LEVEL_EXPENSIVE", "UNSPECIFIED"]
+
+
+def legacy_categorize(types: list) -> str:
+    """The if/elif membership chain categorize_place replaced, for comparison."""
+    place_category = "place"
+    if "lodging" in types or "hotel" in types or "motel" in types:
+        place_category = "hotel"
+    elif "restaurant" in types or "cafe" in types or "food" in types or "bar" in types:
+        place_category = "restaurant"
+    elif "museum" in types:
+        place_category = "museum"
+    elif "park" in types or "natural_feature" in types or "campground" in types:
+        place_category = "park"
+    elif "hindu_temple" in types or "church" in types or "mosque" in types or "place_of_worship" in types or "synagogue" in types:
+        place_category = "heritage"
+    elif "locality" in types or "city_hall" in types or "administrative_area_level_1" in types or "political" in types:
+        place_category = "city"
+    elif "landmark" in types:
+        place_category = "landmark"
+    elif "tourist_attraction" in types or "point_of_interest" in types:
+        place_category = "attraction"
+    elif "establishment" in types:
+        for t in types:
+            if t not in ["establishment", "point_of_interest"]:
+                place_category = t.replace("_", " ").title()
+                break
+    if place_category == "place" and types:
+        for t in types:
+            if t not in ["establishment", "point_of_interest", "geocode"]:
+                place_category = t.replace("_", " ").title()
+                break
+    return place_category
+
+
+def api_places(count: int, rng: random.Random) -> list:
+    return [
+        {
+            "id": f"ChIJ{i:012d}",
+            "displayName": {"text": f"Place {i}"},
+            "formattedAddress": f"{i} Rue Example, Paris",
+            "location": {"latitude": 48.8 + rng.random() / 10, "longitude": 2.3 + rng.random() / 10},
+            "rating": round(rng.uniform(3, 5), 1),
+            "priceLevel": rng.choice(PRICE_LEVELS),
+            "types": rng.sample(SPECIFIC_TYPES, rng.randint(0, 2)) + rng.sample(GENERIC_TYPES, rng.randint(1, 3)),
+        }
+        for i in range(count)
+    ]
+
+
+def dump_features(count: int, rng: random.Random) -> list:
+    tags = list(OSM_TAG_TYPES)
+    features = []
+    for i in range(count):
+        properties = {"name": f"Place {i}", "addr:street": "Rue Example", "addr:city": "Paris"}
+        for key, value in rng.sample(tags, rng.randint(1, 2)):
+            properties[key] = value or "yes"
+        features.append({
+            "type": "Feature",
+            "properties": properties,
+            "geometry": {"type": "Point", "coordinates": [2.3 + rng.random() / 10, 48.8 + rng.random() / 10]},
+        })
+    return features
+
+
+def timed(label: str, count: int, fn) -> float:
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<42} {elapsed * 1e6 / count:8.2f} µs/place   ({count / elapsed:,.0f} places/s)")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark place normalization.")
+    parser.add_argument("--places", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=20, help="Places per API page")
+    parser.add_argument("--with-db", action="store_true", help="Also time importing the dump into a place index")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    places = api_places(args.places, rng)
+    features = dump_features(args.places, rng)
+    type_lists = [place["types"] for place in places]
+    mismatches = sum(legacy_categorize(types) != categorize_place(types) for types in type_lists)
+    print(f"{args.places} places; {mismatches} categorized differently from the legacy chain\n")
+
+    print("Categorization")
+    timed("  legacy if/elif chain", args.places, lambda: [legacy_categorize(t) for t in type_lists])
+    timed("  type -> category table", args.places, lambda: [categorize_place(t) for t in type_lists])
+
+    print("API path (search_places)")
+    pages = [places[i : i + args.page_size] for i in range(0, len(places), args.page_size)]
+    timed("  normalize_places", args.places, lambda: [normalize_places(page) for page in pages])
+    registry = PlaceRegistry()
+    timed("  normalize_places + intern", args.places, lambda: [
+        [registry.intern(record) for record in normalize_places(page)] for page in pages
+    ])
+    timed("  intern again (all already held)", args.places, lambda: [
+        [registry.intern(record) for record in normalize_places(page)] for page in pages
+    ])
+
+    print("Bulk import path (place_index.py import)")
+    records = []
+    timed("  record_from_feature", args.places, lambda: records.extend(map(record_from_feature, features)))
+    if args.with_db:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = PlaceIndex(os.path.join(tmp, "places.db"))
+            timed("  import_records (SQLite + FTS rebuild)", args.places, lambda: index.import_records(records))
@@ -7,11 +7,27 @@ type ItineraryItem = {
   status: string;
 };
 
+type ItineraryDay = {
+  id: string;
+  day: number;
+  title: string;
+  accommodation: string;
+  cost: number;
+  slots: { time: string; activity: string; place: string; cost: number; notes: string }[];
+};
+
+type ItineraryPlan = {
+  summary: string;
+  days: ItineraryDay[];
+  totalCost: number;
+};
+
 type StreamState = {
   messages: { role: string; content: string }[];
   totalBudget: number;
   remainingBudget: number;
   itinerary: ItineraryItem[];
+  itineraryPlan: ItineraryPlan | null;
   foundPlaces: any[];
   researchedPlaces: any[];
   workflowStage: string;
@@ -20,12 +36,15 @@ type StreamState = {
   isPaused: boolean;
 };
 
+const MAX_RECONNECT_ATTEMPTS = 3;
+
 export function useTripStream() {
   const [state, setState] = useState<StreamState>({
     messages: [],
     totalBudget: 0,
     remainingBudget: 0,
     itinerary: [],
+    itineraryPlan: null,
     foundPlaces: [],
     researchedPlaces: [],
     workflowStage: "initial",
@@ -35,6 +54,9 @@ export function useTripStream() {
   });
 
   const abortControllerRef = useRef<AbortController | null>(null);
+  // Where to pick the stream up again if the connection drops
+  const threadIdRef = useRef<string | null>(null);
+  const lastEventIdRef = useRef(0);
 
   const processStream = async (response: Response) => {
     if (!response.ok) {
@@ -52,35 +74,44 @@ export function useTripStream() {
         if (done) break;
 
         buffer += decoder.decode(value, { stream: true });
-        const lines = buffer.split("\n\n");
+        const blocks = buffer.split("\n\n");
 
-        // Keep the last incomplete line in the buffer
-        buffer = lines.pop() || "";
+        // Keep the last incomplete event in the buffer
+        buffer = blocks.pop() || "";
 
-        for (const line of lines) {
-          if (line.startsWith("data: ")) {
-            const jsonStr = line.replace("data: ", "").trim();
-            if (jsonStr === "[DONE]") {
-              return;
+        for (const block of blocks) {
+          let jsonStr: string | null = null;
+          for (const line of block.split("\n")) {
+            if (line.startsWith("id: ")) {
+              lastEventIdRef.current = Number(line.slice(4));
+            } else if (line.startsWith("data: ")) {
+              jsonStr = line.replace("data: ", "").trim();
             }
+          }
+          if (jsonStr === null) continue;
+          if (jsonStr === "[DONE]") {
+            return;
+          }
 
-            try {
-              const payload = JSON.parse(jsonStr);
-              if (payload.type === "error") {
-                console.error("Server error:", payload.data);
-                setState((prev) => ({
-                  ...prev,
-                  messages: [
-                    ...prev.messages,
-                    { role: "error", content: `Error: ${payload.data}` },
-                  ],
-                }));
-              } else {
-                handleEvent(payload);
-              }
-            } catch (e) {
-              console.error("Failed to parse chunk", jsonStr, e);
+          try {
+            const payload = JSON.parse(jsonStr);
+            if (payload.type === "error") {
+              console.error("Server error:", payload.data);
+              setState((prev) => ({
+                ...prev,
+                messages: [
+                  ...prev.messages,
+                  { role: "error", content: `Error: ${payload.data}` },
+                ],
+              }));
+            } else if (payload.type === "resync") {
+              // Some missed events are gone from the server's replay buffer
+              await loadSnapshot(payload.thread_id);
+            } else {
+              handleEvent(payload);
             }
+          } catch (e) {
+            console.error("Failed to parse chunk", jsonStr, e);
           }
         }
       }
@@ -90,6 +121,61 @@ export function useTripStream() {
     }
   };
 
+  const loadSnapshot = async (threadId: string) => {
+    const response = await fetch(`http://localhost:8000/api/state/${threadId}`);
+    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+    const snapshot = await response.json();
+    lastEventIdRef.current = Math.max(lastEventIdRef.current, snapshot.last_event_id);
+    setState((prev) => ({
+      ...prev,
+      messages: snapshot.messages,
+      totalBudget: snapshot.total_budget,
+      remainingBudget: snapshot.remaining_budget,
+      itinerary: snapshot.itinerary,
+      itineraryPlan: snapshot.itinerary_plan?.days
+        ? {
+            summary: snapshot.itinerary_plan.summary,
+            days: snapshot.itinerary_plan.days,
+            totalCost: snapshot.itinerary_plan.total_cost,
+          }
+        : null,
+      foundPlaces: snapshot.found_places,
+      researchedPlaces: snapshot.researched_places,
+      workflowStage: snapshot.workflow_stage,
+      isPaused: snapshot.next.length > 0,
+    }));
+  };
+
+  // Replays the events missed while the connection was down; never re-runs agents
+  const reconnect = async (error: any) => {
+    for (let attempt = 1; attempt <= MAX_RECONNECT_ATTEMPTS; attempt++) {
+      const threadId = threadIdRef.current;
+      if (!threadId || abortControllerRef.current?.signal.aborted) throw error;
+      await new Promise((resolve) => setTimeout(resolve, attempt * 1000));
+      try {
+        const response = await fetch(`http://localhost:8000/api/stream/${threadId}`, {
+          headers: { "Last-Event-ID": String(lastEventIdRef.current) },
+          signal: abortControllerRef.current?.signal,
+        });
+        await processStream(response);
+        return;
+      } catch (err: any) {
+        if (err.name === "AbortError") throw err;
+        error = err;
+      }
+    }
+    throw error;
+  };
+
+  const streamWithReconnect = async (request: () => Promise<Response>) => {
+    try {
+      await processStream(await request());
+    } catch (err: any) {
+      if (err.name === "AbortError" || !threadIdRef.current) throw err;
+      await reconnect(err);
+    }
+  };
+
   const startStream = async (
     query: string,
     budget: number,
@@ -101,6 +187,7 @@ export function useTripStream() {
       totalBudget: budget,
       remainingBudget: budget,
       itinerary: [],
+      itineraryPlan: null,
       foundPlaces: [],
       researchedPlaces: [],
       workflowStage: "search",
@@ -110,15 +197,19 @@ export function useTripStream() {
     });
 
     abortControllerRef.current = new AbortController();
+    threadIdRef.current = null;
+    lastEventIdRef.current = 0;
+    const signal = abortControllerRef.current.signal;
 
     try {
-      const response = await fetch("http://localhost:8000/api/plan", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ query, budget, location, description }),
-        signal: abortControllerRef.current.signal,
-      });
-      await processStream(response);
+      await streamWithReconnect(() =>
+        fetch("http://localhost:8000/api/plan", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ query, budget, location, description }),
+          signal,
+        })
+      );
     } catch (err: any) {
       if (err.name !== "AbortError") console.error("Stream error:", err);
     } finally {
@@ -135,20 +226,22 @@ export function useTripStream() {
 
     setState((prev) => ({ ...prev, isLoading: true, isPaused: false }));
     abortControllerRef.current = new AbortController();
+    const signal = abortControllerRef.current.signal;
 
     try {
-      const response = await fetch("http://localhost:8000/api/resume", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-          thread_id: state.threadId,
-          selected_places: selectedPlaces,
-          action: action,
-          message: message,
-        }),
-        signal: abortControllerRef.current.signal,
-      });
-      await processStream(response);
+      await streamWithReconnect(() =>
+        fetch("http://localhost:8000/api/resume", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({
+            thread_id: state.threadId,
+            selected_places: selectedPlaces,
+            action: action,
+            message: message,
+          }),
+          signal,
+        })
+      );
     } catch (err: any) {
       if (err.name !== "AbortError") console.error("Resume error:", err);
     } finally {
@@ -157,6 +250,7 @@ export function useTripStream() {
   };
 
   const handleEvent = (payload: any) => {
+    if (payload.type === "meta") threadIdRef.current = payload.thread_id;
     setState((prev) => {
       if (payload.type === "meta") {
         return { ...prev, threadId: payload.thread_id };
@@ -185,6 +279,38 @@ export function useTripStream() {
           foundPlaces: payload.data,
         };
       }
+      if (payload.type === "map_patch") {
+        // A page of search results arrived mid-step: merge it by id,
+        // and drop places the search pruned as irrelevant
+        const patchIds = new Set(payload.data.map((place: any) => place.id));
+        const removed = new Set<string>(payload.removed ?? []);
+        return {
+          ...prev,
+          foundPlaces: [
+            ...prev.foundPlaces.filter((place) => !patchIds.has(place.id) && !removed.has(place.id)),
+            ...payload.data,
+          ],
+        };
+      }
+      if (payload.type === "itinerary_patch") {
+        // Only changed days are sent; the rest are kept and re-ordered
+        const patch = payload.data;
+        const days = new Map<string, ItineraryDay>(
+          patch.replace ? [] : (prev.itineraryPlan?.days ?? []).map((d) => [d.id, d])
+        );
+        patch.removed.forEach((id: string) => days.delete(id));
+        patch.days.forEach((d: ItineraryDay) => days.set(d.id, d));
+        return {
+          ...prev,
+          itineraryPlan: {
+            summary: patch.summary ?? prev.itineraryPlan?.summary ?? "",
+            days: patch.order
+              .filter((id: string) => days.has(id))
+              .map((id: string, i: number) => ({ ...days.get(id)!, day: i + 1 })),
+            totalCost: patch.total_cost,
+          },
+        };
+      }
       if (payload.type === "research_update") {
         return {
           ...prev,